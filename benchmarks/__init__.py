@@ -0,0 +1,14 @@
+"""
+Benchmarks for sparkle.
+
+The grammars module has representative scanners and parsers, the
+inputs module generates source text for them at any scale, and the
+run module times them and tracks the results against a baseline:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json
+
+The other modules are standalone scripts comparing the engines of the
+scanner and parser, the ways rules can make tokens, and the memory
+used by tokens.
+"""
@@ -0,0 +1,282 @@
+"""
+Representative scanners and parsers for the benchmarks.
+
+Each language has a scanner and a parser: arithmetic expressions (with
+an unambiguous and a highly ambiguous grammar), JSON, INI-style config
+files, and lists of words with left and right recursive grammars.
+"""
+from sparkle import *
+
+# ..........................................................................
+# Arithmetic expressions
+
+class ExpressionScanner(TokenizingScanner):
+    """
+    Numbers, names and arithmetic operators, separated by spaces.
+    """
+    @rule(r'[0-9]+')
+    @generate_token('NUMBER')
+    def t_number(self, token, string, position):
+        return int(token)
+
+    @rule(r'[A-Za-z_][A-Za-z0-9_]*')
+    @generate_token('NAME')
+    def t_name(self, token, string, position):
+        return token
+
+    @rule(r'[-+*/()]')
+    def t_operator(self, token, string, position):
+        self.tokens.append(Token(token, token, position))
+
+    @rule(r'[ \t\n]+')
+    def t_whitespace(self, token, string, position):
+        pass
+
+class ExpressionParser(GenericParser):
+    """
+    A left-recursive, unambiguous arithmetic grammar.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'expr')
+
+    @rule('expr ::= expr + term  expr ::= expr - term')
+    def p_expr_binary(self, args):
+        return (args[1].token_type, args[0], args[2])
+
+    @rule('expr ::= term  term ::= factor')
+    def p_single(self, args):
+        return args[0]
+
+    @rule('term ::= term * factor  term ::= term / factor')
+    def p_term_binary(self, args):
+        return (args[1].token_type, args[0], args[2])
+
+    @rule('factor ::= NUMBER  factor ::= NAME')
+    def p_factor_atom(self, args):
+        return args[0].value
+
+    @rule('factor ::= ( expr )  factor ::= - factor')
+    def p_factor_compound(self, args):
+        return args[len(args) // 2]
+
+class AmbiguousParser(GenericParser):
+    """
+    An ambiguous arithmetic grammar, resolved by the default rules.
+    Parsing takes time cubic in the length of the input, so only short
+    inputs are practical.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'expr')
+
+    @rule('expr ::= expr + expr  expr ::= expr * expr')
+    def p_expr_binary(self, args):
+        return (args[1].token_type, args[0], args[2])
+
+    @rule('expr ::= NUMBER')
+    def p_expr_number(self, args):
+        return args[0].value
+
+# ..........................................................................
+# JSON
+
+class JSONScanner(TokenizingScanner):
+    """
+    The tokens of JSON. String escapes are left as they are.
+    """
+    @rule(r'"([^"\\\n]|\\.)*"')
+    @generate_token('STRING')
+    def t_string(self, token, string, position):
+        return token[1:-1]
+
+    @rule(r'-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+    @generate_token('NUMBER')
+    def t_number(self, token, string, position):
+        return float(token)
+
+    @rule(r'true|false|null|[{}\[\],:]')
+    def t_symbol(self, token, string, position):
+        self.tokens.append(Token(token, token, position))
+
+    @rule(r'[ \t\r\n]+')
+    def t_whitespace(self, token, string, position):
+        pass
+
+class JSONParser(GenericParser):
+    """
+    Builds the Python value of a JSON document.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'value')
+
+    @rule('value ::= object  value ::= array')
+    def p_value_compound(self, args):
+        return args[0]
+
+    @rule('value ::= STRING  value ::= NUMBER')
+    def p_value_atom(self, args):
+        return args[0].value
+
+    @rule('value ::= true  value ::= false  value ::= null')
+    def p_value_constant(self, args):
+        return _CONSTANTS[args[0].token_type]
+
+    @rule('object ::= { }')
+    def p_object_empty(self, args):
+        return {}
+
+    @rule('object ::= { members }')
+    def p_object(self, args):
+        return dict(args[1])
+
+    @rule('array ::= [ ]')
+    def p_array_empty(self, args):
+        return []
+
+    @rule('array ::= [ elements ]')
+    def p_array(self, args):
+        return args[1]
+
+    @rule('members ::= pair  elements ::= value')
+    def p_sequence_first(self, args):
+        return [args[0]]
+
+    @rule('members ::= members , pair  elements ::= elements , value')
+    def p_sequence_more(self, args):
+        args[0].append(args[2])
+        return args[0]
+
+    @rule('pair ::= STRING : value')
+    def p_pair(self, args):
+        return args[0].value, args[2]
+
+_CONSTANTS = {'true': True, 'false': False, 'null': None}
+
+# ..........................................................................
+# INI-style config files
+
+class ConfigScanner(GenericScanner):
+    """
+    The tokens of an INI-style config file, where line ends matter.
+    This scanner is built on GenericScanner itself, and keeps its own
+    list of tokens.
+    """
+    def tokenize(self, src_string):
+        self.tokens = []
+        GenericScanner.tokenize(self, src_string)
+        return self.tokens
+
+    @rule(r'\[[^\]\n]*\]')
+    def t_section(self, token, string, position):
+        self.tokens.append(Token('SECTION', token[1:-1].strip(), position))
+
+    @rule(r'[A-Za-z_][A-Za-z0-9_.]*')
+    def t_name(self, token, string, position):
+        self.tokens.append(Token('NAME', token, position))
+
+    @rule(r'[0-9]+')
+    def t_number(self, token, string, position):
+        self.tokens.append(Token('NUMBER', int(token), position))
+
+    @rule(r'"[^"\n]*"')
+    def t_string(self, token, string, position):
+        self.tokens.append(Token('STRING', token[1:-1], position))
+
+    @rule(r'=')
+    def t_equals(self, token, string, position):
+        self.tokens.append(Token('=', token, position))
+
+    @rule(r'\n')
+    def t_newline(self, token, string, position):
+        self.tokens.append(Token('NEWLINE', token, position))
+
+    @rule(r'[ \t\r]+|[;#][^\n]*')
+    def t_ignored(self, token, string, position):
+        pass
+
+class ConfigParser(GenericParser):
+    """
+    Builds a map from each section name to a map of its settings.
+    Settings before the first section are in the section ''.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'config')
+
+    @rule('config ::= lines')
+    def p_config(self, args):
+        sections = {'': {}}
+        current = sections['']
+        for line in args[0]:
+            if len(line) == 1:
+                current = sections.setdefault(line[0], {})
+            else:
+                current[line[0]] = line[1]
+        return sections
+
+    @rule('lines ::= ')
+    def p_lines_empty(self, args):
+        return []
+
+    @rule('lines ::= lines line')
+    def p_lines(self, args):
+        if args[1] is not None:
+            args[0].append(args[1])
+        return args[0]
+
+    @rule('line ::= SECTION NEWLINE')
+    def p_line_section(self, args):
+        return (args[0].value,)
+
+    @rule('line ::= NAME = value NEWLINE')
+    def p_line_setting(self, args):
+        return args[0].value, args[2]
+
+    @rule('line ::= NEWLINE')
+    def p_line_blank(self, args):
+        return None
+
+    @rule('value ::= NAME  value ::= NUMBER  value ::= STRING')
+    def p_value(self, args):
+        return args[0].value
+
+# ..........................................................................
+# Lists of words, scanned by ExpressionScanner
+
+class LeftListParser(GenericParser):
+    """
+    A left-recursive list, which Earley parsers handle in constant
+    space per token.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'list')
+
+    @rule('list ::= list item')
+    def p_list(self, args):
+        return args[0] + 1
+
+    @rule('list ::= item')
+    def p_list_first(self, args):
+        return 1
+
+    @rule('item ::= NAME  item ::= NUMBER')
+    def p_item(self, args):
+        return args[0].value
+
+class RightListParser(GenericParser):
+    """
+    A right-recursive list, for which Earley parsers build
+    quadratically many items without Leo's optimisation.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'list')
+
+    @rule('list ::= item list')
+    def p_list(self, args):
+        return args[1] + 1
+
+    @rule('list ::= item')
+    def p_list_first(self, args):
+        return 1
+
+    @rule('item ::= NAME  item ::= NUMBER')
+    def p_item(self, args):
+        return args[0].value
@@ -0,0 +1,128 @@
+"""
+Generators of synthetic source text for the benchmark grammars.
+
+Each generator takes a count, and returns text that scans to about that
+many tokens. The text depends only on the count, so runs can be
+compared.
+"""
+import random
+
+NAMES = ['alpha', 'beta', 'x', 'y2', 'total', 'count_3', 'server', 'port']
+
+def expression_source(count):
+    """
+    Generates an arithmetic expression with names, numbers and nested
+    brackets, for ExpressionParser.
+    """
+    rnd = random.Random(count)
+    pieces = []
+    depth = 0
+    while True:
+        while rnd.random() < 0.15 and len(pieces) < count:
+            pieces.append('(')
+            depth += 1
+        if rnd.random() < 0.5:
+            pieces.append(rnd.choice(NAMES))
+        else:
+            pieces.append(str(rnd.randint(0, 9999)))
+        if depth and rnd.random() < 0.3:
+            pieces.append(')')
+            depth -= 1
+        if len(pieces) >= count and not depth:
+            break
+        pieces.append(rnd.choice('+-*/'))
+    return ' '.join(pieces)
+
+def sum_source(count):
+    """
+    Generates a flat sum of products of numbers, for AmbiguousParser.
+    """
+    rnd = random.Random(count)
+    pieces = ['1']
+    while len(pieces) < count:
+        pieces.extend([rnd.choice('+*'), str(rnd.randint(0, 99))])
+    return ' '.join(pieces)
+
+def word_source(count):
+    """
+    Generates a list of names and numbers, for LeftListParser and
+    RightListParser.
+    """
+    rnd = random.Random(count)
+    pieces = []
+    for i in xrange(count):
+        if i % 2:
+            pieces.append(str(rnd.randint(0, 9999)))
+        else:
+            pieces.append(rnd.choice(NAMES))
+    return ' '.join(pieces)
+
+def json_source(count):
+    """
+    Generates a JSON array of records, some with nested records, for
+    JSONParser.
+    """
+    rnd = random.Random(count)
+    records = []
+    tokens = 2
+    while tokens < count:
+        record, size = _json_record(rnd, 2)
+        records.append(record)
+        tokens += size + 1
+    return '[\n  %s\n]\n' % ',\n  '.join(records)
+
+def config_source(count):
+    """
+    Generates an INI-style config file, with comments and blank lines,
+    for ConfigParser.
+    """
+    rnd = random.Random(count)
+    lines = []
+    tokens = 0
+    section = 0
+    while tokens < count:
+        if rnd.random() < 0.1:
+            lines.append('')
+            tokens += 1
+        elif rnd.random() < 0.1:
+            lines.append('# %s' % ' '.join(rnd.sample(NAMES, 3)))
+            tokens += 1
+        elif rnd.random() < 0.1:
+            section += 1
+            lines.append('[section %d]' % section)
+            tokens += 2
+        else:
+            value = rnd.choice([
+                    str(rnd.randint(0, 65535)),
+                    rnd.choice(NAMES),
+                    '"%s"' % ' '.join(rnd.sample(NAMES, 2)),
+                    ])
+            lines.append('%s.%d = %s' % (
+                    rnd.choice(NAMES), rnd.randint(0, 99), value
+                    ))
+            tokens += 4
+    return '\n'.join(lines) + '\n'
+
+# ..........................................................................
+# Internal functions
+
+def _json_record(rnd, depth):
+    """
+    Returns the text of a random JSON object, and the number of tokens
+    in it.
+    """
+    fields = [
+        '"id": %d' % rnd.randint(0, 1000000),
+        '"name": "%s"' % rnd.choice(NAMES),
+        '"score": %.3f' % rnd.uniform(-100, 100),
+        '"active": %s' % rnd.choice(['true', 'false']),
+        '"parent": null',
+        '"tags": ["%s", "%s"]' % tuple(rnd.sample(NAMES, 2)),
+        ]
+    # The braces, five fields of three tokens, the tags, and commas.
+    size = 2 + 5 * 3 + 7 + 5
+    if depth and rnd.random() < 0.3:
+        child, child_size = _json_record(rnd, depth - 1)
+        fields.append('"child": %s' % child)
+        size += 3 + child_size
+    return '{%s}' % ', '.join(fields), size
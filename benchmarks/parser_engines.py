@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Compares the parser engines on expression grammars and long inputs.
+
+Usage: python benchmarks/parser_engines.py [engine ...]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sparkle import *
+from benchmarks.grammars import ExpressionParser, AmbiguousParser
+
+class StatementParser(GenericParser):
+    """
+    A right-recursive list of statements.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'stmts')
+
+    @rule('stmts ::= stmt stmts  stmts ::= stmt')
+    def p_stmts(self, args):
+        return len(args)
+
+    @rule('stmt ::= NAME = expr ;')
+    def p_stmt(self, args):
+        return args[2]
+
+    @rule('expr ::= NAME  expr ::= NUMBER  expr ::= expr + expr')
+    def p_expr(self, args):
+        return args[0]
+
+def expression_tokens(count):
+    """
+    Generates a random arithmetic expression of about count tokens.
+    """
+    random.seed(count)
+    tokens = []
+    depth = 0
+    while len(tokens) < count or depth:
+        if random.random() < 0.15 and len(tokens) < count:
+            tokens.append('(')
+            depth += 1
+            continue
+        tokens.append(random.choice(['NUMBER', 'NAME']))
+        if depth and random.random() < 0.3:
+            tokens.append(')')
+            depth -= 1
+        if len(tokens) < count or depth:
+            tokens.append(random.choice(['+', '-', '*', '/']))
+    return [Token(token_type, token_type, i)
+            for i, token_type in enumerate(tokens)]
+
+def sum_tokens(count):
+    tokens = ['NUMBER']
+    while len(tokens) < count:
+        tokens.extend([random.choice(['+', '*']), 'NUMBER'])
+    return [Token(token_type, i, i) for i, token_type in enumerate(tokens)]
+
+def statement_tokens(count):
+    tokens = []
+    while len(tokens) < count:
+        tokens.extend(['NAME', '=', 'NUMBER', '+', 'NAME', ';'])
+    return [Token(token_type, i, i) for i, token_type in enumerate(tokens)]
+
+CASES = [
+    ('expression', ExpressionParser, expression_tokens, [100, 1000, 10000]),
+    ('ambiguous', AmbiguousParser, sum_tokens, [41, 81, 161]),
+    ('statements', StatementParser, statement_tokens, [60, 600, 3000]),
+    ]
+
+def run(parser_class, engine, tokens):
+    parser_class.engine = engine
+    parser = parser_class()
+    start = time.time()
+    result = parser.parse(tokens)
+    return time.time() - start, result
+
+def main(argv):
+    engines = argv[1:] or ['reference', 'earley', 'auto']
+    sys.setrecursionlimit(100000)
+    print "%-12s %7s" % ('case', 'tokens'),
+    for engine in engines:
+        print "%12s" % engine,
+    print
+    for name, parser_class, generate, sizes in CASES:
+        for size in sizes:
+            tokens = generate(size)
+            print "%-12s %7d" % (name, len(tokens)),
+            results = []
+            for engine in engines:
+                elapsed, result = run(parser_class, engine, tokens)
+                results.append(result)
+                print "%11.3fs" % elapsed,
+            if [result for result in results if result != results[0]]:
+                print " RESULTS DIFFER",
+            print
+
+if __name__ == '__main__':
+    main(sys.argv)
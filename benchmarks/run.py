@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Runs the benchmark grammars on generated inputs of several sizes, and
+reports the scanning rate, the parse time, the peak memory and the
+number of Earley items for each.
+
+The results can be saved as JSON, and compared against results saved
+earlier, to flag regressions. The exit status is 1 if there are any.
+
+Usage: python benchmarks/run.py [options] [case ...]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sparkle.instrument import Stats
+from benchmarks.grammars import *
+from benchmarks.inputs import *
+
+CASES = [
+    ('expression', ExpressionScanner, ExpressionParser, expression_source,
+     [1000, 10000, 100000]),
+    ('json', JSONScanner, JSONParser, json_source,
+     [1000, 10000, 100000]),
+    ('config', ConfigScanner, ConfigParser, config_source,
+     [1000, 10000, 100000]),
+    ('ambiguous', ExpressionScanner, AmbiguousParser, sum_source,
+     [41, 81, 161]),
+    ('left_list', ExpressionScanner, LeftListParser, word_source,
+     [1000, 10000, 100000]),
+    ('right_list', ExpressionScanner, RightListParser, word_source,
+     [1000, 10000, 100000]),
+    ]
+
+# The metrics compared against the baseline, and the smallest change
+# in each that counts as a regression, whatever the threshold, so that
+# noise in small figures isn't flagged.
+METRICS = [
+    ('scan_seconds', 0.002),
+    ('parse_seconds', 0.002),
+    ('peak_memory', 1 << 20),
+    ('earley_items', 0),
+    ]
+
+def measure(case, size, engine, repeat):
+    """
+    Runs a case on an input of the given size, and returns its results.
+    The scan and parse times are the best of repeat runs. The peak
+    memory is the growth of the process's peak resident set size while
+    scanning and parsing, so each case should run in a new process.
+    """
+    name, scanner_class, parser_class, generate, sizes = case
+    source = generate(size)
+    if engine is not None:
+        parser_class.engine = engine
+    scanner = scanner_class()
+    parser = parser_class()
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scan_seconds = parse_seconds = None
+    for i in range(repeat):
+        start = time.time()
+        tokens = scanner.tokenize(source)
+        elapsed = time.time() - start
+        if scan_seconds is None or elapsed < scan_seconds:
+            scan_seconds = elapsed
+    for i in range(repeat):
+        start = time.time()
+        parser.parse(tokens)
+        elapsed = time.time() - start
+        if parse_seconds is None or elapsed < parse_seconds:
+            parse_seconds = elapsed
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Count the items in a separate run, so that the instrumentation
+    # doesn't slow down the timed ones.
+    stats = Stats()
+    parser.set_stats(stats)
+    parser.parse(tokens)
+
+    return {
+        'case': name,
+        'size': size,
+        'tokens': len(tokens),
+        'engine': parser.active_engine,
+        'scan_seconds': scan_seconds,
+        'tokens_per_second': len(tokens) / max(scan_seconds, 1e-9),
+        'parse_seconds': parse_seconds,
+        'peak_memory': (after - before) * 1024,
+        'earley_items': sum(stats.items.values()),
+        'largest_set': max(stats.set_sizes or [0]),
+        }
+
+def compare(results, baseline, threshold):
+    """
+    Compares results with the baseline results, and returns a list of
+    (result, metric, old value) for each metric that has grown by more
+    than the threshold fraction.
+    """
+    old_results = dict([
+            ((result['case'], result['size']), result)
+            for result in baseline
+            ])
+    regressions = []
+    for result in results:
+        old = old_results.get((result['case'], result['size']))
+        if old is None or 'error' in result or 'error' in old:
+            continue
+        for metric, least in METRICS:
+            change = result[metric] - old[metric]
+            if change > least and change > old[metric] * threshold:
+                regressions.append((result, metric, old[metric]))
+    return regressions
+
+def main(argv):
+    options_parser = OptionParser(
+        usage="python benchmarks/run.py [options] [case ...]",
+        description="Cases: %s." % ', '.join([case[0] for case in CASES])
+        )
+    options_parser.add_option(
+        '-o', '--output', metavar='FILE',
+        help="save the results as JSON to FILE"
+        )
+    options_parser.add_option(
+        '-b', '--baseline', metavar='FILE',
+        help="compare the results with those saved in FILE"
+        )
+    options_parser.add_option(
+        '-t', '--threshold', type='float', default=0.25,
+        help="the growth that counts as a regression [default: %default]"
+        )
+    options_parser.add_option(
+        '-e', '--engine',
+        help="the parser engine to use [default: each parser's own]"
+        )
+    options_parser.add_option(
+        '-r', '--repeat', type='int', default=3,
+        help="the number of timed runs of each case [default: %default]"
+        )
+    options_parser.add_option(
+        '-q', '--quick', action='store_true',
+        help="run only the smaller inputs"
+        )
+    options, names = options_parser.parse_args(argv[1:])
+    cases = [case for case in CASES if not names or case[0] in names]
+
+    print "%-11s %7s %7s %-9s %10s %9s %9s %9s" % (
+        'case', 'size', 'tokens', 'engine', 'tokens/s', 'parse', 'peak',
+        'items'
+        )
+    results = []
+    for case in cases:
+        sizes = case[4]
+        if options.quick:
+            sizes = sizes[:-1]
+        for size in sizes:
+            result = _run_in_process(case, size, options)
+            results.append(result)
+            if 'error' in result:
+                print "%-11s %7d  failed: %s" % (
+                    case[0], size, result['error']
+                    )
+                continue
+            print "%-11s %7d %7d %-9s %10.0f %8.3fs %7.1fMB %9d" % (
+                case[0], size, result['tokens'], result['engine'],
+                result['tokens_per_second'], result['parse_seconds'],
+                result['peak_memory'] / 1e6, result['earley_items']
+                )
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({
+                    'python': platform.python_version(),
+                    'results': results,
+                    }, output, indent=1, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            old = json.load(baseline)['results']
+        regressions = compare(results, old, options.threshold)
+        for result, metric, old_value in regressions:
+            print "REGRESSION %s %d: %s %.4g -> %.4g" % (
+                result['case'], result['size'], metric, old_value,
+                result[metric]
+                )
+        if regressions:
+            return 1
+        print "No regressions against %s." % options.baseline
+    return 0
+
+# ..........................................................................
+# Internal functions
+
+def _run_in_process(case, size, options):
+    """
+    Runs measure in a new process, so that its peak memory is its own,
+    and returns its results, or a result with an error.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_measure_into, args=(queue, case, size, options)
+        )
+    process.start()
+    # The results are small, so the process can finish before they're
+    # read from the queue.
+    process.join()
+    if process.exitcode:
+        return {'case': case[0], 'size': size,
+                'error': 'exit code %d' % process.exitcode}
+    return queue.get()
+
+def _measure_into(queue, case, size, options):
+    """
+    Puts the results of measure into the queue.
+    """
+    sys.setrecursionlimit(100000)
+    try:
+        result = measure(case, size, options.engine, options.repeat)
+    except Exception, e:
+        result = {'case': case[0], 'size': size, 'error': str(e)}
+    queue.put(result)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
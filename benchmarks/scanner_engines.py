@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Compares the throughput of the scanner engines on a config-file style
+grammar with a few dozen token rules.
+
+Usage: python benchmarks/scanner_engines.py [size-in-kb]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sparkle import *
+
+KEYWORDS = [
+    'include', 'section', 'set', 'unset', 'if', 'else', 'end', 'for',
+    'in', 'true', 'false', 'null', 'and', 'or', 'not', 'export',
+    ]
+
+OPERATORS = [
+    '=', '==', '!=', '<', '<=', '>', '>=', r'\+', '-', r'\*', '/',
+    r'\(', r'\)', r'\[', r'\]', '{', '}', ',', ':', r'\.',
+    ]
+
+def make_scanner_class():
+    """
+    Builds a TokenizingScanner subclass with a rule for each keyword
+    and operator, plus names, numbers, strings and comments.
+    """
+    members = {}
+
+    def token_rule(name, pattern, token_type):
+        @rule(pattern)
+        @generate_token(token_type)
+        def t_rule(self, token, string, position):
+            return token
+        members[name] = t_rule
+
+    for keyword in KEYWORDS:
+        token_rule('t_kw_%s' % keyword, keyword, keyword.upper())
+    for index, operator in enumerate(OPERATORS):
+        token_rule('t_op_%02d' % index, operator, operator.strip('\\'))
+    token_rule('t_name', r'[A-Za-z_][A-Za-z0-9_]*', 'NAME')
+    token_rule('t_number', r'[0-9]+(\.[0-9]+)?', 'NUMBER')
+    token_rule('t_string', r'"([^"\\\n]|\\.)*"', 'STRING')
+
+    @rule(r'[ \t\r\n]+')
+    def t_whitespace(self, token, string, position):
+        pass
+    members['t_whitespace'] = t_whitespace
+
+    @rule(r'#[^\n]*')
+    def t_comment(self, token, string, position):
+        pass
+    members['t_comment'] = t_comment
+
+    return type('ConfigScanner', (TokenizingScanner,), members)
+
+def make_input(size):
+    """
+    Generates roughly size characters of config-like text.
+    """
+    random.seed(size)
+    words = KEYWORDS + [
+        'server', 'port_1', 'internal', 'x', '8080', '3.25', '"a string"',
+        '"esc\\"aped"', '=', '==', '<=', '(', ')', '{', '}', ',', '.',
+        '# a comment\n', '\n', '    ',
+        ]
+    pieces = []
+    total = 0
+    while total < size:
+        word = random.choice(words)
+        pieces.append(word)
+        total += len(word) + 1
+    return ' '.join(pieces)
+
+def run(engine, src, repeat=3):
+    """
+    Returns the best time over several runs of tokenizing the source
+    with the given engine, and the tokens produced.
+    """
+    scanner_class = make_scanner_class()
+    scanner_class.engine = engine
+    scanner = scanner_class()
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        tokens = scanner.tokenize(src)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, tokens
+
+def main(argv):
+    size = 1024 * (len(argv) > 1 and int(argv[1]) or 256)
+    src = make_input(size)
+    print "Input: %d bytes, %d rules" % (
+        len(src), len(KEYWORDS) + len(OPERATORS) + 5
+        )
+
+    reference = None
+    for engine in ('reference', 'combined', 'dfa', 'dispatch'):
+        elapsed, tokens = run(engine, src)
+        signature = [(t.token_type, t.value, t.position) for t in tokens]
+        if reference is None:
+            reference = signature, elapsed
+        same = signature == reference[0] and 'same' or 'DIFFERENT'
+        print "%-10s %8.2f MB/s  %5.1fx  %d tokens (%s)" % (
+            engine, len(src) / elapsed / 1e6, reference[1] / elapsed,
+            len(tokens), same
+            )
+
+if __name__ == '__main__':
+    main(sys.argv)
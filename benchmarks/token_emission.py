@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Compares the throughput of scanners written with generate_token and
+methods that do nothing for whitespace and comments, against the same
+scanner written with the declarative token and skip decorators, on
+indented, commented source text. A copy of the first scanner without
+the fast paths shows what every match cost before them: a call to the
+matcher, and a call to the rule's method.
+
+Usage: python benchmarks/token_emission.py [size-in-kb]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sparkle import *
+
+class CallbackScanner(TokenizingScanner):
+    """
+    Rules written as methods, the way scanners were before skip and
+    token.
+    """
+    @rule(r'[A-Za-z_][A-Za-z0-9_]*')
+    @generate_token('NAME')
+    def t_name(self, token, string, position):
+        return token
+
+    @rule(r'[0-9]+')
+    @generate_token('NUMBER')
+    def t_number(self, token, string, position):
+        return int(token)
+
+    @rule(r'"[^"\n]*"')
+    @generate_token('STRING')
+    def t_string(self, token, string, position):
+        return token
+
+    @rule(r'[-+*/=(),:]')
+    def t_operator(self, token, string, position):
+        self.tokens.append(Token(token, token, position))
+
+    @rule(r'[ \t\r\n]+')
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\#[^\n]*')
+    def t_comment(self, token, string, position):
+        pass
+
+class UnacceleratedScanner(CallbackScanner):
+    """
+    CallbackScanner, with every match found by the matcher and handed
+    to the rule's method.
+    """
+    def _build_matchers(self):
+        CallbackScanner._build_matchers(self)
+        self._inline = {}
+        self._fast = {}
+
+class DeclarativeScanner(TokenizingScanner):
+    """
+    CallbackScanner, with the rules that only make tokens or throw
+    the text away declared with token and skip.
+    """
+    @rule(r'[A-Za-z_][A-Za-z0-9_]*')
+    @token('NAME')
+    def t_name(self, token, string, position):
+        pass
+
+    @rule(r'[0-9]+')
+    @token('NUMBER', int)
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'"[^"\n]*"')
+    @token('STRING')
+    def t_string(self, token, string, position):
+        pass
+
+    @rule(r'[-+*/=(),:]')
+    def t_operator(self, token, string, position):
+        self.tokens.append(Token(token, token, position))
+
+    @rule(r'[ \t\r\n]+')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\#[^\n]*')
+    @skip
+    def t_comment(self, token, string, position):
+        pass
+
+CASES = [
+    ('before fast paths', UnacceleratedScanner),
+    ('methods', CallbackScanner),
+    ('token and skip', DeclarativeScanner),
+    ]
+
+NAMES = ['alpha', 'beta', 'x', 'y2', 'total', 'count_3', 'server', 'port']
+
+def make_input(size):
+    """
+    Generates roughly size characters of indented assignments, with
+    comments.
+    """
+    rnd = random.Random(size)
+    lines = []
+    total = 0
+    while total < size:
+        indent = '    ' * rnd.randint(0, 3)
+        if rnd.random() < 0.2:
+            line = '%s# %s' % (indent, ' '.join(rnd.sample(NAMES, 4)))
+        else:
+            line = '%s%s = %s(%s, %d)  # %s' % (
+                indent, rnd.choice(NAMES), rnd.choice(NAMES),
+                rnd.choice(NAMES), rnd.randint(0, 9999),
+                rnd.choice(NAMES)
+                )
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+def run(scanner_class, engine, src, repeat=3):
+    """
+    Returns the best time over several runs of tokenizing the source
+    with the given scanner class and engine, and the tokens produced.
+    """
+    scanner_class.engine = engine
+    scanner = scanner_class()
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        tokens = scanner.tokenize(src)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, tokens
+
+def main(argv):
+    size = 1024 * (len(argv) > 1 and int(argv[1]) or 256)
+    src = make_input(size)
+    print "Input: %d bytes" % len(src)
+
+    for engine in ('combined', 'dfa', 'dispatch'):
+        reference = None
+        for name, scanner_class in CASES:
+            elapsed, tokens = run(scanner_class, engine, src)
+            signature = [(t.token_type, t.value, t.position) for t in tokens]
+            if reference is None:
+                reference = signature, elapsed
+            same = signature == reference[0] and 'same' or 'DIFFERENT'
+            print "%-9s %-18s %6.2f MB/s  %5.1fx  %d tokens (%s)" % (
+                engine, name, len(src) / elapsed / 1e6,
+                reference[1] / elapsed, len(tokens), same
+                )
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Measures the memory used per million tokens when they are stored as a
+list of Token objects, and in a TokenBuffer. An unslotted copy of the
+Token class shows what storing tokens cost before Token had slots.
+
+Each case runs in its own process, and is measured by the growth of
+its peak resident set size.
+
+Usage: python benchmarks/token_memory.py [millions-of-tokens]
+"""
+import os
+import sys
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sparkle import *
+
+TYPES = ['NAME', 'NUMBER', 'STRING', '=', '(', ')', ',', ':']
+
+# Values come from a shared pool, so the figures show the overhead of
+# the token storage itself.
+VALUES = range(1000)
+
+class UnslottedToken(object):
+    """
+    The Token class as it was, with a per-instance __dict__.
+    """
+    def __init__(self, token_type, value, position):
+        self.token_type = token_type
+        self.value = value
+        self.position = position
+
+def fill_list(token_class, count):
+    tokens = []
+    for i in xrange(count):
+        tokens.append(token_class(TYPES[i % 8], VALUES[i % 1000], i * 4))
+    return tokens
+
+def fill_buffer(count):
+    tokens = TokenBuffer()
+    for i in xrange(count):
+        tokens.add(TYPES[i % 8], VALUES[i % 1000], i * 4)
+    return tokens
+
+CASES = [
+    ('unslotted Token list', lambda count: fill_list(UnslottedToken, count)),
+    ('Token list', lambda count: fill_list(Token, count)),
+    ('TokenBuffer', fill_buffer),
+    ]
+
+def measure(index, count, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tokens = CASES[index][1](count)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((after - before) * 1024)
+
+def main(argv):
+    millions = len(argv) > 1 and float(argv[1]) or 1.0
+    count = int(millions * 1000000)
+    print "Memory per million tokens (%d tokens stored):" % count
+    for index, (name, fill) in enumerate(CASES):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=measure, args=(index, count, queue)
+            )
+        process.start()
+        used = queue.get()
+        process.join()
+        print "%-22s %8.1f MB  %6.1f bytes/token" % (
+            name, used / millions / 1e6, float(used) / count
+            )
+
+if __name__ == '__main__':
+    main(sys.argv)
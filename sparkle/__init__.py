@@ -6,3 +6,4 @@ from tokens import *
 
 from scanner import *
 from parser import *
+from batch import *
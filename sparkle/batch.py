@@ -0,0 +1,82 @@
+"""
+Parses batches of independent documents in a pool of worker
+processes.
+"""
+import multiprocessing
+from errors import SparkleErrorBase
+
+def parse_many(scanner, parser, sources, workers=None, ordered=True,
+               chunk_size=16):
+    """
+    Tokenizes each of the sources with the scanner (a
+    TokenizingScanner) and parses the tokens with the parser, in a pool
+    of the given number of worker processes (by default, one per CPU).
+    If the scanner is None, the sources are sequences of tokens to be
+    parsed as they are.
+
+    Generates an (index, result, error) triple for each source, where
+    index is its position among the sources. If the source couldn't
+    be scanned or parsed, the result is None and the error is the
+    SparkleError (or SparkleSyntaxError, and so on) raised, with its
+    position, otherwise the error is None. The batch carries on past
+    errors. The triples are generated in the order of the sources if
+    ordered is True, otherwise in the order they are finished.
+
+    The scanner and parser are pickled and sent to each worker once,
+    along with their compiled tables. The sources are sent in chunks
+    of the given size, and the results must be picklable. With a
+    single worker, the sources are parsed in this process.
+    """
+    jobs = enumerate(sources)
+    if workers == 1:
+        _start_worker(scanner, parser)
+        try:
+            for job in jobs:
+                yield _parse_document(job)
+        finally:
+            _start_worker(None, None)
+        return
+
+    pool = multiprocessing.Pool(workers, _start_worker, (scanner, parser))
+    finished = False
+    try:
+        if ordered:
+            results = pool.imap(_parse_document, jobs, chunk_size)
+        else:
+            results = pool.imap_unordered(_parse_document, jobs, chunk_size)
+        for result in results:
+            yield result
+        finished = True
+    finally:
+        # Stop the workers at once if the caller stops reading results.
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+# ..........................................................................
+# Internal data and functions
+
+# The scanner and parser of this worker process.
+_worker = None
+
+def _start_worker(scanner, parser):
+    global _worker
+    _worker = scanner, parser
+
+def _parse_document(job):
+    """
+    Scans and parses one source, returning its (index, result, error)
+    triple.
+    """
+    index, source = job
+    scanner, parser = _worker
+    try:
+        if scanner is None:
+            tokens = source
+        else:
+            tokens = scanner.tokenize(source)
+        return index, parser.parse(tokens), None
+    except SparkleErrorBase, err:
+        return index, None, err
@@ -0,0 +1,360 @@
+"""
+Generates a Python module holding the rules and compiled tables of
+scanner and parser classes, so that production code can import them
+ready made, rather than finding and compiling them at startup.
+
+For each class given, the generated module has a subclass of the same
+name, whose rules are listed as literals (so constructing it doesn't
+walk dir() or split rule strings), and whose compiled tables are
+written out as literals (so they aren't compiled, or loaded from a
+table cache, either). These are the compiled grammar of a parser, the
+LALR(1) tables of the 'auto' parser engine, and the DFAs of the 'dfa'
+scanner engine. The other scanner engines have no tables, so their
+regular expressions are still compiled when the class is constructed.
+
+Only the data is generated, not code: the generated classes scan and
+parse with the same engines as the originals, just as fast, and the
+rule functions are still the methods of the original class, which the
+module imports. All that is saved is the work of constructing them.
+
+The generated module must be written again whenever the rules change.
+A generated class whose rules no longer match its tables (because
+preprocess now changes them, say) compiles its grammar as usual.
+"""
+import os
+import re
+import imp
+import pprint
+from errors import SparkleInternalError, SparkleErrorBase
+from grammar import Grammar
+from dfa import DFA
+from lalr import LALRTable
+from scanner import GenericScanner, TokenizingScanner
+from parser import GenericParser, _split_rule
+
+class GeneratedScanner(GenericScanner):
+    """
+    The base of the generated scanner classes. Generated_patterns maps
+    each state to the (method name, pattern, flags) triples of its
+    rules, in order, and generated_tables maps the (kind, source) key
+    of each compiled table to the table.
+    """
+    generated_patterns = {}
+    generated_tables = {}
+
+    def _make_matchers(self):
+        self._tables.tables.update(self.generated_tables)
+        self.patterns = {}
+        for state, entries in self.generated_patterns.items():
+            self.patterns[state] = [
+                (getattr(self, name), re.compile(pattern, flags))
+                for name, pattern, flags in entries
+                ]
+        self._build_matchers()
+
+class GeneratedParser(GenericParser):
+    """
+    The base of the generated parser classes. Generated_rules holds
+    the (method name, lhs, rhs) triple of each production, in order,
+    and generated_tables maps the (kind, source) key of each compiled
+    table to the table.
+    """
+    generated_rules = ()
+    generated_tables = {}
+
+    def _find_rules(self, start):
+        self._tables.tables.update(self.generated_tables)
+        self.rules = {}
+        self.rule2func = {}
+        self.rule2name = {}
+        for name, lhs, rhs in self.generated_rules:
+            self._add_production(lhs, rhs, getattr(self, name))
+        self.start_rule = self._init_first_rule(start)
+        self.rules_changed = 1
+        self.grammar = None
+
+def generate_module(classes):
+    """
+    Returns the source of a module with a generated subclass of each
+    of the given GenericScanner and GenericParser subclasses. Each
+    class is instantiated with no arguments to find its rules and
+    compile its tables, and must be importable from its module.
+    """
+    imports = []
+    bodies = []
+    for cls in classes:
+        if cls.__module__ == '__main__':
+            raise ValueError(
+                "Class '%s' must be importable to generate code for it."
+                % cls.__name__
+                )
+        instance = cls()
+        base = '_' + cls.__name__
+        imports.append('from %s import %s as %s' % (
+                cls.__module__, cls.__name__, base
+                ))
+        if isinstance(instance, GenericParser):
+            bodies.append(_parser_class(instance, base))
+        elif isinstance(instance, GenericScanner):
+            bodies.append(_scanner_class(instance, base))
+        else:
+            raise ValueError(
+                "Class '%s' is neither a scanner nor a parser."
+                % cls.__name__
+                )
+
+    lines = [
+        '"""',
+        'Compiled scanner and parser tables, generated by sparkle.codegen.',
+        'Generate this module again whenever the rules change.',
+        '"""',
+        'from sparkle.codegen import GeneratedScanner, GeneratedParser',
+        'from sparkle.codegen import load_grammar, load_dfa, load_lalr',
+        ]
+    lines.extend(imports)
+    for body in bodies:
+        lines.append('')
+        lines.extend(body)
+    return '\n'.join(lines) + '\n'
+
+def write_module(path, classes, samples=None):
+    """
+    Writes the module generated for the given classes (see
+    generate_module) to the given path, then imports it and checks
+    that each generated class has the same rules and tables as the
+    class it was generated from, and gives the same results for the
+    sample inputs of the class, if samples (a dictionary mapping
+    classes to lists of inputs) has any (see check_class). Returns the
+    module.
+    """
+    source = generate_module(classes)
+    with open(path, 'w') as module_file:
+        module_file.write(source)
+    name = os.path.splitext(os.path.basename(path))[0]
+    module = imp.load_source(name, path)
+    for original in classes:
+        generated = getattr(module, original.__name__)
+        check_class(generated, original, (samples or {}).get(original, ()))
+    return module
+
+def check_class(generated, original, samples=()):
+    """
+    Checks that a generated class has the same rules and compiled
+    tables as the class it was generated from, and gives the same
+    results for each of the sample inputs, raising a
+    SparkleInternalError if it doesn't.
+
+    The samples of a scanner are strings to tokenize, and those of a
+    parser are sequences of tokens to parse. The tokens made by a
+    TokenizingScanner are compared by their type, value and position,
+    and the results of a parser with ==, or failing that by their repr
+    (as AST nodes don't define ==). Errors raised are compared by their
+    class, message and position.
+    """
+    new, old = generated(), original()
+    if isinstance(old, GenericParser):
+        same = new.rule2name == old.rule2name and \
+            new.start_rule == old.start_rule
+        _compile(old)
+    else:
+        same = _patterns(new) == _patterns(old)
+    for key, table in old._tables.tables.items():
+        if key not in new._tables.tables or \
+                _table_state(new._tables.tables[key]) != _table_state(table):
+            same = False
+    if not same:
+        raise SparkleInternalError(
+            "Generated class '%s' doesn't match the original."
+            % generated.__name__,
+            None
+            )
+    for index, sample in enumerate(samples):
+        new_result = _run(new, sample)
+        old_result = _run(old, sample)
+        if new_result != old_result and repr(new_result) != repr(old_result):
+            raise SparkleInternalError(
+                "Generated class '%s' gives a different result from the "
+                "original for sample %d." % (generated.__name__, index),
+                None
+                )
+
+def load_grammar(tables, rows):
+    """
+    Makes a Grammar from the literal tables of a generated module. The
+    rows of the prediction tables are given as indices into rows.
+    """
+    grammar = Grammar.__new__(Grammar)
+    grammar.__dict__.update(tables)
+    grammar.predictions = tuple([
+            tuple([rows[index] for index in row])
+            for row in tables['predictions']
+            ])
+    return grammar
+
+def load_dfa(rules, boundaries, transitions, accept):
+    """
+    Makes the (rules, DFA) table of a DFAMatcher from the literal
+    tables of a generated module.
+    """
+    dfa = DFA.__new__(DFA)
+    dfa.boundaries = boundaries
+    dfa.transitions = transitions
+    dfa.accept = accept
+    return rules, dfa
+
+def load_lalr(tables):
+    """
+    Makes an LALRTable from the literal tables of a generated module.
+    """
+    table = LALRTable.__new__(LALRTable)
+    table.__dict__.update(tables)
+    return table
+
+# ..........................................................................
+# Internal functions
+
+def _parser_class(parser, base):
+    """
+    Returns the lines of the generated subclass of the given parser.
+    """
+    productions = []
+    for name in dir(parser):
+        if name.startswith('p_'):
+            for lhs, rhs in _split_rule(getattr(parser, name).rule):
+                productions.append((name, lhs, rhs))
+    _compile(parser)
+
+    lines = ['class %s(GeneratedParser, %s):' % (base[1:], base)]
+    lines.append(
+        '    generated_rules = %s' % _literal(tuple(productions), 22)
+        )
+    lines.extend(_tables(parser))
+    return lines
+
+def _scanner_class(scanner, base):
+    """
+    Returns the lines of the generated subclass of the given scanner.
+    """
+    lines = ['class %s(GeneratedScanner, %s):' % (base[1:], base)]
+    lines.append(
+        '    generated_patterns = %s' % _literal(_patterns(scanner), 25)
+        )
+    lines.extend(_tables(scanner))
+    return lines
+
+def _compile(parser):
+    """
+    Compiles the grammar of the given parser, and the LALR(1) tables
+    its engine would build on the first parse.
+    """
+    parser._get_grammar()
+    if parser.engine == 'auto' and not parser.incremental:
+        parser._get_lalr_table()
+
+def _run(instance, sample):
+    """
+    Returns the result of tokenizing or parsing the sample with the
+    given scanner or parser, for check_class to compare.
+    """
+    try:
+        if isinstance(instance, GenericParser):
+            return instance.parse(list(sample))
+        tokens = instance.tokenize(sample)
+        if isinstance(instance, TokenizingScanner):
+            return [(token.token_type, token.value, token.position)
+                    for token in tokens]
+        return tokens
+    except SparkleErrorBase, e:
+        return e.__class__, str(e), e.position
+
+def _patterns(scanner):
+    """
+    Returns the (method name, pattern, flags) triples of the rules of
+    each state of a scanner.
+    """
+    names = scanner._rule_names()
+    patterns = {}
+    for state, entries in scanner.patterns.items():
+        patterns[state] = tuple([
+                (names[fn], regex.pattern, regex.flags)
+                for fn, regex in entries
+                ])
+    return patterns
+
+def _tables(instance):
+    """
+    Returns the lines of the generated_tables attribute, holding the
+    tables the given scanner or parser has compiled.
+    """
+    if not instance._tables.tables:
+        return ['    generated_tables = {}']
+    lines = ['    generated_tables = {']
+    for (kind, source), table in sorted(instance._tables.tables.items()):
+        try:
+            loader, args = _WRITERS[kind](table)
+        except KeyError:
+            raise ValueError("Can't generate tables of kind '%s'." % kind)
+        lines.append('        (%r,' % kind)
+        lines.append('         %s):' % _literal(source, 9))
+        lines.append('            %s(' % loader)
+        for arg in args:
+            lines.append('                %s,' % _literal(arg, 16))
+        lines.append('                ),')
+    lines.append('        }')
+    return lines
+
+def _write_grammar(grammar):
+    """
+    Returns the loader and arguments that make the given Grammar.
+    """
+    tables = grammar.__dict__.copy()
+    rows = []
+    numbers = {}
+    predictions = []
+    for row in grammar.predictions:
+        numbered = []
+        for items in row:
+            if items not in numbers:
+                numbers[items] = len(rows)
+                rows.append(items)
+            numbered.append(numbers[items])
+        predictions.append(tuple(numbered))
+    tables['predictions'] = tuple(predictions)
+    return 'load_grammar', (tables, tuple(rows))
+
+def _write_dfa(table):
+    """
+    Returns the loader and arguments that make the given (rules, DFA)
+    table.
+    """
+    rules, dfa = table
+    return 'load_dfa', (rules, dfa.boundaries, dfa.transitions, dfa.accept)
+
+def _write_lalr(table):
+    """
+    Returns the loader and arguments that make the given LALRTable.
+    """
+    return 'load_lalr', (table.__dict__,)
+
+def _table_state(table):
+    """
+    Returns a comparable form of a compiled table.
+    """
+    if isinstance(table, tuple):
+        return tuple([_table_state(part) for part in table])
+    return getattr(table, '__dict__', table)
+
+def _literal(value, column):
+    """
+    Returns the repr of a value laid out to fit in 79 columns, starting
+    at the given column.
+    """
+    text = pprint.pformat(value, width=79 - column)
+    return text.replace('\n', '\n' + ' ' * column)
+
+# Writes the source of each kind of table.
+_WRITERS = {
+    'grammar': _write_grammar,
+    'dfa': _write_dfa,
+    'lalr': _write_lalr,
+    }
@@ -43,3 +43,73 @@ def generate_token(token_type):
             return token
         return _wraps
     return _decorator
+
+def generate_lazy_token(token_type, encoding=None):
+    """
+    Like generate_token, but for scanning byte buffers. If the
+    function it wraps returns None, the token is a LazyToken, which
+    decodes its value from the matched bytes (using the given
+    encoding, if any) only when the value is first used.
+    """
+    def _decorator(function):
+        @functools.wraps(function)
+        def _wraps(self, token, string, position):
+            value = function(self, token, string, position)
+            if value is None:
+                token = LazyToken(token_type, token, position, encoding)
+            else:
+                token = Token(token_type, value, position)
+            self.tokens.append(token)
+            return token
+        return _wraps
+    return _decorator
+
+def token(token_type, convert=None):
+    """
+    Like generate_token, but declarative: the value of the token is
+    the matched text, passed through convert (such as int) if it is
+    given. The scanner makes these tokens itself, without calling the
+    method, so the body of the method is never run. On byte buffers,
+    a token without convert is a LazyToken, as generate_lazy_token
+    makes, rather than a Token holding a view of the buffer.
+
+    Usage:
+
+    @rule(r"[0-9]+")
+    @token('NUMBER', int)
+    def t_number(self, token, string, position):
+        pass
+    """
+    def _decorator(function):
+        @functools.wraps(function)
+        def _wraps(self, text, string, position):
+            if convert is not None:
+                token = Token(token_type, convert(text), position)
+            elif isinstance(text, basestring):
+                token = Token(token_type, text, position)
+            else:
+                token = LazyToken(token_type, text, position)
+            self.tokens.append(token)
+            return token
+        _wraps.inline_token = token_type, convert
+        return _wraps
+    return _decorator
+
+def skip(function):
+    """
+    Marks a scanner rule whose matches are thrown away, such as
+    whitespace or comments. The scanner passes over them without
+    calling the method, so the body of the method is never run.
+
+    Usage:
+
+    @rule(r"[ \\t\\n]+")
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+    """
+    @functools.wraps(function)
+    def _wraps(self, token, string, position):
+        return None
+    _wraps.inline_token = None, None
+    return _wraps
@@ -0,0 +1,406 @@
+"""
+Compiles the regular t_* rules of a scanner state into a single
+deterministic finite automaton.
+
+Python's regex engine is a backtracking matcher, so it can't give the
+POSIX leftmost-longest semantics that Lex uses. A DFA can: it reads
+the input once, and remembers the last accepting state it passed
+through. Only the regular subset of Python's regex syntax can be
+compiled this way. Rules that use anything else (backreferences,
+lookaround, anchors, flags) are left for the regex engine.
+"""
+import sys
+import bisect
+import sre_parse
+import sre_constants
+
+class NotRegular(Exception):
+    """
+    Raised when a pattern uses a feature that can't be compiled into
+    a DFA.
+    """
+    pass
+
+class DFA(object):
+    """
+    A DFA built from a list of rule patterns. It is plain data, so it
+    can be pickled.
+
+    The alphabet is divided into classes of characters that every
+    pattern treats identically. Boundaries holds the first code point
+    of each class, transitions[state][class] is the next state (or -1
+    for none), and accept[state] is the index of the highest priority
+    rule accepting in that state (or -1). State 0 is the start.
+    """
+
+    # Patterns expanding to more NFA states than this are not compiled.
+    MAX_NFA_STATES = 20000
+
+    # Give up building automata with more states than this.
+    MAX_DFA_STATES = 10000
+
+    def __init__(self, patterns):
+        """
+        Compiles the given list of regex pattern strings, in priority
+        order. Raises NotRegular if any of them can't be compiled.
+        """
+        nfa = _NFA()
+        starts = []
+        for index, pattern in enumerate(patterns):
+            start, end = nfa.build(sre_parse.parse(pattern))
+            nfa.accept[end] = index
+            starts.append(start)
+        root = nfa.new_state()
+        nfa.epsilon[root].extend(starts)
+
+        self.boundaries = nfa.boundaries()
+        self.transitions, self.accept = self._determinize(nfa, root)
+
+    def _determinize(self, nfa, root):
+        """
+        Builds the DFA from the NFA with the subset construction.
+        """
+        classes = len(self.boundaries)
+
+        # For each NFA edge, the set of character classes it covers.
+        covered = []
+        for edges in nfa.edges:
+            covered.append([
+                    (_classes_in(self.boundaries, charset), target)
+                    for charset, target in edges
+                    ])
+
+        start = nfa.closure([root])
+        ids = {start: 0}
+        pending = [start]
+        transitions = []
+        accept = []
+        for current in pending:
+            rules = [nfa.accept[state] for state in current
+                     if state in nfa.accept]
+            accept.append(min(rules) if rules else -1)
+
+            moves = {}
+            for state in current:
+                for class_ids, target in covered[state]:
+                    for class_id in class_ids:
+                        moves.setdefault(class_id, set()).add(target)
+
+            row = [-1] * classes
+            for class_id, targets in moves.items():
+                target = nfa.closure(targets)
+                if target not in ids:
+                    if len(ids) >= self.MAX_DFA_STATES:
+                        raise NotRegular("Automaton is too large.")
+                    ids[target] = len(ids)
+                    pending.append(target)
+                row[class_id] = ids[target]
+            transitions.append(tuple(row))
+        return transitions, accept
+
+class DFAMatcher(object):
+    """
+    Finds the longest match among a list of scanner rules with a DFA.
+
+    Unlike the other engines, this one gives POSIX semantics within a
+    rule as well as between them: a rule such as /in|init/ matches
+    'init' in full, and lazy repeats are treated like greedy ones. For
+    matches of the same length, the earlier rule still wins. Rules
+    that aren't regular are matched with the regex engine, and their
+    results merged in.
+    """
+    # The matches can differ from the regex engine's.
+    posix = True
+
+    def __init__(self, rules, cache=None):
+        self.fns = [fn for fn, regex in rules]
+        source = tuple([(regex.pattern, regex.flags) for fn, regex in rules])
+        if cache is None:
+            self.rules, self.dfa = _compile(source)
+        else:
+            self.rules, self.dfa = cache.get(
+                'dfa', source, lambda: _compile(source)
+                )
+
+        self.fallback = []
+        for index, (fn, regex) in enumerate(rules):
+            if index not in self.rules:
+                self.fallback.append((index, fn, regex))
+
+        # Transitions are cached per character as they are met, to
+        # avoid looking up the class of each character.
+        self.rows = [{} for row in self.dfa.transitions]
+
+    def match(self, src_string, pos, tried=None):
+        """
+        Returns a (function, end) pair for the longest non-empty match
+        at the given position, or None if no rule matched. If tried is
+        a list, the index of each rule tried is appended to it, where
+        running the DFA tries all the rules compiled into it.
+        """
+        if tried is not None:
+            tried.extend(self.rules)
+            tried.extend([index for index, fn, regex in self.fallback])
+        rows = self.rows
+        accept = self.dfa.accept
+        state = 0
+        rule = -1
+        longest = pos
+        i = pos
+        n = len(src_string)
+        while i < n:
+            c = src_string[i]
+            following = rows[state].get(c)
+            if following is None:
+                following = self._step(state, c)
+            if following < 0:
+                break
+            state = following
+            i += 1
+            if accept[state] >= 0:
+                rule = self.rules[accept[state]]
+                longest = i
+
+        for index, fn, regex in self.fallback:
+            m = regex.match(src_string, pos)
+            if m is not None:
+                end = m.end()
+                if end > longest or (end == longest and index < rule):
+                    rule = index
+                    longest = end
+
+        if rule < 0:
+            return None
+        return self.fns[rule], longest
+
+    def _step(self, state, c):
+        """
+        Finds the transition on the given character out of the given
+        state, and caches it.
+        """
+        if isinstance(c, (int, long)):
+            code = c
+        else:
+            code = ord(c)
+        class_id = bisect.bisect_right(self.dfa.boundaries, code) - 1
+        following = self.dfa.transitions[state][class_id]
+        self.rows[state][c] = following
+        return following
+
+def is_regular(pattern, flags=0):
+    """
+    Checks if the given rule pattern can be compiled into a DFA.
+    """
+    if flags:
+        return False
+    try:
+        _NFA().build(sre_parse.parse(pattern))
+    except (NotRegular, sre_constants.error):
+        return False
+    return True
+
+def _compile(source):
+    """
+    Compiles the regular rules among the given (pattern, flags) pairs.
+    Returns the indices of the rules compiled, and their DFA.
+    """
+    regular = tuple([
+            index for index, (pattern, flags) in enumerate(source)
+            if is_regular(pattern, flags)
+            ])
+    return regular, DFA([source[index][0] for index in regular])
+
+# ..........................................................................
+# Internal: NFA construction
+
+_MAX_CODE = sys.maxunicode
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: [(48, 57)],
+    sre_constants.CATEGORY_WORD: [(48, 57), (65, 90), (95, 95), (97, 122)],
+    sre_constants.CATEGORY_SPACE: [(9, 13), (32, 32)],
+    }
+_CATEGORIES[sre_constants.CATEGORY_NOT_DIGIT] = \
+    _CATEGORIES[sre_constants.CATEGORY_DIGIT]
+_CATEGORIES[sre_constants.CATEGORY_NOT_WORD] = \
+    _CATEGORIES[sre_constants.CATEGORY_WORD]
+_CATEGORIES[sre_constants.CATEGORY_NOT_SPACE] = \
+    _CATEGORIES[sre_constants.CATEGORY_SPACE]
+
+_NEGATED_CATEGORIES = (
+    sre_constants.CATEGORY_NOT_DIGIT,
+    sre_constants.CATEGORY_NOT_WORD,
+    sre_constants.CATEGORY_NOT_SPACE,
+    )
+
+class _NFA(object):
+    """
+    A Thompson NFA, built from parsed regular expressions. Character
+    sets are sorted lists of disjoint, inclusive (low, high) ranges of
+    code points.
+    """
+    def __init__(self):
+        self.epsilon = []
+        self.edges = []
+        self.accept = {}
+
+    def new_state(self):
+        if len(self.epsilon) >= DFA.MAX_NFA_STATES:
+            raise NotRegular("Pattern is too large.")
+        self.epsilon.append([])
+        self.edges.append([])
+        return len(self.epsilon) - 1
+
+    def build(self, parsed):
+        """
+        Adds the NFA for a parsed (sub)pattern. Returns its start and
+        end states.
+        """
+        start = end = self.new_state()
+        for op, av in parsed:
+            if op == sre_constants.LITERAL:
+                first, last = self._charset([(av, av)])
+            elif op == sre_constants.NOT_LITERAL:
+                first, last = self._charset(_negate([(av, av)]))
+            elif op == sre_constants.ANY:
+                first, last = self._charset(_negate([(10, 10)]))
+            elif op == sre_constants.IN:
+                first, last = self._charset(_charset_of(av))
+            elif op == sre_constants.BRANCH:
+                first, last = self.new_state(), self.new_state()
+                for branch in av[1]:
+                    b_first, b_last = self.build(branch)
+                    self.epsilon[first].append(b_first)
+                    self.epsilon[b_last].append(last)
+            elif op == sre_constants.SUBPATTERN:
+                if len(av) > 2 and (av[1] or av[2]):
+                    raise NotRegular("Scoped flags are not supported.")
+                first, last = self.build(av[-1])
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                first, last = self._repeat(*av)
+            else:
+                raise NotRegular("Unsupported regex feature: %s." % op)
+            self.epsilon[end].append(first)
+            end = last
+        return start, end
+
+    def _charset(self, charset):
+        first, last = self.new_state(), self.new_state()
+        self.edges[first].append((charset, last))
+        return first, last
+
+    def _repeat(self, minimum, maximum, parsed):
+        start = end = self.new_state()
+        for i in range(minimum):
+            first, last = self.build(parsed)
+            self.epsilon[end].append(first)
+            end = last
+
+        if maximum == sre_constants.MAXREPEAT:
+            first, last = self.build(parsed)
+            loop = self.new_state()
+            self.epsilon[end].append(loop)
+            self.epsilon[loop].append(first)
+            self.epsilon[last].append(loop)
+            return start, loop
+
+        finish = self.new_state()
+        self.epsilon[end].append(finish)
+        for i in range(maximum - minimum):
+            first, last = self.build(parsed)
+            self.epsilon[end].append(first)
+            self.epsilon[last].append(finish)
+            end = last
+        return start, finish
+
+    def closure(self, states):
+        """
+        Returns the frozen set of states reachable from the given ones
+        through epsilon transitions alone.
+        """
+        result = set(states)
+        pending = list(result)
+        while pending:
+            state = pending.pop()
+            for target in self.epsilon[state]:
+                if target not in result:
+                    result.add(target)
+                    pending.append(target)
+        return frozenset(result)
+
+    def boundaries(self):
+        """
+        Returns the sorted first code points of the character classes
+        that the NFA's character sets divide the alphabet into.
+        """
+        points = set([0])
+        for edges in self.edges:
+            for charset, target in edges:
+                for low, high in charset:
+                    points.add(low)
+                    if high < _MAX_CODE:
+                        points.add(high + 1)
+        return sorted(points)
+
+def _charset_of(items):
+    """
+    Converts the items of a parsed [...] set into a character set.
+    """
+    ranges = []
+    negate = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            ranges.append((av, av))
+        elif op == sre_constants.RANGE:
+            ranges.append(av)
+        elif op == sre_constants.CATEGORY and av in _CATEGORIES:
+            if av in _NEGATED_CATEGORIES:
+                ranges.extend(_negate(_CATEGORIES[av]))
+            else:
+                ranges.extend(_CATEGORIES[av])
+        else:
+            raise NotRegular("Unsupported set item: %s." % op)
+    ranges = _normalize(ranges)
+    if negate:
+        ranges = _negate(ranges)
+    return ranges
+
+def _normalize(ranges):
+    """
+    Sorts and merges a list of ranges.
+    """
+    result = []
+    for low, high in sorted(ranges):
+        if result and low <= result[-1][1] + 1:
+            if high > result[-1][1]:
+                result[-1] = (result[-1][0], high)
+        else:
+            result.append((low, high))
+    return result
+
+def _negate(ranges):
+    """
+    Returns the complement of a normalized list of ranges.
+    """
+    result = []
+    low = 0
+    for first, last in _normalize(ranges):
+        if first > low:
+            result.append((low, first - 1))
+        low = last + 1
+    if low <= _MAX_CODE:
+        result.append((low, _MAX_CODE))
+    return result
+
+def _classes_in(boundaries, charset):
+    """
+    Returns the indices of the character classes within a set.
+    """
+    result = []
+    for low, high in charset:
+        first = bisect.bisect_right(boundaries, low) - 1
+        last = bisect.bisect_right(boundaries, high) - 1
+        result.extend(range(first, last + 1))
+    return result
@@ -0,0 +1,434 @@
+"""
+An Earley recogniser working over an integer-coded Grammar.
+
+An Earley item is coded as a single integer, origin * item_count +
+item, so moving its dot on is adding one to it. Each Earley set keeps
+its items in a list (in the order they were added, which is the order
+they are processed), with a hashed set for membership tests, an index
+of the items waiting on each nonterminal for the completer, and the
+links the tree builder follows back from each item made by the
+completer to the completed items that made it.
+
+Items whose origin is their own set were all added by prediction, and
+any symbols before their dot derived the empty string, so they have
+no links. Where an item from an earlier set had its dot moved over a
+nonterminal that derived the empty string, its links include NULL.
+
+The items a set is seeded with by the scanner (its kernel) come
+first, so a set can be made again from them if the terminal at its
+position changes.
+"""
+
+# The link for a nonterminal that derived the empty string.
+NULL = -1
+
+# Marks a Leo item that hasn't been worked out yet.
+_UNKNOWN = object()
+
+class EarleySet(object):
+    """
+    The items of the Earley set at one input position.
+    """
+    __slots__ = (
+        'items', 'kernel', 'members', 'waiting', 'links', 'leo', 'leo_links'
+        )
+
+    def __init__(self, items):
+        self.items = items
+        self.kernel = len(items)
+        self.members = set(items)
+        self.waiting = {}
+        self.links = {}
+        self.leo = {}
+        self.leo_links = {}
+
+    def __len__(self):
+        return len(self.items)
+
+class EarleyRecognizer(object):
+    """
+    Builds the Earley sets for a sequence of terminals, one position
+    at a time.
+
+    The algorithm is that of J. Earley, "An Efficient Context-Free
+    Parsing Algorithm", CACM 13(2), pp. 94-102, with the predictor
+    filtered by the lookahead terminal, and with the handling of
+    nullable nonterminals of J. Aycock and R. N. Horspool (see
+    Grammar): an item is moved over a nullable nonterminal as soon as
+    it reaches one, so the completer never has to deal with empty
+    derivations.
+
+    Right recursion is handled in linear time by J. Leo's
+    optimisation ("A general context-free parsing algorithm running
+    in linear time on every LR(k) grammar without using lookahead",
+    Theoretical Computer Science 82, pp. 165-176). When a completion
+    would only start a deterministic chain of further completions (each
+    finishing the single item waiting in its origin set, with nothing
+    after the dot), only the item at the top of the chain is added.
+    The links to the items skipped over are recreated by links() if
+    the tree builder asks for them.
+    """
+    def __init__(self, grammar):
+        self.grammar = grammar
+        seed = [grammar.start_item]
+        while grammar.item_next[seed[-1]] in grammar.nullable:
+            seed.append(seed[-1] + 1)
+        self.sets = {0: EarleySet(seed)}
+
+    def step(self, i, terminal):
+        """
+        Completes the Earley set at position i, given the number of
+        the terminal at that position, and seeds the set after it with
+        the items that scan the terminal. Returns False if the next
+        set is empty, meaning the terminal is a syntax error.
+        """
+        grammar = self.grammar
+        item_count = grammar.item_count
+        item_next = grammar.item_next
+        item_lhs = grammar.item_lhs
+        nonterminal_count = grammar.nonterminal_count
+        nullable = grammar.nullable
+        predictions = grammar.predictions
+        prediction_symbols = grammar.prediction_symbols
+        sets = self.sets
+
+        current = sets[i]
+        items = current.items
+        members = current.members
+        waiting = current.waiting
+        links = current.links
+
+        base = i * item_count
+        scanned = []
+        predicted = set()
+
+        for code in items:
+            origin, item = divmod(code, item_count)
+            symbol = item_next[item]
+
+            #
+            #  A -> a . (completer)
+            #
+            if symbol < 0:
+                if origin == i:
+                    # An empty derivation, which the items waiting on
+                    # it have been moved over already.
+                    continue
+                lhs = item_lhs[item]
+                top = sets[origin].leo.get(lhs, _UNKNOWN)
+                if top is _UNKNOWN:
+                    top = self._leo_item(origin, lhs)
+                if top is not None:
+                    if top not in members:
+                        members.add(top)
+                        items.append(top)
+                        links[top] = []
+                    if top in current.leo_links:
+                        current.leo_links[top].append(code)
+                    else:
+                        current.leo_links[top] = [code]
+                    continue
+                for parent in sets[origin].waiting.get(lhs, ()):
+                    new = parent + 1
+                    if new in members:
+                        links[new].append(code)
+                    else:
+                        members.add(new)
+                        items.append(new)
+                        links[new] = [code]
+
+            #
+            #  A -> a . B (predictor)
+            #
+            elif symbol < nonterminal_count:
+                if symbol in waiting:
+                    waiting[symbol].append(code)
+                else:
+                    waiting[symbol] = [code]
+
+                if symbol not in predicted:
+                    predicted.update(prediction_symbols[symbol])
+                    for item in predictions[symbol][terminal]:
+                        new = base + item
+                        if new not in members:
+                            members.add(new)
+                            items.append(new)
+
+                # Predicted items have been moved over nullable
+                # symbols by the prediction table.
+                if symbol in nullable and origin != i:
+                    new = code + 1
+                    if new in members:
+                        links[new].append(NULL)
+                    else:
+                        members.add(new)
+                        items.append(new)
+                        links[new] = [NULL]
+
+            #
+            #  A -> a . c (scanner)
+            #
+            elif symbol == terminal:
+                scanned.append(code + 1)
+
+        sets[i + 1] = EarleySet(scanned)
+        return len(scanned) > 0
+
+    def accepted(self, i):
+        """
+        Checks if the start rule is complete in the set at position i.
+        """
+        return self.grammar.accept_item in self.sets[i].members
+
+    def links(self, i, code):
+        """
+        Returns the list of completed items in set i that the item with
+        the given code was made by completing, or None if it was made
+        by the scanner.
+        """
+        for step in self.expand_steps(i, code):
+            pass
+        return self.sets[i].links.get(code)
+
+    def expand_steps(self, i, code):
+        """
+        Recreates the links of the items skipped by the Leo chains that
+        end at the item with the given code in set i, as links does
+        when first asked for them, generating the number of links made
+        after each. A right recursion's chain is as long as the input.
+        """
+        current = self.sets[i]
+        if code in current.leo_links:
+            made = 0
+            for child in current.leo_links.pop(code):
+                for made in self._expand_leo(current, code, child, made):
+                    yield made
+
+    def update(self, terminals, start, old_end, new_end):
+        """
+        Brings the sets up to date after an edit to the terminals they
+        were built from, which replaced the terminals from start to
+        old_end with those from start to new_end. Terminals is the whole
+        new list. Returns the position of the first terminal that is a
+        syntax error, or None.
+
+        The sets before start are kept, and the sets from start on are
+        made again until one is seeded with the same items as the old
+        set at the same place after the edit, where the sets those
+        items go back to are waiting on the same items as before. The
+        old sets are the same from there on, and are kept, with the
+        positions in their items moved along by the change in length.
+        """
+        item_count = self.grammar.item_count
+        old = self.sets
+        delta = new_end - old_end
+        sets = self.sets = {}
+        for i in xrange(start):
+            sets[i] = old[i]
+        kept = old[start]
+        sets[start] = EarleySet(kept.items[:kept.kernel])
+
+        # Whether each set made again is waiting on the same items as
+        # the old set at the same place, and so will complete them in
+        # the same way.
+        same = {}
+        for i in xrange(start, len(terminals)):
+            if not self.step(i, terminals[i]):
+                return i
+            q = _old_position(i, start, old_end, new_end)
+            same[i] = q is not None and self._same_waiting(
+                sets[i], old[q], i, start, old_end, new_end, same
+                )
+
+            # Has the next set converged with the old one?
+            q = _old_position(i + 1, start, old_end, new_end)
+            if q is None:
+                continue
+            kernel = sets[i + 1].items
+            if kernel != self._moved_codes(
+                old[q].items[:old[q].kernel], start, old_end, new_end
+                ):
+                continue
+            for code in kernel:
+                origin = code // item_count
+                if origin >= start and not same.get(origin):
+                    break
+            else:
+                for j in xrange(q, len(old)):
+                    sets[j + delta] = self._moved_set(
+                        old[j], old_end * item_count, delta * item_count
+                        )
+                return None
+        return None
+
+    def _same_waiting(self, current, previous, i, start, old_end, new_end,
+                      same):
+        """
+        Checks if the new set at position i is waiting on the same
+        items as the previous one at its place, and if the sets those
+        items came from are too.
+        """
+        item_count = self.grammar.item_count
+        waiting = current.waiting
+        if len(waiting) != len(previous.waiting):
+            return False
+        for symbol, codes in previous.waiting.iteritems():
+            codes = self._moved_codes(codes, start, old_end, new_end)
+            if codes is None or waiting.get(symbol) != codes:
+                return False
+            for code in codes:
+                origin = code // item_count
+                if origin >= start and origin != i and not same.get(origin):
+                    return False
+        return True
+
+    def _moved_codes(self, codes, start, old_end, new_end):
+        """
+        Returns the given codes from the old sets, with their origins
+        moved to their places after the edit, or None if one of them
+        started in the part of the input replaced.
+        """
+        item_count = self.grammar.item_count
+        result = []
+        for code in codes:
+            origin, item = divmod(code, item_count)
+            origin = _new_position(origin, start, old_end, new_end)
+            if origin is None:
+                return None
+            result.append(origin * item_count + item)
+        return result
+
+    def _moved_set(self, old, threshold, offset):
+        """
+        Returns a copy of an old set, with the offset added to the codes
+        of its items at or above the threshold (those starting after the
+        edit). If the offset is zero, the old set itself is returned.
+        """
+        if offset == 0:
+            return old
+
+        moved = EarleySet([
+                code + offset if code >= threshold else code
+                for code in old.items
+                ])
+        moved.kernel = old.kernel
+        for symbol, codes in old.waiting.iteritems():
+            moved.waiting[symbol] = [
+                code + offset if code >= threshold else code
+                for code in codes
+                ]
+        for code, links in old.links.iteritems():
+            if code >= threshold:
+                code += offset
+            moved.links[code] = [
+                link + offset if link >= threshold else link
+                for link in links
+                ]
+        for symbol, top in old.leo.iteritems():
+            if top is not None and top >= threshold:
+                top += offset
+            moved.leo[symbol] = top
+        for code, links in old.leo_links.iteritems():
+            if code >= threshold:
+                code += offset
+            moved.leo_links[code] = [
+                link + offset if link >= threshold else link
+                for link in links
+                ]
+        return moved
+
+    def _leo_item(self, j, symbol):
+        """
+        Returns the code of the topmost item of the deterministic
+        chain of completions started by completing the given symbol
+        with origin j, or None if completing it isn't deterministic.
+        The result is memoised in set j, which must be finished.
+        """
+        grammar = self.grammar
+        item_count = grammar.item_count
+
+        # Follow the chain until it stops, or reaches a known result.
+        steps = []
+        seen = set()
+        top = None
+        while (j, symbol) not in seen:
+            seen.add((j, symbol))
+            leo = self.sets[j].leo
+            if symbol in leo:
+                if leo[symbol] is not None:
+                    top = leo[symbol]
+                break
+            waiting = self.sets[j].waiting.get(symbol, ())
+            if len(waiting) == 1:
+                advanced = waiting[0] + 1
+                item = advanced % item_count
+            if len(waiting) != 1 or grammar.item_next[item] >= 0:
+                leo[symbol] = None
+                break
+            steps.append((leo, symbol))
+            top = advanced
+            j = advanced // item_count
+            symbol = grammar.item_lhs[item]
+        else:
+            # A cycle of unit rules, which isn't followed.
+            top = None
+
+        # Every step of the chain leads to the same top item.
+        for leo, symbol in steps:
+            leo[symbol] = top
+        return top
+
+    def _expand_leo(self, current, top, child, made):
+        """
+        Recreates the links of the items skipped between the given
+        completed child and the top item of its Leo chain, generating
+        the number of links made after each, counting on from made.
+        """
+        grammar = self.grammar
+        item_count = grammar.item_count
+        links = current.links
+        while True:
+            origin, item = divmod(child, item_count)
+            parent = self.sets[origin].waiting[grammar.item_lhs[item]][0]
+            advanced = parent + 1
+            if advanced in links:
+                if child in links[advanced]:
+                    # The rest of the chain has been expanded already.
+                    return
+                links[advanced].append(child)
+            else:
+                links[advanced] = [child]
+            made += 1
+            yield made
+            if advanced == top:
+                return
+            child = advanced
+
+# ..........................................................................
+# Internal functions
+
+def _old_position(i, start, old_end, new_end):
+    """
+    Returns the position before an edit of the position i after it, or
+    None if it is inside the part of the input replaced.
+    """
+    if i < start:
+        return i
+    if i >= new_end:
+        return i - new_end + old_end
+    if i == start and old_end > start:
+        return i
+    return None
+
+def _new_position(i, start, old_end, new_end):
+    """
+    Returns the position after an edit of the position i before it, or
+    None if it is inside the part of the input replaced.
+    """
+    if i < start:
+        return i
+    if i >= old_end:
+        return i - old_end + new_end
+    if i == start and new_end > start:
+        return i
+    return None
@@ -3,6 +3,10 @@ class SparkleErrorBase(Exception):
         super(SparkleErrorBase, self).__init__(message)
         self.position = position
 
+    def __reduce__(self):
+        # So that errors can be pickled back from worker processes.
+        return self.__class__, (self.args[0], self.position)
+
 class SparkleInternalError(SparkleErrorBase):
     pass
 
@@ -11,3 +15,10 @@ class SparkleSyntaxError(SparkleErrorBase):
 
 class SparkleError(SparkleErrorBase):
     pass
+
+class SparkleTimeoutError(SparkleError):
+    """
+    Raised when a sliced scan or parse passes its deadline. The
+    position is how far it got.
+    """
+    pass
@@ -0,0 +1,504 @@
+"""
+The shared packed parse forest of an Earley parse.
+
+The forest isn't built as a separate structure: the Earley sets and
+the links the recogniser records between their items already are one.
+A node is an (item code, position) pair, standing for the item's rule
+matched from the item's origin up to the position, as far as its dot.
+The alternatives of a node are the ways the symbol before its dot was
+matched, and each leads back to the node for the rest of the rule.
+"""
+from earley import NULL
+
+INFINITY = float('inf')
+
+# The alternative for a terminal, matched by the token before the
+# node's position.
+TOKEN = -2
+
+_TOKEN_ONLY = (TOKEN,)
+_NULL_ONLY = (NULL,)
+
+class ParseForest(object):
+    """
+    All the parses of a sequence of tokens, read from the Earley sets
+    of an EarleyRecognizer that accepted them.
+
+    Nothing is built until asked for. count() counts the parse trees,
+    trees() builds them one at a time, and best() builds the highest
+    scoring one, each in time polynomial in the size of the forest
+    (trees() per tree). A tree is built as the parser would, by calling
+    the parser's rule functions.
+
+    If the grammar is cyclic, a parse can have infinitely many trees,
+    nesting a nonterminal in itself any number of times. Only the trees
+    where each nonterminal is nested no deeper than it needs to be are
+    then built.
+    """
+    def __init__(self, grammar, recognizer, tokens, rule2func):
+        """
+        Tokens is the sequence the recogniser was run over, including
+        the end of file marker, and rule2func the parser's map from
+        rules to the functions building their results.
+        """
+        self.grammar = grammar
+        self.recognizer = recognizer
+        self.tokens = tokens
+        self.rule2func = rule2func
+        self.root = (grammar.accept_item, len(tokens))
+        self._heights = None
+        self._empty_rules = None
+        self._empty_counts = {}
+
+    def count(self):
+        """
+        Returns the number of parse trees in the forest, which is
+        INFINITY if the grammar's cycles give it infinitely many.
+        """
+        def parts(node):
+            result = []
+            if self.dot(node) > 0:
+                for alternative in self.alternatives(node):
+                    result.append(self.previous(node, alternative))
+                    if alternative >= 0:
+                        result.append((alternative, node[1]))
+            return result
+
+        def combine(node, counts):
+            if self.dot(node) == 0:
+                return 1
+            total = 0
+            counts = iter(counts)
+            for alternative in self.alternatives(node):
+                count = counts.next()
+                if alternative >= 0:
+                    count *= counts.next()
+                elif alternative == NULL:
+                    count *= self._count_empty(self.symbol(node), set())
+                total += count
+            return total
+
+        values = _evaluate(self.root, parts, combine)
+        if values is None:
+            return INFINITY
+        return values[self.root]
+
+    def trees(self):
+        """
+        Generates the result of each parse tree in turn.
+        """
+        # The choices taken at each point with more than one option,
+        # in the order the points are reached, as [index, options].
+        choices = []
+        while True:
+            reached = [0]
+
+            def choose(options):
+                if len(options) == 1:
+                    return options[0]
+                point = reached[0]
+                reached[0] = point + 1
+                if point == len(choices):
+                    choices.append([0, len(options)])
+                return options[choices[point][0]]
+
+            def empty(symbol, i):
+                rule_index = choose(self._rules_for_empty(symbol))
+                return self._call(rule_index, [
+                        empty(child, i) for child in self._rhs(rule_index)
+                        ])
+
+            yield self.build(
+                lambda node, height: choose(self._options(node, height)),
+                empty
+                )
+
+            # Move on to the next set of choices.
+            while choices and choices[-1][0] == choices[-1][1] - 1:
+                choices.pop()
+            if not choices:
+                return
+            choices[-1][0] += 1
+
+    def best(self, score):
+        """
+        Returns the result of the parse tree with the highest total
+        score, where score is a function returning the score of each
+        use of a rule, given the rule's (lhs, rhs) tuple. Ties go to the
+        first tree that trees() would give.
+        """
+        rules = self.grammar.rules
+        empty_scores = {}
+
+        def score_empty(symbol):
+            if symbol not in empty_scores:
+                empty_scores[symbol] = max([
+                        (score_rule(rule_index), rule_index)
+                        for rule_index in self._rules_for_empty(symbol)
+                        ], key=lambda (value, rule_index): value)
+            return empty_scores[symbol]
+
+        def score_rule(rule_index):
+            value = 0
+            if rule_index != 0:
+                value = score(rules[rule_index])
+            for child in self._rhs(rule_index):
+                value += score_empty(child)[0]
+            return value
+
+        # The best score of a node, and the alternative that gives it.
+        def parts(key):
+            node, height = key
+            result = []
+            if self.dot(node) == 0:
+                return result
+            for alternative in self._options(node, height):
+                result.append((self.previous(node, alternative), height))
+                if alternative >= 0:
+                    child = alternative, node[1]
+                    result.append((child, self._height(child)))
+            return result
+
+        def combine(key, values):
+            node, height = key
+            if self.dot(node) == 0:
+                return 0, None
+            best = None
+            values = iter(values)
+            for alternative in self._options(node, height):
+                value = values.next()[0]
+                if alternative >= 0:
+                    value += values.next()[0] + score(
+                        rules[self.rule((alternative, node[1]))]
+                        )
+                elif alternative == NULL:
+                    value += score_empty(self.symbol(node))[0]
+                if best is None or value > best[0]:
+                    best = value, alternative
+            return best
+
+        root = self.root, self._height(self.root)
+        values = _evaluate(root, parts, combine)
+
+        def empty(symbol, i):
+            rule_index = score_empty(symbol)[1]
+            return self._call(rule_index, [
+                    empty(child, i) for child in self._rhs(rule_index)
+                    ])
+
+        return self.build(lambda node, height: values[node, height][1], empty)
+
+    def build(self, choose, empty, done=None):
+        """
+        Builds one parse tree, calling choose(node, height) to pick the
+        alternative to take at each node, and empty(symbol, position)
+        for the result of each nonterminal deriving the empty string.
+        The height is the one the node's derivation must fit in, for
+        passing on to finite_alternatives, or None if the grammar isn't
+        cyclic.
+
+        If done is given, it is a dictionary of the results of completed
+        nodes, which are used rather than building the nodes again, and
+        the result of each completed node built is added to it.
+        """
+        result = []
+        for steps in self.build_steps(choose, empty, done, None, result):
+            pass
+        return result[0]
+
+    def build_steps(self, choose, empty, done, check, result):
+        """
+        Builds one parse tree as build does, stopping to generate the
+        number of steps taken after each check steps (if check isn't
+        None), and appends it to the result list when done. Each step
+        takes one alternative, calls one rule function, or recreates
+        one link skipped by the recogniser's Leo chains, which are
+        expanded a step at a time here rather than all at once by
+        alternatives.
+
+        Each node is walked back from the end of its rule, as the
+        reference parser's _build_tree_recursive does, so the rule
+        functions are called in the same order. The nodes being walked
+        are kept on an explicit stack, so the depth of the input is
+        not limited by Python's recursion limit, and each node's
+        arguments are collected in reverse and turned round once, so
+        building takes linear time.
+        """
+        grammar = self.grammar
+        tokens = self.tokens
+        item_count = grammar.item_count
+        item_rule = grammar.item_rule
+        expand_steps = self.recognizer.expand_steps
+
+        # Each frame is the [code, position, dot, reversed arguments,
+        # height, completed node] of a node being walked.
+        steps = 0
+        pause = check or -1
+        code, i = self.root
+        frames = [[
+                code, i, self.dot(self.root), [], self._height(self.root),
+                self.root
+                ]]
+        while True:
+            steps += 1
+            if steps == pause:
+                yield steps
+                pause += check
+            frame = frames[-1]
+            code, i, dot, args, height, completed = frame
+            if dot == 0:
+                frames.pop()
+                args.reverse()
+                value = self._call(item_rule[code % item_count], args)
+                if done is not None:
+                    done[completed] = value
+                if not frames:
+                    result.append(value)
+                    return
+                frames[-1][3].append(value)
+                continue
+
+            node = code, i
+            if check is not None:
+                for made in expand_steps(i, code):
+                    steps += 1
+                    if steps == pause:
+                        yield steps
+                        pause += check
+            child = choose(node, height)
+            if child == TOKEN:
+                args.append(tokens[i - 1])
+            elif child == NULL:
+                args.append(empty(self.symbol(node), i))
+            elif done is not None and (child, i) in done:
+                args.append(done[child, i])
+            else:
+                child_node = child, i
+                frames.append([
+                        child, i, self.dot(child_node), [],
+                        self._height(child_node), child_node
+                        ])
+            frame[0], frame[1] = self.previous(node, child)
+            frame[2] = dot - 1
+
+    def rule(self, node):
+        """
+        Returns the index of the rule of the given node's item.
+        """
+        return self.grammar.item_rule[node[0] % self.grammar.item_count]
+
+    def dot(self, node):
+        """
+        Returns the number of symbols of its rule the given node has
+        matched.
+        """
+        item = node[0] % self.grammar.item_count
+        return item - self.grammar.rule_items[self.grammar.item_rule[item]]
+
+    def symbol(self, node):
+        """
+        Returns the number of the symbol before the given node's dot.
+        """
+        return self.grammar.item_next[node[0] % self.grammar.item_count - 1]
+
+    def alternatives(self, node):
+        """
+        Returns the ways the symbol before the given node's dot was
+        matched: TOKEN for a terminal, NULL for a nonterminal that
+        derived the empty string, or the codes of the completed items
+        (ending at the node's position) for one that didn't. Several
+        codes, or a code and NULL, are an ambiguity.
+        """
+        code, i = node
+        if code // self.grammar.item_count == i:
+            return _NULL_ONLY
+        links = self.recognizer.links(i, code)
+        if links is None:
+            return _TOKEN_ONLY
+        return links
+
+    def previous(self, node, alternative):
+        """
+        Returns the node for the rest of the given node's rule, before
+        the symbol matched by the given alternative.
+        """
+        code, i = node
+        if alternative == TOKEN:
+            return code - 1, i - 1
+        if alternative == NULL:
+            return code - 1, i
+        return code - 1, alternative // self.grammar.item_count
+
+    def height(self, node):
+        """
+        Returns the height of the shortest derivation of the given
+        node, counting the nonterminals nested in it. This is only
+        needed if the grammar is cyclic, where some derivations go
+        round a cycle forever.
+        """
+        if self._heights is None:
+            self._heights = self._find_heights()
+        return self._heights[node]
+
+    def finite_alternatives(self, node, height):
+        """
+        Returns the alternatives of the given node that lead to a
+        derivation no higher than the given height. Choosing from these
+        at every node, with the height of the completed node being
+        built, never goes round a cycle.
+        """
+        result = []
+        for alternative in self.alternatives(node):
+            if alternative >= 0:
+                child = self.height((alternative, node[1])) + 1
+            else:
+                child = 0
+            previous = self.height(self.previous(node, alternative))
+            if max(child, previous) <= height:
+                result.append(alternative)
+        return result
+
+    # ........................................................................
+    # Internal functions
+
+    def _height(self, node):
+        if self.grammar.cyclic:
+            return self.height(node)
+        return None
+
+    def _options(self, node, height):
+        if height is None:
+            return self.alternatives(node)
+        return self.finite_alternatives(node, height)
+
+    def _call(self, rule_index, args):
+        rule = self.grammar.rules[rule_index]
+        return self.rule2func[rule](args)
+
+    def _rhs(self, rule_index):
+        """
+        Returns the numbers of the symbols of a rule.
+        """
+        grammar = self.grammar
+        first = grammar.rule_items[rule_index]
+        return grammar.item_next[
+            first:first + len(grammar.rules[rule_index][1])
+            ]
+
+    def _rules_for_empty(self, symbol, every=False):
+        """
+        Returns the rules the given nullable nonterminal's empty
+        derivations can start with. In a cyclic grammar, these are
+        only the ones nesting it no deeper than it needs to be, unless
+        every rule is asked for.
+        """
+        grammar = self.grammar
+        if grammar.cyclic and not every:
+            return grammar.null_rules[symbol]
+        if self._empty_rules is None:
+            self._empty_rules = {}
+            for index in range(len(grammar.rules)):
+                lhs = grammar.item_lhs[grammar.rule_items[index]]
+                if all([child in grammar.nullable
+                        for child in self._rhs(index)]):
+                    self._empty_rules.setdefault(lhs, []).append(index)
+        return self._empty_rules[symbol]
+
+    def _count_empty(self, symbol, nesting):
+        """
+        Counts the empty derivations of the given nullable nonterminal,
+        within the given set of nonterminals being derived. A count is
+        infinite if the nonterminal can be nested in itself, whatever
+        it is nested in, so counts can be kept.
+        """
+        if symbol in self._empty_counts:
+            return self._empty_counts[symbol]
+        if symbol in nesting:
+            return INFINITY
+        nesting.add(symbol)
+        total = 0
+        for index in self._rules_for_empty(symbol, True):
+            count = 1
+            for child in self._rhs(index):
+                count *= self._count_empty(child, nesting)
+            total += count
+        nesting.remove(symbol)
+        self._empty_counts[symbol] = total
+        return total
+
+    def _find_heights(self):
+        """
+        Finds the height of every node reachable from the root.
+        """
+        # Find the nodes, and the nodes each one is made from.
+        parts = {}
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            if node in parts:
+                continue
+            parts[node] = made = []
+            if self.dot(node) == 0:
+                continue
+            for alternative in self.alternatives(node):
+                previous = self.previous(node, alternative)
+                if alternative >= 0:
+                    child = (alternative, node[1])
+                    pending.append(child)
+                else:
+                    child = None
+                made.append((child, previous))
+                pending.append(previous)
+
+        heights = dict([(node, INFINITY) for node in parts])
+        changed = True
+        while changed:
+            changed = False
+            for node, made in parts.items():
+                if not made:
+                    height = 0
+                else:
+                    height = INFINITY
+                    for child, previous in made:
+                        if child is None:
+                            child_height = 0
+                        else:
+                            child_height = heights[child] + 1
+                        height = min(
+                            height, max(child_height, heights[previous])
+                            )
+                if height < heights[node]:
+                    heights[node] = height
+                    changed = True
+        return heights
+
+def _evaluate(root, parts, combine):
+    """
+    Evaluates a function over the nodes below the root, bottom up and
+    without recursion. parts(node) returns the nodes a node's value is
+    made from, and combine(node, values) makes it from their values.
+    Returns the dictionary of the values, or None if the nodes are
+    made from each other in a cycle.
+    """
+    values = {}
+    made = {}
+    stack = [root]
+    while stack:
+        node = stack[-1]
+        if node in values:
+            stack.pop()
+            continue
+        if node not in made:
+            made[node] = parts(node)
+            missing = [part for part in made[node] if part not in values]
+            if missing:
+                for part in missing:
+                    if part in made:
+                        # Started but not finished, so it is made from
+                        # this node.
+                        return None
+                stack.extend(missing)
+                continue
+        values[node] = combine(node, [values[part] for part in made[node]])
+        stack.pop()
+    return values
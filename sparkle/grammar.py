@@ -0,0 +1,261 @@
+class Grammar(object):
+    """
+    A parser's rules compiled into integer-coded tables for the Earley
+    recogniser. Once built, a Grammar is read-only plain data, so it
+    can be pickled, and cached (see tables.TableCache).
+
+    Symbols are numbered with the nonterminals first, so a symbol is a
+    terminal if its number is at least nonterminal_count. Each rule
+    has an item for each position of its dot, and the items of a rule
+    are numbered consecutively, so moving an item's dot over a symbol
+    is adding one to it. For each item, item_next holds the number of
+    the symbol after the dot (or -1 if the item is complete), item_lhs
+    the number of the rule's left hand side and item_rule the index
+    of the rule.
+
+    The prediction tables follow J. Aycock and R. N. Horspool,
+    "Practical Earley Parsing", The Computer Journal 45(6), pp. 620-630:
+    predicting a nonterminal adds, in one step, every item that the
+    predictor would go on to add, with the dot already moved over any
+    nullable nonterminals.
+    """
+    def __init__(self, rules, start_rule):
+        """
+        Compiles the given rules, each of which is a (lhs, rhs) tuple,
+        for parsing from the given start rule.
+        """
+        self.rules = [start_rule]
+        for rule in rules:
+            if rule not in self.rules:
+                self.rules.append(rule)
+
+        # Number the symbols.
+        self.symbols = []
+        for lhs, rhs in self.rules:
+            if lhs not in self.symbols:
+                self.symbols.append(lhs)
+        self.nonterminal_count = len(self.symbols)
+        for lhs, rhs in self.rules:
+            for symbol in rhs:
+                if symbol not in self.symbols:
+                    self.symbols.append(symbol)
+        self.symbol_ids = dict([
+                (symbol, index) for index, symbol in enumerate(self.symbols)
+                ])
+        self.terminal_ids = dict([
+                (symbol, index)
+                for index, symbol in enumerate(self.symbols)
+                if index >= self.nonterminal_count
+                ])
+
+        # Number the items.
+        self.rule_items = []
+        self.item_rule = []
+        self.item_lhs = []
+        self.item_next = []
+        for index, (lhs, rhs) in enumerate(self.rules):
+            lhs_id = self.symbol_ids[lhs]
+            self.rule_items.append(len(self.item_rule))
+            for symbol in rhs:
+                self.item_rule.append(index)
+                self.item_lhs.append(lhs_id)
+                self.item_next.append(self.symbol_ids[symbol])
+            self.item_rule.append(index)
+            self.item_lhs.append(lhs_id)
+            self.item_next.append(-1)
+        self.item_count = len(self.item_rule)
+
+        self.start_item = self.rule_items[0]
+        self.accept_item = self.start_item + len(start_rule[1])
+
+        self._find_nullable()
+        self._find_cycles()
+        self._find_first()
+        self._make_predictions()
+        self._freeze()
+
+    def terminal_id(self, token_type):
+        """
+        Returns the number of the terminal symbol for the given token
+        type, or -1 if the grammar doesn't use it.
+        """
+        return self.terminal_ids.get(token_type, -1)
+
+    def predict(self, symbol, terminal):
+        """
+        Returns the items added by predicting the given nonterminal
+        before the given lookahead terminal.
+        """
+        return self.predictions[symbol][terminal]
+
+    # ........................................................................
+    # Internal functions
+
+    def _rhs_ids(self, rule_index):
+        lhs, rhs = self.rules[rule_index]
+        return [self.symbol_ids[symbol] for symbol in rhs]
+
+    def _find_nullable(self):
+        """
+        Finds the nonterminals that can derive the empty string, and
+        the rules to build each one's empty derivation from. These are
+        the rules needing the fewest levels of nesting, so building
+        from them always terminates, even in cyclic grammars.
+        """
+        self.nullable = set()
+        self.null_rules = {}
+        while True:
+            found = {}
+            for index, (lhs, rhs) in enumerate(self.rules):
+                lhs_id = self.symbol_ids[lhs]
+                if lhs_id in self.nullable:
+                    continue
+                if all([symbol in self.nullable
+                        for symbol in self._rhs_ids(index)]):
+                    found.setdefault(lhs_id, []).append(index)
+            if not found:
+                break
+            for lhs_id, rules in found.items():
+                self.nullable.add(lhs_id)
+                self.null_rules[lhs_id] = tuple(rules)
+
+    def _find_cycles(self):
+        """
+        Checks if any nonterminal can derive itself, in which case
+        some parses have an infinite number of trees.
+        """
+        # The nonterminals each one can derive on its own.
+        units = dict([
+                (symbol, set()) for symbol in range(self.nonterminal_count)
+                ])
+        for index, (lhs, rhs) in enumerate(self.rules):
+            rhs_ids = self._rhs_ids(index)
+            for position, symbol in enumerate(rhs_ids):
+                others = rhs_ids[:position] + rhs_ids[position + 1:]
+                if symbol < self.nonterminal_count and \
+                   all([other in self.nullable for other in others]):
+                    units[self.symbol_ids[lhs]].add(symbol)
+
+        self.cyclic = False
+        for symbol in units:
+            reached = set()
+            pending = list(units[symbol])
+            while pending:
+                target = pending.pop()
+                if target not in reached:
+                    reached.add(target)
+                    pending.extend(units[target])
+            if symbol in reached:
+                self.cyclic = True
+                return
+
+    def _find_first(self):
+        """
+        Finds the set of terminals that can begin each nonterminal.
+        """
+        self.first = dict([
+                (symbol, set()) for symbol in range(self.nonterminal_count)
+                ])
+        changed = True
+        while changed:
+            changed = False
+            for index, (lhs, rhs) in enumerate(self.rules):
+                first = self.first[self.symbol_ids[lhs]]
+                size = len(first)
+                first.update(self._first_of(self._rhs_ids(index)))
+                if len(first) != size:
+                    changed = True
+
+    def _first_of(self, symbols):
+        """
+        Returns the terminals that can begin the given symbol string.
+        """
+        result = set()
+        for symbol in symbols:
+            if symbol >= self.nonterminal_count:
+                result.add(symbol)
+                break
+            result.update(self.first[symbol])
+            if symbol not in self.nullable:
+                break
+        return result
+
+    def _make_predictions(self):
+        """
+        Builds the table of items added when predicting each
+        nonterminal. The row for a nonterminal is indexed by the
+        number of the lookahead terminal, and its last entry (so index
+        -1) is for tokens the grammar doesn't use. Items are left out
+        if the rest of them can neither begin with the lookahead nor
+        derive the empty string. prediction_symbols holds the
+        nonterminals whose predictions are included in each one's.
+        """
+        by_lhs = {}
+        for index, (lhs, rhs) in enumerate(self.rules):
+            by_lhs.setdefault(self.symbol_ids[lhs], []).append(
+                self.rule_items[index]
+                )
+
+        # The terminals that can begin the rest of each item, or None
+        # if the rest of it can derive the empty string.
+        item_first = []
+        for item in range(self.item_count):
+            rule_index = self.item_rule[item]
+            dot = item - self.rule_items[rule_index]
+            rest = self._rhs_ids(rule_index)[dot:]
+            if all([symbol in self.nullable for symbol in rest]):
+                item_first.append(None)
+            else:
+                item_first.append(self._first_of(rest))
+
+        # Identical rows of items are shared.
+        shared = {}
+        self.predictions = []
+        self.prediction_symbols = []
+        terminals = range(self.nonterminal_count, len(self.symbols)) + [-1]
+        for symbol in range(self.nonterminal_count):
+            closure = list(by_lhs[symbol])
+            members = set(closure)
+            expanded = set([symbol])
+            for item in closure:
+                next_symbol = self.item_next[item]
+                if not 0 <= next_symbol < self.nonterminal_count:
+                    continue
+                if next_symbol not in expanded:
+                    expanded.add(next_symbol)
+                    for new in by_lhs[next_symbol]:
+                        if new not in members:
+                            members.add(new)
+                            closure.append(new)
+                if next_symbol in self.nullable and item + 1 not in members:
+                    members.add(item + 1)
+                    closure.append(item + 1)
+
+            row = [()] * (len(self.symbols) + 1)
+            for terminal in terminals:
+                items = tuple([
+                        item for item in closure
+                        if item_first[item] is None
+                        or terminal in item_first[item]
+                        ])
+                row[terminal] = shared.setdefault(items, items)
+            self.predictions.append(tuple(row))
+            self.prediction_symbols.append(frozenset(expanded))
+
+    def _freeze(self):
+        """
+        Converts the tables into immutable types.
+        """
+        self.rules = tuple(self.rules)
+        self.symbols = tuple(self.symbols)
+        self.rule_items = tuple(self.rule_items)
+        self.item_rule = tuple(self.item_rule)
+        self.item_lhs = tuple(self.item_lhs)
+        self.item_next = tuple(self.item_next)
+        self.predictions = tuple(self.predictions)
+        self.prediction_symbols = tuple(self.prediction_symbols)
+        self.nullable = frozenset(self.nullable)
+        self.first = dict([
+                (symbol, frozenset(first))
+                for symbol, first in self.first.items()
+                ])
@@ -0,0 +1,221 @@
+"""
+Statistics on where a scanner or parser spends its time.
+
+Instrumentation is switched on by giving a scanner or parser a Stats
+object with set_stats. Until then nothing is recorded, and the only
+cost is a check per parse. A Stats can be shared by a scanner and a
+parser, to see both in one report.
+"""
+from timeit import default_timer
+
+class Counter(object):
+    """
+    A count of calls to something, and the time they took in total.
+    """
+    __slots__ = ('count', 'time')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __repr__(self):
+        return 'Counter(%d, %.6f)' % (self.count, self.time)
+
+class Stats(object):
+    """
+    The statistics recorded by instrumented scanners and parsers.
+
+    For scanners, match_calls holds a Counter for each state, of the
+    calls to its matcher to find the longest match at a position, and
+    the time they took. rule_attempts holds a Counter for each t_*
+    rule, of the times the matcher tried it, as the matcher itself
+    reports them, and a share of the matcher's time, which is split
+    evenly between the rules each call tried. Which rules are tried is
+    up to the engine: the 'reference' engine tries every rule, the
+    'combined' engine tries the rules of a master pattern up to the
+    one that matches, passing over rules that can't make a longer
+    match than one already found, the 'dispatch' engine only tries the
+    rules that can start with the character at the position, and the
+    'dfa' engine tries all the rules compiled into its DFA at once.
+    rule_hits holds a Counter for each t_* rule, of the matches it won
+    and the time its function took.
+
+    For parsers, actions holds a Counter for each p_* function, of its
+    calls and their time, and ambiguities the number of ambiguities
+    _ambiguity resolved for each nonterminal. For the Earley engine,
+    set_sizes holds the size of the Earley set at each position of the
+    last input parsed, and items the number of items added to the sets
+    of every input parsed by the 'scanner', 'predictor' and
+    'completer' steps.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        self.match_calls = {}
+        self.rule_attempts = {}
+        self.rule_hits = {}
+        self.actions = {}
+        self.ambiguities = {}
+        self.set_sizes = []
+        self.items = {'scanner': 0, 'predictor': 0, 'completer': 0}
+
+    def timed(self, table, name, function):
+        """
+        Returns a wrapper for the given function that counts its calls
+        and their time in the Counter for the given name in the given
+        table. The function is kept as the wrapper's wrapped attribute.
+        """
+        counter = table.setdefault(name, Counter())
+        clock = default_timer
+
+        def _timed(*args):
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                counter.count += 1
+                counter.time += clock() - start
+        _timed.wrapped = function
+        return _timed
+
+    def timed_matcher(self, state, matcher, rules, names):
+        """
+        Returns a wrapper for the matcher of the given scanner state
+        that counts its calls and their time, counts the attempts at
+        each rule the matcher reports, and times the functions of the
+        rules it matches. Rules is the state's list of (function,
+        regex) pairs, and names maps each function to the name of its
+        rule.
+        """
+        counter = self.match_calls.setdefault(state, Counter())
+        timed = {}
+        attempts = []
+        for fn, regex in rules:
+            timed[fn] = self.timed(self.rule_hits, names[fn], fn)
+            attempts.append(
+                self.rule_attempts.setdefault(names[fn], Counter())
+                )
+        return _TimedMatcher(matcher, counter, timed, attempts)
+
+    def add_ambiguity(self, symbol):
+        """
+        Counts an ambiguity resolved for the given nonterminal.
+        """
+        self.ambiguities[symbol] = self.ambiguities.get(symbol, 0) + 1
+
+    def add_sets(self, sets, item_count):
+        """
+        Records the sizes of the given EarleyRecognizer sets, and the
+        steps that added their items. The items a set was seeded with
+        were added by the scanner, the others with the set as their
+        origin by the predictor, and the rest by the completer.
+        """
+        items = self.items
+        self.set_sizes = sizes = []
+        for i in xrange(len(sets)):
+            current = sets[i]
+            sizes.append(len(current.items))
+            base = i * item_count
+            predicted = 0
+            for code in current.items[current.kernel:]:
+                if code >= base:
+                    predicted += 1
+            items['scanner'] += current.kernel
+            items['predictor'] += predicted
+            items['completer'] += len(current.items) - current.kernel - \
+                predicted
+
+    def summary(self):
+        """
+        Returns a text report of the statistics, with the most costly
+        rules first.
+        """
+        lines = []
+        if self.match_calls:
+            lines.extend(_table(
+                    'Scanner state', 'calls', self.match_calls
+                    ))
+        if self.rule_attempts:
+            lines.extend(_table(
+                    'Scanner rule', 'attempts', self.rule_attempts
+                    ))
+        if self.rule_hits:
+            lines.extend(_table('Scanner rule', 'hits', self.rule_hits))
+        if self.actions:
+            lines.extend(_table('Parser action', 'calls', self.actions))
+        if self.set_sizes:
+            sizes = self.set_sizes
+            largest = max(sizes)
+            lines.append(
+                'Earley sets: %d positions, largest %d (at %d), mean %.1f'
+                % (len(sizes), largest, sizes.index(largest),
+                   float(sum(sizes)) / len(sizes))
+                )
+            lines.append(
+                'Earley items: %(scanner)d scanned, %(predictor)d '
+                'predicted, %(completer)d completed' % self.items
+                )
+        if self.ambiguities:
+            lines.append('%-32s %10s' % ('Ambiguity', 'resolved'))
+            for symbol, count in sorted(
+                    self.ambiguities.items(), key=lambda pair: -pair[1]
+                    ):
+                lines.append('  %-30s %10d' % (symbol, count))
+        return '\n'.join(lines)
+
+    __str__ = summary
+
+# ..........................................................................
+# Internal data and functions
+
+class _TimedMatcher(object):
+    """
+    Wraps a scanner state's matcher to count its calls and time, to
+    count the attempts at each rule it reports, sharing out the time
+    of each call between them, and to time the functions of the rules
+    it matches. Attempts is the list of the Counter of each rule.
+    """
+    def __init__(self, matcher, counter, timed, attempts):
+        self.matcher = matcher
+        self.counter = counter
+        self.timed = timed
+        self.attempts = attempts
+
+    def match(self, src_string, pos):
+        counter = self.counter
+        tried = []
+        start = default_timer()
+        best = self.matcher.match(src_string, pos, tried)
+        elapsed = default_timer() - start
+        counter.count += 1
+        counter.time += elapsed
+
+        if tried:
+            share = elapsed / len(tried)
+            attempts = self.attempts
+            for index in tried:
+                attempts[index].count += 1
+                attempts[index].time += share
+
+        if best is None:
+            return None
+        fn, end = best
+        return self.timed[fn], end
+
+def _table(title, count_name, counters):
+    """
+    Returns the lines of a table of the given counters, most costly
+    first.
+    """
+    lines = ['%-32s %10s %10s' % (title, count_name, 'time')]
+    for name, counter in sorted(
+            counters.items(), key=lambda pair: -pair[1].time
+            ):
+        lines.append(
+            '  %-30s %10d %9.4fs' % (name, counter.count, counter.time)
+            )
+    return lines
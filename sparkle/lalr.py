@@ -0,0 +1,231 @@
+"""
+Builds LALR(1) parse tables from an integer-coded Grammar.
+
+Many grammars are deterministic, and can be parsed by a shift-reduce
+parser in a single pass over the tokens, without building any Earley
+sets. The tables are built from the grammar's LR(0) automaton, with
+lookaheads worked out by the propagation method of Aho, Sethi and
+Ullman ("Compilers: Principles, Techniques, and Tools", section 4.7).
+If any state has a conflict, the grammar isn't LALR(1), and the
+conflicts are recorded so that the parser can fall back to Earley.
+"""
+
+# Stands for the lookahead of the item a closure was started from,
+# when working out which lookaheads propagate.
+_PROPAGATE = -2
+
+class LALRTable(object):
+    """
+    The LALR(1) tables for a Grammar. Like the Grammar, it is plain
+    data, so it can be pickled and cached.
+
+    States are numbered from 0, the start state. Actions[state] maps
+    each terminal number to the action on it: a state number to shift
+    to, or -1 - rule to reduce by the rule with that index. Terminals
+    with no action are syntax errors. Gotos[state] maps each
+    nonterminal to the state after reducing to it. Shifting the end
+    of file marker reaches accept_state, which ends the parse. The
+    left hand side and length of each rule are kept in rule_lhs and
+    rule_length.
+
+    Conflicts holds a (state, terminal) pair for each conflict found.
+    The tables can only be used if there are none.
+    """
+    def __init__(self, grammar):
+        self.rule_lhs = tuple([
+                grammar.item_lhs[item] for item in grammar.rule_items
+                ])
+        self.rule_length = tuple([
+                len(rhs) for lhs, rhs in grammar.rules
+                ])
+
+        # The items of each nonterminal's rules with the dot at the
+        # start.
+        by_lhs = {}
+        for index, item in enumerate(grammar.rule_items):
+            by_lhs.setdefault(self.rule_lhs[index], []).append(item)
+        self._by_lhs = by_lhs
+        self._grammar = grammar
+        self._find_rest_first()
+
+        kernels, transitions = self._make_automaton()
+        lookaheads = self._find_lookaheads(kernels, transitions)
+        self._make_actions(kernels, transitions, lookaheads)
+        del self._by_lhs, self._grammar, self._rest_first
+
+    # ........................................................................
+    # Internal functions
+
+    def _find_rest_first(self):
+        """
+        Finds, for each item, the terminals that can begin the symbols
+        from its dot to the end of its rule, and None among them if
+        those symbols can derive the empty string.
+        """
+        grammar = self._grammar
+        rest_first = [None] * grammar.item_count
+        for item in xrange(grammar.item_count - 1, -1, -1):
+            symbol = grammar.item_next[item]
+            if symbol < 0:
+                rest_first[item] = frozenset([None])
+            elif symbol >= grammar.nonterminal_count:
+                rest_first[item] = frozenset([symbol])
+            elif symbol in grammar.nullable:
+                rest_first[item] = grammar.first[symbol] | rest_first[item + 1]
+            else:
+                rest_first[item] = grammar.first[symbol]
+        self._rest_first = rest_first
+
+    def _closure(self, kernel):
+        """
+        Returns the LR(0) closure of the given items, as a list.
+        """
+        grammar = self._grammar
+        items = list(kernel)
+        members = set(items)
+        expanded = set()
+        for item in items:
+            symbol = grammar.item_next[item]
+            if 0 <= symbol < grammar.nonterminal_count and \
+                    symbol not in expanded:
+                expanded.add(symbol)
+                for new in self._by_lhs[symbol]:
+                    if new not in members:
+                        members.add(new)
+                        items.append(new)
+        return items
+
+    def _make_automaton(self):
+        """
+        Builds the LR(0) automaton. Returns the sorted kernel items of
+        each state, and a map from each state to its transitions on
+        each symbol.
+        """
+        grammar = self._grammar
+        start = (grammar.start_item,)
+        kernels = [start]
+        ids = {start: 0}
+        transitions = []
+        for kernel in kernels:
+            moves = {}
+            for item in self._closure(kernel):
+                symbol = grammar.item_next[item]
+                if symbol >= 0:
+                    moves.setdefault(symbol, []).append(item + 1)
+            targets = {}
+            for symbol, items in moves.items():
+                target = tuple(sorted(set(items)))
+                if target not in ids:
+                    ids[target] = len(kernels)
+                    kernels.append(target)
+                targets[symbol] = ids[target]
+            transitions.append(targets)
+        return kernels, transitions
+
+    def _lr1_closure(self, seeds):
+        """
+        Returns the LR(1) closure of the given map from items to sets
+        of lookaheads, as a map from each item to its lookaheads.
+        """
+        grammar = self._grammar
+        rest_first = self._rest_first
+        closure = dict([(item, set(seeds[item])) for item in seeds])
+        pending = list(closure)
+        while pending:
+            item = pending.pop()
+            symbol = grammar.item_next[item]
+            if not 0 <= symbol < grammar.nonterminal_count:
+                continue
+            following = rest_first[item + 1]
+            lookaheads = following - frozenset([None])
+            if None in following:
+                lookaheads = lookaheads | closure[item]
+            for new in self._by_lhs[symbol]:
+                if new not in closure:
+                    closure[new] = set(lookaheads)
+                    pending.append(new)
+                elif not lookaheads <= closure[new]:
+                    closure[new].update(lookaheads)
+                    pending.append(new)
+        return closure
+
+    def _find_lookaheads(self, kernels, transitions):
+        """
+        Works out the lookaheads of the kernel items of each state.
+        Returns a list with a map from item to lookaheads for each
+        state.
+        """
+        grammar = self._grammar
+        lookaheads = [
+            dict([(item, set()) for item in kernel]) for kernel in kernels
+            ]
+
+        # Find the lookaheads generated in each state, and where each
+        # kernel item's lookaheads propagate to.
+        propagates = {}
+        for state, kernel in enumerate(kernels):
+            for source in kernel:
+                closure = self._lr1_closure({source: [_PROPAGATE]})
+                for item, found in closure.iteritems():
+                    symbol = grammar.item_next[item]
+                    if symbol < 0:
+                        continue
+                    target = transitions[state][symbol], item + 1
+                    for lookahead in found:
+                        if lookahead == _PROPAGATE:
+                            propagates.setdefault(
+                                (state, source), []
+                                ).append(target)
+                        else:
+                            lookaheads[target[0]][target[1]].add(lookahead)
+
+        # Pass the lookaheads along until nothing changes.
+        changed = True
+        while changed:
+            changed = False
+            for (state, source), targets in propagates.iteritems():
+                found = lookaheads[state][source]
+                for target_state, target in targets:
+                    existing = lookaheads[target_state][target]
+                    if not found <= existing:
+                        existing.update(found)
+                        changed = True
+        return lookaheads
+
+    def _make_actions(self, kernels, transitions, lookaheads):
+        """
+        Fills in the action and goto tables, noting any conflicts.
+        """
+        grammar = self._grammar
+        nonterminal_count = grammar.nonterminal_count
+        actions = []
+        gotos = []
+        conflicts = []
+        for state, kernel in enumerate(kernels):
+            action = {}
+            goto = {}
+            for symbol, target in transitions[state].items():
+                if symbol < nonterminal_count:
+                    goto[symbol] = target
+                else:
+                    action[symbol] = target
+
+            closure = self._lr1_closure(lookaheads[state])
+            for item, found in sorted(closure.items()):
+                if grammar.item_next[item] >= 0:
+                    continue
+                reduction = -1 - grammar.item_rule[item]
+                for terminal in found:
+                    if action.get(terminal, reduction) != reduction:
+                        conflicts.append((state, terminal))
+                    else:
+                        action[terminal] = reduction
+            actions.append(action)
+            gotos.append(goto)
+
+        self.actions = tuple(actions)
+        self.gotos = tuple(gotos)
+        self.accept_state = transitions[
+            transitions[0][grammar.item_next[grammar.start_item]]
+            ][grammar.item_next[grammar.start_item + 1]]
+        self.conflicts = tuple(sorted(set(conflicts)))
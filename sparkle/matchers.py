@@ -0,0 +1,497 @@
+import re
+import sys
+import bisect
+import sre_parse
+import sre_constants
+
+class ReferenceMatcher(object):
+    """
+    Finds the longest match among a list of scanner rules by trying
+    each rule's regular expression in turn. This is the simplest
+    possible implementation, and is kept as the reference that the
+    faster matchers are checked against.
+    """
+    def __init__(self, rules, cache=None):
+        """
+        Rules is a list of (function, compiled regex) pairs, in the
+        order that ties should be broken. The matchers that compile
+        tables keep them in the given tables.TableCache, if any.
+        """
+        self.rules = rules
+
+    def match(self, src_string, pos, tried=None):
+        """
+        Returns a (function, end) pair for the longest non-empty match
+        at the given position, or None if no rule matched. If tried is
+        a list, the index of each rule tried is appended to it.
+        """
+        if tried is not None:
+            tried.extend(xrange(len(self.rules)))
+        longest = 0
+        best = None
+        for fn, regex in self.rules:
+            m = regex.match(src_string, pos)
+            if m is not None:
+                this_length = m.end() - pos
+                if this_length > longest:
+                    longest = this_length
+                    best = fn, m.end()
+        return best
+
+class CombinedMatcher(object):
+    """
+    Finds the longest match among a list of scanner rules using
+    master regular expressions.
+
+    The rules are joined into an alternation of groups. Python's
+    regex engine takes the first alternative that matches, so one call
+    tells us the earliest rule matching at the current position, and
+    that every rule before it failed. Matching again with the
+    alternation of the remaining rules finds the next candidate, and
+    so on. The regex engine is therefore entered once per rule that
+    actually matches (usually one to three), rather than once per
+    rule. The result is identical to the ReferenceMatcher.
+
+    Rules that can't safely be combined (because they use
+    backreferences, which would be renumbered, or inline flags, which
+    would leak into the other rules) are matched on their own, as are
+    batches that fail to compile together (duplicate group names, for
+    example).
+
+    The most characters each rule can match is worked out from its
+    pattern, so that the rules left can be passed over once none of
+    them could beat the longest match so far. The t_default rule,
+    which matches one character, is then almost never tried.
+
+    The rules are numbered by their index in the list, or by the
+    given list of indices, when reporting which were tried.
+    """
+
+    # Python's regex engine limits the number of groups in a pattern.
+    MAX_GROUPS = 99
+
+    def __init__(self, rules, cache=None, indices=None):
+        if indices is None:
+            indices = range(len(rules))
+        self.parts = []
+
+        batch = []
+        numbers = []
+        groups = 0
+        for index, (fn, regex) in zip(indices, rules):
+            if not _combinable(regex):
+                self._add_batch(batch, numbers)
+                self._add_rule(fn, regex, index)
+                batch, numbers, groups = [], [], 0
+                continue
+            if groups + regex.groups + 1 > self.MAX_GROUPS:
+                self._add_batch(batch, numbers)
+                batch, numbers, groups = [], [], 0
+            batch.append((fn, regex))
+            numbers.append(index)
+            groups += regex.groups + 1
+        self._add_batch(batch, numbers)
+
+    def _add_rule(self, fn, regex, index):
+        """
+        Adds a rule to be matched on its own.
+        """
+        self.parts.append(
+            ([regex], None, [fn], [_widths(regex)[1]], [index])
+            )
+
+    def _add_batch(self, batch, numbers):
+        """
+        Adds a batch of consecutive rules, whose indices are the given
+        numbers, to be matched with master patterns, falling back to
+        matching them separately if they can't be compiled together.
+        """
+        if len(batch) < 2:
+            for (fn, regex), index in zip(batch, numbers):
+                self._add_rule(fn, regex, index)
+            return
+
+        try:
+            first = self._compile_suffix(batch, 0)
+        except (re.error, OverflowError, AssertionError):
+            for (fn, regex), index in zip(batch, numbers):
+                self._add_rule(fn, regex, index)
+            return
+
+        # The most characters any rule from each index onwards can match.
+        reach = [_widths(regex)[1] for fn, regex in batch]
+        for index in range(len(reach) - 2, -1, -1):
+            reach[index] = max(reach[index], reach[index + 1])
+
+        # The master patterns for later suffixes are only compiled when
+        # they are first needed.
+        suffixes = [None] * len(batch)
+        suffixes[0] = first
+        self.parts.append(
+            (suffixes, batch, [fn for fn, regex in batch], reach, numbers)
+            )
+
+    def _compile_suffix(self, batch, index):
+        """
+        Compiles the alternation of the rules in the batch from the
+        given index onwards. Returns the pattern and a map from the
+        number of each wrapping group to the index of its rule.
+        """
+        group2rule = {}
+        pieces = []
+        group = 1
+        for rule in range(index, len(batch)):
+            regex = batch[rule][1]
+            group2rule[group] = rule
+            pieces.append('(%s)' % regex.pattern)
+            group += regex.groups + 1
+        return re.compile('|'.join(pieces)), group2rule
+
+    def match(self, src_string, pos, tried=None):
+        """
+        Returns a (function, end) pair for the longest non-empty match
+        at the given position, or None if no rule matched. If tried is
+        a list, the index of each rule tried is appended to it, where
+        a master pattern tries its rules up to the one that matches.
+        """
+        longest = pos
+        best = None
+        for suffixes, batch, fns, reach, numbers in self.parts:
+            if batch is None:
+                if pos + reach[0] <= longest:
+                    continue
+                if tried is not None:
+                    tried.append(numbers[0])
+                m = suffixes[0].match(src_string, pos)
+                if m is not None and m.end() > longest:
+                    longest = m.end()
+                    best = fns[0], longest
+                continue
+
+            index = 0
+            count = len(suffixes)
+            while index < count:
+                if pos + reach[index] <= longest:
+                    break
+                suffix = suffixes[index]
+                if suffix is None:
+                    suffix = suffixes[index] = \
+                        self._compile_suffix(batch, index)
+                regex, group2rule = suffix
+                m = regex.match(src_string, pos)
+                if m is None:
+                    if tried is not None:
+                        tried.extend(numbers[index:])
+                    break
+                rule = group2rule[m.lastindex]
+                if tried is not None:
+                    tried.extend(numbers[index:rule + 1])
+                if m.end() > longest:
+                    longest = m.end()
+                    best = fns[rule], longest
+                index = rule + 1
+        return best
+
+class DispatchMatcher(object):
+    """
+    Finds the longest match among a list of scanner rules by trying
+    only the rules that can start with the character at the current
+    position.
+
+    The characters each rule can start with are worked out from its
+    pattern. Rules for which they can't be (because they use flags
+    that change which characters match, say) are tried at every
+    position. The rules that can start with a
+    character are matched with a CombinedMatcher, made when the
+    character is first met and shared by all characters with the same
+    rules. The result is identical to the ReferenceMatcher.
+    """
+    def __init__(self, rules, cache=None):
+        self.rules = rules
+        self.starts = [_start_chars(regex) for fn, regex in rules]
+        self.by_char = {}
+        self.by_rules = {}
+
+    def match(self, src_string, pos, tried=None):
+        """
+        Returns a (function, end) pair for the longest non-empty match
+        at the given position, or None if no rule matched. If tried is
+        a list, the index of each rule tried is appended to it.
+        """
+        c = src_string[pos]
+        matcher = self.by_char.get(c)
+        if matcher is None:
+            matcher = self._add_char(c)
+        return matcher.match(src_string, pos, tried)
+
+    def _add_char(self, c):
+        """
+        Finds the matcher for the rules that can start with the given
+        character (or byte), and caches it.
+        """
+        if isinstance(c, (int, long)):
+            code = c
+        else:
+            code = ord(c)
+        indices = tuple([
+                index for index, starts in enumerate(self.starts)
+                if starts is None or _in_ranges(starts, code)
+                ])
+        matcher = self.by_rules.get(indices)
+        if matcher is None:
+            matcher = self.by_rules[indices] = CombinedMatcher(
+                [self.rules[index] for index in indices], None, indices
+                )
+        self.by_char[c] = matcher
+        return matcher
+
+class RuleDecider(object):
+    """
+    Finds the rule, among a list of scanner rules, that wins every
+    match starting with a given character, if there is one. That is a
+    rule that always matches at least one character, where no rule
+    before it can start with the character, and every rule after it
+    either can't, or can't match more characters than it always does.
+    Its match alone, if it matches, is then the longest match.
+
+    This holds for the semantics of the regex engine, so not for
+    engines that give POSIX semantics within rules (see make_decider).
+    """
+    def __init__(self, rules):
+        self.starts = [_start_chars(regex) for fn, regex in rules]
+        self.widths = [_widths(regex) for fn, regex in rules]
+
+    def decide(self, c):
+        """
+        Returns the index of the rule that wins matches starting with
+        the given character, or None if there isn't one.
+        """
+        if isinstance(c, (int, long)):
+            code = c
+        else:
+            code = ord(c)
+        starting = [
+            index for index, starts in enumerate(self.starts)
+            if starts is None or _in_ranges(starts, code)
+            ]
+        if not starting:
+            return None
+        first = starting[0]
+        least = self.widths[first][0]
+        if least < 1:
+            return None
+        for index in starting[1:]:
+            if self.widths[index][1] > least:
+                return None
+        return first
+
+from dfa import DFAMatcher, NotRegular, _MAX_CODE
+from dfa import _charset_of, _negate, _normalize
+
+ENGINES = {
+    'reference': ReferenceMatcher,
+    'combined': CombinedMatcher,
+    'dfa': DFAMatcher,
+    'dispatch': DispatchMatcher,
+    }
+
+def make_matcher(engine, rules, cache=None):
+    """
+    Creates a matcher of the named engine for the given list of
+    (function, compiled regex) rules, keeping any tables it compiles
+    in the given cache.
+    """
+    try:
+        matcher_class = ENGINES[engine]
+    except KeyError:
+        raise ValueError("Unknown scanner engine '%s'." % engine)
+    return matcher_class(rules, cache)
+
+def make_decider(engine, rules):
+    """
+    Creates a RuleDecider for the given list of (function, compiled
+    regex) rules, or returns None if the named engine's matches can
+    differ from those of the regex engine, or it is the 'reference'
+    engine, which must find every match itself to stay the reference.
+    """
+    if engine == 'reference' or getattr(ENGINES[engine], 'posix', False):
+        return None
+    return RuleDecider(rules)
+
+# ..........................................................................
+# Pattern analysis
+
+_GROUPREFS = (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS)
+
+_LOOKAROUND = (sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+def _combinable(regex):
+    """
+    Checks if the given compiled rule can be embedded in a larger
+    pattern without changing its meaning. Rules with flags can't be,
+    as an inline flag anywhere in a pattern (even (?u)) applies to the
+    whole of it, and so to the other rules.
+    """
+    if regex.flags:
+        return False
+    try:
+        parsed = sre_parse.parse(regex.pattern)
+    except sre_constants.error:
+        return False
+    if parsed.pattern.flags:
+        return False
+    return not _contains_op(parsed, _GROUPREFS)
+
+def _widths(regex):
+    """
+    Returns the fewest and the most characters a match of the given
+    compiled rule can take. The most is sys.maxint if there is no
+    limit, or it can't be worked out.
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except sre_constants.error:
+        return 0, sys.maxint
+    least, most = parsed.getwidth()
+    # The width of a backreference isn't counted.
+    if _contains_op(parsed, _GROUPREFS) or \
+            most >= sre_constants.MAXREPEAT - 1:
+        most = sys.maxint
+    return least, most
+
+def _context(regex):
+    """
+    Returns how many characters before the start of a match attempt of
+    the given compiled rule, and from its start on, the outcome of the
+    attempt can depend on, as (behind, ahead). Ahead is sys.maxint if
+    there is no limit, or it can't be worked out.
+
+    An attempt that fails (or gives way to a longer match) can look
+    further than the text it ends up matching, so ahead is taken from
+    the longest match the rule can make. Anchors look at the character
+    on each side of them, and lookarounds at the text they match.
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except sre_constants.error:
+        return sys.maxint, sys.maxint
+    behind = 0
+    ahead = _widths(regex)[1]
+    pending = [parsed]
+    while pending and ahead < sys.maxint:
+        item = pending.pop()
+        if isinstance(item, sre_parse.SubPattern):
+            for op, av in item:
+                if op is sre_constants.AT:
+                    behind = max(behind, 1)
+                    ahead += 1
+                elif op in _LOOKAROUND:
+                    direction, pattern = av
+                    width = pattern.getwidth()[1]
+                    if width >= sre_constants.MAXREPEAT - 1:
+                        return behind, sys.maxint
+                    if direction < 0:
+                        behind += width
+                    else:
+                        ahead += width
+                pending.append(av)
+        elif isinstance(item, (tuple, list)):
+            pending.extend(item)
+    return behind, min(ahead, sys.maxint)
+
+def _start_chars(regex):
+    """
+    Returns the characters that a non-empty match of the given
+    compiled rule can start with, as a normalized list of (low, high)
+    ranges of code points, or None if they can't be worked out.
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except sre_constants.error:
+        return None
+    flags = regex.flags | parsed.pattern.flags
+    if flags & (re.IGNORECASE | re.LOCALE | re.UNICODE):
+        return None
+    try:
+        ranges, nullable = _starts_of(parsed, flags & re.DOTALL)
+    except NotRegular:
+        return None
+    return _normalize(ranges)
+
+def _starts_of(parsed, dotall):
+    """
+    Returns a list of ranges holding every character that a non-empty
+    match of the parsed (sub)pattern can start with, and whether it
+    can match the empty string. Raises NotRegular for features it
+    can't follow.
+    """
+    ranges = []
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            ranges.append((av, av))
+            return ranges, False
+        elif op == sre_constants.NOT_LITERAL:
+            ranges.extend(_negate([(av, av)]))
+            return ranges, False
+        elif op == sre_constants.ANY:
+            if dotall:
+                ranges.extend(_negate([]))
+            else:
+                ranges.extend(_negate([(10, 10)]))
+            return ranges, False
+        elif op == sre_constants.IN:
+            ranges.extend(_charset_of(av))
+            return ranges, False
+        elif op == sre_constants.BRANCH:
+            nullable = False
+            for branch in av[1]:
+                branch_ranges, branch_nullable = _starts_of(branch, dotall)
+                ranges.extend(branch_ranges)
+                nullable = nullable or branch_nullable
+            if not nullable:
+                return ranges, False
+        elif op == sre_constants.SUBPATTERN:
+            sub_ranges, nullable = _starts_of(av[-1], dotall)
+            ranges.extend(sub_ranges)
+            if not nullable:
+                return ranges, False
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            sub_ranges, nullable = _starts_of(av[2], dotall)
+            ranges.extend(sub_ranges)
+            if av[0] and not nullable:
+                return ranges, False
+        elif op in _ZERO_WIDTH:
+            # Anchors and lookarounds match no characters themselves,
+            # so the match starts with whatever follows them.
+            pass
+        else:
+            raise NotRegular("Unsupported regex feature: %s." % op)
+    return ranges, True
+
+def _in_ranges(ranges, code):
+    """
+    Checks if a code point is within a normalized list of ranges.
+    """
+    index = bisect.bisect_right(ranges, (code, _MAX_CODE)) - 1
+    return index >= 0 and ranges[index][1] >= code
+
+_ZERO_WIDTH = (
+    sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT
+    )
+
+def _contains_op(parsed, ops):
+    """
+    Checks if a parsed regular expression uses any of the given
+    opcodes anywhere within it.
+    """
+    pending = [parsed]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, sre_parse.SubPattern):
+            for op, av in item:
+                if op in ops:
+                    return True
+                pending.append(av)
+        elif isinstance(item, (tuple, list)):
+            pending.extend(item)
+    return False
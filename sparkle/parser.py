@@ -1,11 +1,344 @@
+import itertools
+import operator
+from array import array
 from errors import *
+from grammar import Grammar
+from earley import EarleyRecognizer, NULL
+from forest import ParseForest
+from lalr import LALRTable
+from tables import default_cache, TableSet
+from slicing import SlicedJob
 
 class GenericParser(object):
+    """
+    Parses a sequence of tokens according to the grammar rules defined
+    in the p_* members of this class.
+
+    The engine class attribute selects the parsing algorithm. The
+    'earley' engine works on a copy of the grammar compiled to integer
+    tables, and can parse with any grammar. The default 'auto' engine
+    also builds LALR(1) tables for the grammar (see lalr.LALRTable),
+    and if they have no conflicts, parses with a shift-reduce parser
+    instead, which is much faster. Otherwise it falls back to the
+    'earley' engine. The tables are built the first time they are
+    needed, by parse or by the active_engine attribute, which gives
+    the engine parse uses, rather than when the parser is constructed.
+    The lalr_table attribute then holds them (with their conflicts).
+    The default engine used to be 'earley', which is still the one to
+    ask for to never build the LALR(1) tables. The 'reference' engine
+    is the original parser, working directly on the rule tuples, and
+    is kept to check the other engines against.
+
+    Every engine calls the rule functions in the same order: walking
+    the tree back from the end of the tokens, the function of each
+    rule is called after the functions of the rules matched within
+    it, last first.
+    So for root ::= a b, the function for b is called, then the one
+    for a, then the one for root. The shift-reduce parser records the
+    rules it reduces, and calls their functions in this order once the
+    tokens are accepted.
+
+    The compiled grammar is kept in the table_cache (by default
+    tables.default_cache), so constructing another parser with the
+    same rules, in this process or another using the same cache
+    directory, doesn't compile them again. A parser can be pickled,
+    and takes its compiled grammar with it.
+
+    If the incremental class attribute is True, parse keeps the Earley
+    sets and the results of the rules between calls, so that reparse
+    can parse the tokens again after a small edit without starting
+    from scratch. Results of the rules that matched only tokens before
+    the edit are reused, so with incremental parsing the rule
+    functions mustn't change the results they are given. Only the
+    Earley engine can reparse this way, so an incremental parser with
+    the 'auto' engine always uses it, LALR(1) grammar or not.
+
+    A parser given an instrument.Stats with set_stats records the calls
+    and time of each p_* function, the ambiguities resolved, and the
+    sizes of the Earley sets, into it.
+
+    If the class declares a result_cache (a tables.ResultCache), the
+    result of parsing each sequence of tokens is kept in it, and the
+    same tokens parsed again get the same result from there, without
+    calling the rule functions. Only declare one if the rule functions
+    have no side effects, and their results are never changed.
+    """
+    engine = 'auto'
+    table_cache = default_cache
+    incremental = False
+    stats = None
+    result_cache = None
+
     def __init__(self, start='root'):
         """
         Create the parse, so that its top level grammar element is given
         by the start parameter. This defaults to 'root'.
         """
+        self._tables = TableSet(self.table_cache)
+        self._find_rules(start)
+        self._get_grammar()
+        self._previous = None
+
+    def __getstate__(self):
+        # The rule functions are bound methods, which can't be pickled,
+        # so are found again when unpickling.
+        state = self.__dict__.copy()
+        for name in ('rules', 'rule2func', 'rule2name', 'grammar',
+                     'lalr_table'):
+            del state[name]
+        state['_previous'] = None
+        state.pop('stats', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._tables.cache = self.table_cache
+        self._find_rules(self.start_rule[1][0])
+        self._get_grammar()
+
+    def set_stats(self, stats):
+        """
+        Starts recording statistics into the given instrument.Stats, or
+        stops if it is None. Only the rules added so far are timed.
+        """
+        self.stats = stats
+        for rule, func in self.rule2func.items():
+            func = getattr(func, 'wrapped', func)
+            if stats is not None and self.rule2name[rule]:
+                func = stats.timed(
+                    stats.actions, 'p_' + self.rule2name[rule], func
+                    )
+            self.rule2func[rule] = func
+
+    def preprocess(self, rule, func):
+        """
+        Implement this method in subclasses to augment any rule that
+        the parser contains. This allows you to centrally build an
+        AST, for example.
+        """
+        return rule, func
+
+    def parse(self, tokens):
+        """
+        Parses the given sequence of tokens, and returns the result of
+        the top level rule. The tokens can be a list of Token objects
+        (or of strings), or a TokenBuffer, in which case the token
+        types are read without creating Token objects.
+        """
+        self._previous = None
+        if self.result_cache is not None:
+            return self.result_cache.get(
+                'parse', self._result_source(tokens),
+                lambda: self._parse_new(tokens)
+                )
+        return self._parse_new(tokens)
+
+    def parse_sliced(self, tokens, slice_size=1000, time_budget=None,
+                     deadline=None):
+        """
+        Returns a slicing.SlicedJob that parses the tokens as it is
+        iterated, a slice of slice_size tokens (or of time_budget
+        seconds) at a time, generating the number of tokens it has
+        parsed after each. It raises a SparkleTimeoutError if it runs
+        past the deadline. Once the tokens are recognised, the result
+        is built in slices too, of slice_size steps (each taking one
+        symbol of a rule) or time_budget seconds, generating the number
+        of tokens after each. Only the 'reference' engine parses in one
+        go, so it raises a ValueError if given a deadline, which it
+        couldn't keep to. The parser mustn't be used for anything else
+        until the job is done.
+        """
+        if deadline is not None and self.active_engine == 'reference':
+            raise ValueError(
+                "The 'reference' engine can't parse to a deadline."
+                )
+        self._previous = None
+        return SlicedJob(
+            lambda check, result: self._parse_steps(tokens, check, result),
+            slice_size, time_budget, deadline
+            )
+
+    def reparse(self, tokens, start, old_end, new_end):
+        """
+        Parses the given tokens after an edit to the tokens parsed last,
+        which replaced the tokens from start to old_end with the tokens
+        from start to new_end of the new list, and returns the result
+        of the top level rule.
+
+        The Earley sets are only made again from the edit up to where
+        they converge with the old ones, and the results of the rules
+        that matched tokens before the edit are reused. The tokens
+        before the edit must be the ones parsed last. If there's no
+        parse to start from (parse wasn't incremental, the last parse
+        failed, or the rules have changed), the tokens are parsed from
+        scratch.
+        """
+        previous = self._previous
+        self._previous = None
+        engine = self.active_engine
+        if engine == 'reference':
+            return self._parse_reference(tokens)
+        if engine == 'lalr':
+            return self._parse_lalr(tokens)
+        grammar = self._get_grammar()
+        if previous is None or previous[0].grammar is not grammar:
+            return self._parse_earley(tokens, True)
+
+        recognizer, terminals, done = previous
+        terminals = terminals[:start] + \
+            self._terminals(grammar, tokens[start:new_end])[:-1] + \
+            terminals[old_end:]
+        error = recognizer.update(terminals, start, old_end, new_end)
+        if error is not None:
+            self._syntax_error(tokens, error)
+        if not recognizer.accepted(len(terminals)):
+            self._syntax_error(tokens, len(tokens))
+
+        # Only the results of rules ending before the edit still stand.
+        for node in done.keys():
+            if node[1] >= start:
+                del done[node]
+        return self._build_result(recognizer, tokens, terminals, done)
+
+    def parse_forest(self, tokens):
+        """
+        Parses the given sequence of tokens, and returns a
+        forest.ParseForest holding all of their parses, without
+        building any of them. It can count the parses, build each of
+        them in turn, or build the best one by a given scoring.
+        Whatever the engine, the forest comes from the Earley engine.
+        """
+        grammar = self._get_grammar()
+        terminals = self._terminals(grammar, tokens)
+        recognizer = EarleyRecognizer(grammar)
+        self._recognize(recognizer, tokens, terminals)
+        return ParseForest(
+            grammar, recognizer, _WithEOF(tokens, self._EOF), self.rule2func
+            )
+
+    def parse_stream(self, tokens):
+        """
+        Parses an iterable of tokens as any number of matches of the
+        top level rule, one after another, and generates the result of
+        each match in turn. The tokens can be a generator, such as
+        TokenizingScanner.tokenize_stream.
+
+        A result is built, by calling the rule functions as parse
+        would, as soon as the tokens read so far settle it: when every
+        way of parsing them that the token after can carry on ends a
+        match at the same place, so no later token can change how the
+        tokens before are parsed. The Earley
+        sets, tokens and results from before that place are then
+        thrown away, so memory use doesn't grow with the length of the
+        stream, only with how far ahead the grammar needs to read to
+        settle each match. Where the tokens can be split into matches
+        in more than one way, fewer, longer matches are preferred.
+        Streaming always uses the Earley engine, and the top level rule
+        mustn't be able to match no tokens.
+        """
+        grammar = self._get_stream_grammar()
+        if grammar.cyclic:
+            raise ValueError(
+                "Can't stream a top level rule that can match no tokens."
+                )
+        item_count = grammar.item_count
+
+        # A set is settled if none of its items with earlier origins
+        # are part way through a match that the token after the set can
+        # carry on. These are the terminals that can carry on each item
+        # part way through a match.
+        stream_symbol = grammar.symbol_ids[self._STREAM]
+        carried = []
+        for item in xrange(item_count):
+            symbol = grammar.item_next[item]
+            if symbol < 0 or grammar.item_lhs[item] == stream_symbol or \
+                    grammar.item_rule[item] == 0:
+                carried.append(())
+            elif symbol < grammar.nonterminal_count:
+                carried.append(frozenset(grammar.first[symbol]))
+            else:
+                carried.append((symbol,))
+        ends = frozenset([
+                item for item in xrange(item_count)
+                if grammar.item_lhs[item] == stream_symbol
+                and grammar.item_next[item] < 0
+                ])
+
+        # The node of the start item, with its dot before the end of
+        # file marker, at a settled position is the list of results of
+        # the matches up to there.
+        top = grammar.rule_items[0] + 1
+
+        recognizer = EarleyRecognizer(grammar)
+        sets = recognizer.sets
+        window = _TokenWindow()
+        forest = ParseForest(grammar, recognizer, window, self.rule2func)
+        read = self._terminal_reader(grammar)
+        eof = grammar.terminal_id(self._EOF)
+        settled = 0
+        done = {}
+
+        for i, token in enumerate(itertools.chain(tokens, [_END])):
+            if token is _END:
+                if i == 0:
+                    return
+                if not recognizer.step(i, eof) or \
+                        not recognizer.accepted(i + 1):
+                    self._syntax_error(window, i)
+            else:
+                window.append(token)
+                terminal = read(token)
+                if not recognizer.step(i, terminal):
+                    self._syntax_error(window, i)
+                if i == settled or not _settled(
+                        sets[i].items, i, item_count, carried, terminal
+                        ):
+                    continue
+            if i == settled:
+                return
+
+            # Build the matches since the last settled position, then
+            # forget what they were built from.
+            forest.root = top, i
+            for result in self._build_tree_from_forest(forest, done):
+                yield result
+            done = dict([
+                    (node, []) for node in done
+                    if node[1] == i and node[0] in ends
+                    ])
+            for position in xrange(max(settled, 1), i):
+                del sets[position]
+            window.forget(i - 1)
+            settled = i
+
+    @property
+    def active_engine(self):
+        """
+        The engine that parse uses: 'lalr' or 'earley' for the 'auto'
+        engine, depending on whether the grammar is LALR(1) (and always
+        'earley' for an incremental parser), otherwise the engine asked
+        for.
+        """
+        if self.engine != 'auto':
+            return self.engine
+        if self.incremental:
+            return 'earley'
+        if self._get_lalr_table().conflicts:
+            return 'earley'
+        return 'lalr'
+
+    # ........................................................................
+    # Internal data and functions
+
+    _START = 'START'
+    _EOF = 'EOF'
+    _STREAM = 'STREAM'
+
+    def _find_rules(self, start):
+        """
+        Finds and adds the rules defined in the p_* members, and the
+        start rule.
+        """
         self.rules = {}
         self.rule2func = {}
         self.rule2name = {}
@@ -17,46 +350,493 @@ class GenericParser(object):
 
         self.start_rule = self._init_first_rule(start)
         self.rules_changed = 1
+        self.grammar = None
 
-    def preprocess(self, rule, func):
+    def _get_grammar(self):
         """
-        Implement this method in subclasses to augment any rule that
-        the parser contains. This allows you to centrally build an
-        AST, for example.
+        Returns the compiled form of the grammar, compiling it if the
+        rules have changed.
         """
-        return rule, func
+        if self.grammar is None:
+            rules = []
+            for lhs in sorted(self.rules):
+                rules.extend(self.rules[lhs])
+            source = tuple(rules), self.start_rule
+            self.grammar = self._tables.get(
+                'grammar', source, lambda: Grammar(*source)
+                )
+            self.lalr_table = None
+        return self.grammar
 
-    def parse(self, tokens):
+    def _get_lalr_table(self):
+        """
+        Returns the LALR(1) tables of the grammar, building them the
+        first time they are needed.
+        """
+        grammar = self._get_grammar()
+        if self.lalr_table is None:
+            self.lalr_table = self._tables.get(
+                'lalr', grammar.rules, lambda: LALRTable(grammar)
+                )
+        return self.lalr_table
+
+    def _get_stream_grammar(self):
+        """
+        Returns the compiled grammar for parse_stream, which matches
+        the top level rule one or more times. Its extra rules are added
+        to rule2func and rule2name, as the start rule is, with the
+        results of the matches in a list. An ambiguity between them is
+        resolved in favour of fewer, longer matches.
+        """
+        grammar = self._get_grammar()
+        start = self.start_rule[1][0]
+        first = (self._STREAM, (start,))
+        more = (self._STREAM, (self._STREAM, start))
+        start_rule = (self._START, (self._STREAM, self._EOF))
+        self.rule2func[first] = lambda args: args
+        self.rule2func[more] = lambda args: args[0] + [args[1]]
+        self.rule2func[start_rule] = lambda args: args[0]
+        self.rule2name[first] = 'stream'
+        self.rule2name[more] = 'stream_more'
+        self.rule2name[start_rule] = ''
+
+        source = grammar.rules[1:] + (first, more), start_rule
+        return self._tables.get('grammar', source, lambda: Grammar(*source))
+
+    def _parse_earley(self, tokens, keep):
+        """
+        Parses the tokens with the Earley engine. If keep is True, what
+        reparse needs is kept.
+        """
+        result = []
+        for i in self._earley_steps(tokens, keep, None, result):
+            pass
+        return result[0]
+
+    def _earley_steps(self, tokens, keep, check, result):
+        """
+        Parses the tokens as _parse_earley does, stopping to generate
+        the number of tokens recognised after each check tokens (if
+        check isn't None), and then, while the result is built, the
+        number of tokens after each check steps of building it.
+        Appends the result to the result list when done.
+        """
+        grammar = self._get_grammar()
+        terminals = self._terminals(grammar, tokens)
+        recognizer = EarleyRecognizer(grammar)
+        for i in self._recognize_steps(recognizer, tokens, terminals, check):
+            yield i
+        if keep:
+            steps = self._build_result_steps(
+                recognizer, tokens, terminals, {}, check, result
+                )
+        else:
+            steps = self._build_steps(ParseForest(
+                    grammar, recognizer, _WithEOF(tokens, self._EOF),
+                    self.rule2func
+                    ), None, check, result)
+        for count in steps:
+            yield len(tokens)
+        if not keep and check is not None:
+            # Freeing the sets of a long input takes a while too, so it
+            # is done in slices as well.
+            sets = recognizer.sets
+            for i in xrange(len(sets)):
+                del sets[i]
+                if i % check == 0:
+                    yield len(tokens)
+
+    def _parse_steps(self, tokens, check, result):
+        """
+        Parses the tokens as parse does (without the result cache),
+        stopping to generate the number of tokens parsed after each
+        check tokens. The 'reference' engine doesn't stop. Appends the
+        result to the result list when done.
+        """
+        engine = self.active_engine
+        if engine == 'reference':
+            steps = ()
+            result.append(self._parse_reference(tokens))
+        elif engine == 'lalr':
+            steps = self._lalr_steps(tokens, check, result)
+        else:
+            steps = self._earley_steps(
+                tokens, self.incremental, check, result
+                )
+        for i in steps:
+            yield i
+
+    def _parse_new(self, tokens):
+        """
+        Parses the tokens with the active engine.
+        """
+        engine = self.active_engine
+        if engine == 'reference':
+            return self._parse_reference(tokens)
+        if engine == 'lalr':
+            return self._parse_lalr(tokens)
+        return self._parse_earley(tokens, self.incremental)
+
+    def _result_source(self, tokens):
+        """
+        Returns the data identifying the result of parsing the tokens,
+        for the result cache.
+        """
+        cls = self.__class__
+        if hasattr(tokens, 'token_types'):
+            tokens = (tokens.type_names, tokens.types.tostring(),
+                      tokens.positions.tostring(), tokens.values)
+        else:
+            try:
+                tokens = map(_TOKEN_FIELDS, tokens)
+            except AttributeError:
+                # The tokens are strings, whose reprs identify them.
+                tokens = list(tokens)
+        return ('%s.%s' % (cls.__module__, cls.__name__),
+                self._get_grammar().rules, tokens)
+
+    def _parse_lalr(self, tokens):
+        """
+        Parses the tokens with the LALR(1) tables, which must have no
+        conflicts.
+        """
+        result = []
+        for i in self._lalr_steps(tokens, None, result):
+            pass
+        return result[0]
+
+    def _lalr_steps(self, tokens, check, result):
+        """
+        Parses the tokens as _parse_lalr does, stopping to generate the
+        number of tokens shifted after each check tokens (if check
+        isn't None), and then the number of tokens after each check
+        steps of calling the rule functions. Appends the result to the
+        result list when done.
+
+        The rules reduced are only recorded, and their functions called
+        once the tokens are accepted, by _reduction_steps.
+        """
+        grammar = self._get_grammar()
+        table = self._get_lalr_table()
+        actions = table.actions
+        gotos = table.gotos
+        rule_lhs = table.rule_lhs
+        rule_length = table.rule_length
+        accept_state = table.accept_state
+        terminals = self._terminals(grammar, tokens)
+
+        states = [0]
+        reductions = array('i')
+        i = 0
+        pause = check or -1
+        terminal = terminals[0]
+        while True:
+            action = actions[states[-1]].get(terminal)
+            if action is None:
+                self._syntax_error(tokens, i)
+            if action >= 0:
+                # Shift.
+                if action == accept_state:
+                    break
+                states.append(action)
+                i += 1
+                terminal = terminals[i]
+                if i == pause:
+                    yield i
+                    pause += check
+            else:
+                # Reduce.
+                rule = -1 - action
+                reductions.append(rule)
+                length = rule_length[rule]
+                if length:
+                    del states[-length:]
+                states.append(gotos[states[-1]][rule_lhs[rule]])
+        for count in self._reduction_steps(
+                grammar, tokens, reductions, check, result
+                ):
+            yield i
+
+    def _reduction_steps(self, grammar, tokens, reductions, check, result):
+        """
+        Calls the functions of the rules a shift-reduce parse of the
+        tokens reduced, in the given order, stopping to generate the
+        number of steps taken after each check steps (if check isn't
+        None), and appends the result of the start rule to the result
+        list. Each step takes one symbol of a rule. The functions are
+        called in the order the other engines call them: the tree is
+        walked back from its end, and each rule's function is called
+        after those of the rules within it, last first.
+        """
+        item_next = grammar.item_next
+        rule_items = grammar.rule_items
+        nonterminal_count = grammar.nonterminal_count
+        rule2func = self.rule2func
+        funcs = [rule2func[rule] for rule in grammar.rules]
+        # Which symbols of each rule are nonterminals.
+        nonterminals = [
+            [symbol < nonterminal_count for symbol in
+             item_next[item:item + len(rule[1])]]
+            for item, rule in zip(rule_items, grammar.rules)
+            ]
+
+        # Walking back through the rules in the order they were reduced
+        # meets each rule before the rules within it, last first. Each
+        # frame is (rule, symbols left to fill in, argument values in
+        # reverse), starting with the start rule, whose end of file
+        # marker is already filled in.
+        steps = 0
+        pause = check or -1
+        position = len(tokens)
+        index = len(reductions)
+        frames = []
+        rule = 0
+        left = len(nonterminals[0]) - 1
+        args = [self._EOF]
+        while True:
+            flags = nonterminals[rule]
+            while left:
+                left -= 1
+                steps += 1
+                if steps == pause:
+                    yield steps
+                    pause += check
+                if flags[left]:
+                    break
+                position -= 1
+                args.append(tokens[position])
+            else:
+                args.reverse()
+                value = funcs[rule](args)
+                if not frames:
+                    result.append(value)
+                    return
+                rule, left, args = frames.pop()
+                args.append(value)
+                continue
+            frames.append((rule, left, args))
+            index -= 1
+            rule = reductions[index]
+            left = len(nonterminals[rule])
+            args = []
+
+    def _recognize(self, recognizer, tokens, terminals):
+        """
+        Runs the recogniser over the terminals, raising a syntax error
+        if they aren't accepted.
+        """
+        for i in self._recognize_steps(recognizer, tokens, terminals, None):
+            pass
+
+    def _recognize_steps(self, recognizer, tokens, terminals, check):
+        """
+        Runs the recogniser as _recognize does, stopping to generate
+        the number of terminals recognised after each check terminals
+        (if check isn't None).
+        """
+        pause = check or -1
+        for i, terminal in enumerate(terminals):
+            if not recognizer.step(i, terminal):
+                self._syntax_error(tokens, i)
+            if i + 1 == pause:
+                yield pause
+                pause += check
+        if not recognizer.accepted(len(terminals)):
+            self._syntax_error(tokens, len(tokens))
+        if self.stats is not None:
+            self.stats.add_sets(
+                recognizer.sets, recognizer.grammar.item_count
+                )
+
+    def _build_result(self, recognizer, tokens, terminals, done):
+        """
+        Builds the result of the tokens recognised, reusing and adding
+        to the results in done, and keeps what reparse needs.
+        """
+        result = []
+        for count in self._build_result_steps(
+                recognizer, tokens, terminals, done, None, result
+                ):
+            pass
+        return result[0]
+
+    def _build_result_steps(self, recognizer, tokens, terminals, done,
+                            check, result):
+        """
+        Builds the result as _build_result does, stopping to generate
+        the number of steps taken after each check steps (if check
+        isn't None), and appends it to the result list.
+        """
+        forest = ParseForest(
+            recognizer.grammar, recognizer, _WithEOF(tokens, self._EOF),
+            self.rule2func
+            )
+        for count in self._build_steps(forest, done, check, result):
+            yield count
+        self._previous = recognizer, terminals, done
+
+    def _terminals(self, grammar, tokens):
+        """
+        Returns the list of terminal numbers for the given tokens,
+        ending with the end of file marker.
+        """
+        if hasattr(tokens, 'token_types'):
+            ids = [grammar.terminal_id(name) for name in tokens.type_names]
+            terminals = [ids[type_id] for type_id in tokens.types]
+        else:
+            terminals = map(self._terminal_reader(grammar), tokens)
+        terminals.append(grammar.terminal_id(self._EOF))
+        return terminals
+
+    def _terminal_reader(self, grammar):
+        """
+        Returns a function giving the terminal number of a token.
+        """
+        terminal_id = grammar.terminal_id
+        type_string = self._type_string
+        if type_string.im_func is GenericParser._type_string.im_func:
+            def read(token):
+                return terminal_id(getattr(token, 'token_type', token))
+        else:
+            def read(token):
+                token_type = type_string(token)
+                if token_type is None:
+                    token_type = getattr(token, 'token_type', token)
+                return terminal_id(token_type)
+        return read
+
+    def _syntax_error(self, tokens, i):
+        """
+        Raises a syntax error for the token at position i. A failure at
+        the end of the input is reported at the last token.
+        """
+        if len(tokens) == 0:
+            raise SparkleSyntaxError("Syntax error at end of input", 0)
+        token = tokens[min(i, len(tokens) - 1)]
+        raise SparkleSyntaxError(
+            "Syntax error at or near '%s'" % token,
+            getattr(token, 'position', None)
+            )
+
+    def _build_tree_from_forest(self, forest, done=None):
+        """
+        Builds the result of the parse forest's root, the equivalent of
+        _build_tree for the integer-coded Earley sets, resolving
+        ambiguities with _ambiguity. Done is passed on to the forest's
+        build.
+        """
+        result = []
+        for count in self._build_steps(forest, done, None, result):
+            pass
+        return result[0]
+
+    def _build_steps(self, forest, done, check, result):
+        """
+        Builds the result as _build_tree_from_forest does, stopping to
+        generate the number of steps taken after each check steps (if
+        check isn't None), and appends it to the result list.
+        """
+        grammar = forest.grammar
+
+        def choose(node, height):
+            if height is None:
+                alternatives = forest.alternatives(node)
+            else:
+                alternatives = forest.finite_alternatives(node, height)
+            if len(alternatives) == 1:
+                return alternatives[0]
+            return self._choose(
+                grammar, alternatives, forest.symbol(node), node[1]
+                )
+
+        return forest.build_steps(
+            choose, lambda symbol, i: self._build_null(grammar, symbol, i),
+            done, check, result
+            )
+
+    def _build_null(self, grammar, symbol, i):
+        """
+        Builds the result for the given nullable nonterminal deriving
+        the empty string at position i.
+        """
+        rule_index = self._choose_rule(grammar, grammar.null_rules[symbol], i)
+        rule = grammar.rules[rule_index]
+        item = grammar.rule_items[rule_index]
+        args = [
+            self._build_null(grammar, grammar.item_next[item + index], i)
+            for index in range(len(rule[1]))
+            ]
+        return self.rule2func[rule](args)
+
+    def _choose(self, grammar, children, symbol, i):
+        """
+        Resolves an ambiguity between the given completed items for a
+        symbol in set i, by passing them to _ambiguity in the form the
+        reference parser uses. A NULL link takes the place of the rule
+        the symbol's empty derivation is built from.
+        """
+        item_count = grammar.item_count
+        candidates = []
+        choices = []
+        for child in children:
+            if child != NULL:
+                origin, item = divmod(child, item_count)
+                rule = grammar.rules[grammar.item_rule[item]]
+                candidates.append(child)
+                choices.append(((rule, len(rule[1]), origin), i))
+        if NULL in children:
+            rule_index = self._choose_rule(
+                grammar, grammar.null_rules[symbol], i
+                )
+            rule = grammar.rules[rule_index]
+            candidates.append(NULL)
+            choices.append(((rule, len(rule[1]), i), i))
+        return candidates[choices.index(self._ambiguity(choices))]
+
+    def _choose_rule(self, grammar, rule_indices, i):
+        """
+        Resolves an ambiguity between the given rules for deriving the
+        empty string at position i.
+        """
+        if len(rule_indices) == 1:
+            return rule_indices[0]
+        choices = []
+        for rule_index in rule_indices:
+            rule = grammar.rules[rule_index]
+            choices.append(((rule, len(rule[1]), i), i))
+        return rule_indices[choices.index(self._ambiguity(choices))]
+
+    def _parse_reference(self, tokens):
+        """
+        Parses the tokens with the original parser.
+        """
         tree = {}
-        tokens.append(self._EOF)
+        if hasattr(tokens, 'token_types'):
+            symbols = tokens.token_types()
+        else:
+            symbols = list(tokens)
+        symbols.append(self._EOF)
         states = { 0: [ (self.start_rule, 0, 0) ] }
 
         if self.rules_changed:
             self._make_first()
 
-        for i in xrange(len(tokens)):
+        for i in xrange(len(symbols)):
             states[i+1] = []
 
             if states[i] == []:
                 break
-            self._build_state(tokens[i], states, i, tree)
+            self._build_state(symbols[i], states, i, tree)
 
-        if i < len(tokens)-1 or states[i+1] != [(self.start_rule, 2, 0)]:
-            del tokens[-1]
+        if i < len(symbols)-1 or states[i+1] != [(self.start_rule, 2, 0)]:
             print tokens
             raise SparkleSyntaxError(
                 "Syntax error at or near '%s'" % tokens[i-1],
                 tokens[i-1].position
                 )
-        rv = self._build_tree(tokens, tree, ((self.start_rule, 2, 0), i+1))
-        del tokens[-1]
-        return rv
-
-    # ........................................................................
-    # Internal data and functions
-
-    _START = 'START'
-    _EOF = 'EOF'
+        return self._build_tree(
+            _WithEOF(tokens, self._EOF), tree, ((self.start_rule, 2, 0), i+1)
+            )
 
     def _add_rule(self, func):
         """
@@ -64,28 +844,23 @@ class GenericParser(object):
         rule function should have a .rule property containing the
         grammar production.
         """
-        rules = func.rule.split()
-
-        index = []
-        for i in range(len(rules)):
-            if rules[i] == '::=':
-                index.append(i-1)
-        index.append(len(rules))
+        for lhs, rhs in _split_rule(func.rule):
+            self._add_production(lhs, rhs, func)
 
-        for i in range(len(index)-1):
-            lhs = rules[index[i]]
-            rhs = rules[index[i]+2:index[i+1]]
-            rule = (lhs, tuple(rhs))
-
-            rule, processed_func = self.preprocess(rule, func)
+    def _add_production(self, lhs, rhs, func):
+        """
+        Adds the production lhs ::= rhs of the given rule function.
+        """
+        rule, processed_func = self.preprocess((lhs, rhs), func)
 
-            if self.rules.has_key(lhs):
-                self.rules[lhs].append(rule)
-            else:
-                self.rules[lhs] = [rule]
-            self.rule2func[rule] = processed_func
-            self.rule2name[rule] = func.__name__[2:]
+        if self.rules.has_key(lhs):
+            self.rules[lhs].append(rule)
+        else:
+            self.rules[lhs] = [rule]
+        self.rule2func[rule] = processed_func
+        self.rule2name[rule] = func.__name__[2:]
         self.rules_changed = 1
+        self.grammar = None
 
     def _init_first_rule(self, start):
         #
@@ -310,6 +1085,8 @@ class GenericParser(object):
         #     undefined results if rules causing the ambiguity
         #     appear in the same method.
         #
+        if self.stats is not None:
+            self.stats.add_ambiguity(children[0][0][0][0])
         sortlist = []
         name2index = {}
         for i in range(len(children)):
@@ -331,6 +1108,87 @@ class GenericParser(object):
         return list[0]
 
 
+# Reads the fields of a Token that identify it.
+_TOKEN_FIELDS = operator.attrgetter('token_type', 'value', 'position')
+
+# Marks the end of a stream of tokens.
+_END = object()
+
+def _settled(items, i, item_count, carried, terminal):
+    """
+    Checks if none of the given items of Earley set i with an origin
+    before it can be carried on by the given terminal, the one at
+    position i.
+    """
+    base = i * item_count
+    for code in items:
+        if code < base and terminal in carried[code % item_count]:
+            return False
+    return True
+
+class _TokenWindow(object):
+    """
+    The tokens read from a stream that are still needed, indexed by
+    their positions in the whole stream.
+    """
+    def __init__(self):
+        self.tokens = []
+        self.offset = 0
+
+    def append(self, token):
+        self.tokens.append(token)
+
+    def forget(self, position):
+        """
+        Throws away the tokens before the given position.
+        """
+        del self.tokens[:position - self.offset]
+        self.offset = position
+
+    def __len__(self):
+        return self.offset + len(self.tokens)
+
+    def __getitem__(self, index):
+        return self.tokens[index - self.offset]
+
+class _WithEOF(object):
+    """
+    A read-only view of a sequence of tokens, with the end of file
+    marker added to the end.
+    """
+    def __init__(self, tokens, eof):
+        self.tokens = tokens
+        self.eof = eof
+
+    def __len__(self):
+        return len(self.tokens) + 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index == len(self.tokens):
+            return self.eof
+        return self.tokens[index]
+
+def _split_rule(definition):
+    """
+    Splits a rule definition, such as 'expr ::= expr + term term ::=
+    factor', into a list of its (lhs, rhs) productions.
+    """
+    rules = definition.split()
+
+    index = []
+    for i in range(len(rules)):
+        if rules[i] == '::=':
+            index.append(i-1)
+    index.append(len(rules))
+
+    productions = []
+    for i in range(len(index)-1):
+        lhs = rules[index[i]]
+        rhs = rules[index[i]+2:index[i+1]]
+        productions.append((lhs, tuple(rhs)))
+    return productions
 
 # This code is based on Spark by John Aycock.Original copyright
 # message below:
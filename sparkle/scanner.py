@@ -1,6 +1,12 @@
 import re
+import bisect
+import multiprocessing
+from array import array
 from errors import *
 from decorators import *
+from matchers import make_matcher, make_decider, _context
+from tables import default_cache, TableSet
+from slicing import SlicedJob
 
 class GenericScanner(object):
     """
@@ -21,13 +27,206 @@ class GenericScanner(object):
     name that comes first alphabetically will be chosen. The order of
     method declarations is ignored (because Python throws away this
     information when it generates its __dict__).
+
+    The engine class attribute controls how the longest match is
+    found. The default 'combined' engine matches all the rules of a
+    state with master regular expressions. The 'dfa' engine compiles
+    the rules of each state into one deterministic automaton, which
+    gives POSIX semantics within rules too (so /in|init/ can match
+    'init'); rules it can't compile are left to the regex engine. The
+    'dispatch' engine works out which characters each rule can start
+    with, and at each position matches only the rules that can start
+    with the character there, which pays off for states with many
+    rules. The 'reference' engine tries each rule in turn, and is
+    kept to check the others against.
+
+    Wherever one rule wins every match starting with the character at
+    the current position (see matchers.RuleDecider), it is matched on
+    its own, without the matcher, for every engine but 'dfa'. Rules
+    declared with decorators.skip and decorators.token aren't called
+    at all: the scanner makes their tokens itself.
+
+    Compiled tables (such as the DFAs) are kept in the table_cache (by
+    default tables.default_cache), so constructing another scanner
+    with the same rules doesn't compile them again. A scanner can be
+    pickled, and takes its compiled tables with it.
+
+    If the incremental class attribute is True, tokenize keeps the
+    position and state at the start of each match, so that retokenize
+    can scan the string again after an edit by running the rules over
+    the damaged region alone. Matching a rule can look at text past the
+    end of the match it makes (or past where it started, if it gives
+    way to a longer match), so the rules are run again from far enough
+    before the edit that no match kept could have looked at the edited
+    text, as worked out from the longest match each rule of the state
+    can make, its lookarounds and its anchors. If any of them can make
+    matches of unbounded length, such as r'\s+', that is from the start
+    of the string, so rules meant for incremental scanning should have
+    a bounded length where they can (r'\s{1,80}', say). The rule
+    functions themselves must depend on nothing but their match and
+    the state.
+
+    A scanner given an instrument.Stats with set_stats records the
+    calls to the matcher of each state, the attempts at each rule, and
+    the matches and time of each rule, into it.
     """
+    engine = 'combined'
+    table_cache = default_cache
+    incremental = False
+    stats = None
+
     def __init__(self):
         """
         Set up the scanner, and examine its defined methods to
         build a pattern table.
         """
         self.state = None
+        self.boundaries = None
+        self._tables = TableSet(self.table_cache)
+        self._make_matchers()
+
+    def __getstate__(self):
+        # The rules are bound methods, which can't be pickled, so are
+        # found again when unpickling.
+        state = self.__dict__.copy()
+        del state['patterns'], state['matchers']
+        del state['_inline'], state['_fast'], state['_contexts']
+        state['boundaries'] = None
+        state.pop('stats', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._tables.cache = self.table_cache
+        self._make_matchers()
+
+    def tokenize(self, src_string, initial_state=None):
+        """
+        Tokenizes the given string using the t_* rules defined in
+        this instance.
+
+        The source may also be a byte buffer, such as an mmap or a
+        bytearray, which is scanned in place without being copied into
+        a string. The rules are then given read-only buffer views of
+        their matched text (see decorators.generate_lazy_token).
+        """
+        self.state = initial_state
+        self.boundaries = None
+        if self.incremental:
+            boundaries = []
+            self._scan(src_string, 0, boundaries)
+            self.boundaries = boundaries
+        else:
+            self._scan(src_string, 0, None)
+
+    def retokenize(self, src_string, start, old_end, new_end):
+        """
+        Tokenizes the string again after an edit to the string last
+        tokenized, which replaced the characters from start to old_end
+        with the characters from start to new_end of the new string.
+        The string must have been tokenized incrementally.
+
+        The rules are run again from the start of the first match whose
+        rules could have looked at the edited text, until a match ends
+        where one of the old matches began (moved along by the edit) in
+        the same state, far enough past the edit that no rule looking
+        behind it could see the edited text. From there, the old matches
+        stand. Returns the range of the output that changed, as (start,
+        old_end, new_end) marks (see _mark).
+        """
+        boundaries = self.boundaries
+        if boundaries is None:
+            raise SparkleError(
+                "There is no incremental scan to start from.", start
+                )
+        self.boundaries = None
+        # Back up over the matches whose rules could have looked at the
+        # edited text.
+        contexts = self._contexts
+        first = max(bisect.bisect_left(boundaries, (start,)) - 1, 0)
+        while first > 0:
+            pos, state, mark = boundaries[first - 1]
+            if pos + contexts[state][1] < start:
+                break
+            first -= 1
+        pos, self.state, first_mark = boundaries[first]
+        behind = max([context[0] for context in contexts.values()])
+        self._rewind(first_mark)
+
+        delta = new_end - old_end
+
+        def sync(pos, state):
+            # Is this where an old match started, in the same state?
+            if pos - behind >= new_end:
+                index = bisect.bisect_left(boundaries, (pos - delta,))
+                if index < len(boundaries) and \
+                        boundaries[index][:2] == (pos - delta, state):
+                    return index
+            return None
+
+        scanned = boundaries[:first]
+        last = self._scan(src_string, pos, scanned, sync)
+        self.boundaries = scanned
+        if last is None:
+            return first_mark, boundaries[-1][2], scanned[-1][2]
+
+        # The rest of the old matches stand, moved along by the edit.
+        old_mark = boundaries[last][2]
+        new_mark = self._mark()
+        moved = new_mark - old_mark
+        scanned.extend([
+                (position + delta, state, mark + moved)
+                for position, state, mark in boundaries[last:]
+                ])
+        self.state = boundaries[-1][1]
+        return first_mark, old_mark, new_mark
+
+    def tokenize_sliced(self, src_string, initial_state=None,
+                        slice_size=1000, time_budget=None, deadline=None):
+        """
+        Returns a slicing.SlicedJob that tokenizes the string as it is
+        iterated, a slice of slice_size matches (or of time_budget
+        seconds) at a time, generating the position in the string it
+        has reached after each. It raises a SparkleTimeoutError if it
+        runs past the deadline. The scanner mustn't be used for
+        anything else until the job is done.
+        """
+        return SlicedJob(
+            lambda check, result: self._tokenize_steps(
+                src_string, initial_state, check, result
+                ),
+            slice_size, time_budget, deadline
+            )
+
+    def set_stats(self, stats):
+        """
+        Starts recording statistics into the given instrument.Stats, or
+        stops if it is None.
+        """
+        self.stats = stats
+        self._build_matchers()
+
+    @rule(r'(.|\n)')
+    def t_default(self, token, full_string, position):
+        """
+        The default rule that will be used (in all states) if no
+        other rule matches. The default implementation raises an error.
+        This can be overridden in a subclass to provide other
+        behaviour.
+        """
+        raise SparkleError(
+            "Found unmatched input at position %d" % position,
+            position
+            )
+
+    # ........................................................................
+    # Internal functions
+
+    def _make_matchers(self):
+        """
+        Examines the methods of the scanner to build a pattern table,
+        and a matcher for each state.
+        """
         self.patterns = {}
 
         # Check each valid name to see if it is a token declaration.
@@ -46,70 +245,616 @@ class GenericScanner(object):
         for entries in self.patterns.values():
             entries.append(entry)
 
-    def tokenize(self, src_string, initial_state=None):
+        self._build_matchers()
+
+    def _build_matchers(self):
         """
-        Tokenizes the given string using the t_* rules defined in
-        this instance.
+        Builds the matcher for each state from the pattern table.
+
+        Also works out how far the rules of each state can look, for
+        retokenize, and builds the map from the function of each skip
+        or token rule (see decorators.skip and decorators.token) to its
+        (token type, conversion), which _scan uses to carry the rule out
+        itself, and for each state a _FastRules, with which _scan finds
+        matches without the matcher where it can.
+        """
+        self.matchers = {}
+        for state, entries in self.patterns.items():
+            self.matchers[state] = make_matcher(
+                self.engine, entries, self._tables
+                )
+
+        # How far before and after the start of a match in each state
+        # the rules can look, for retokenize.
+        self._contexts = {}
+        for state, entries in self.patterns.items():
+            contexts = [_context(regex) for fn, regex in entries]
+            self._contexts[state] = (
+                max([behind for behind, ahead in contexts]),
+                max([ahead for behind, ahead in contexts])
+                )
+
+        self._inline = {}
+        for entries in self.patterns.values():
+            for fn, regex in entries:
+                action = getattr(fn, 'inline_token', None)
+                if action is not None:
+                    self._inline[fn] = action
+
+        # Instrumented scanners find every match with the matcher, so
+        # that it is counted.
+        self._fast = {}
+        if self.stats is not None:
+            names = self._rule_names()
+            for state, entries in self.patterns.items():
+                self.matchers[state] = self.stats.timed_matcher(
+                    state, self.matchers[state], entries, names
+                    )
+        else:
+            for state, entries in self.patterns.items():
+                decider = make_decider(self.engine, entries)
+                if decider is not None:
+                    self._fast[state] = _FastRules(
+                        decider, entries, self._inline
+                        )
+
+    def _rule_names(self):
+        """
+        Returns a map from the function of each t_* rule to the name of
+        the attribute it was found as, which may not be the name of the
+        function.
+        """
+        names = {}
+        for name in dir(self):
+            if name.startswith('t_'):
+                names[getattr(self, name)] = name
+        return names
+
+    def _tokenize_steps(self, src_string, initial_state, check, result):
+        """
+        Tokenizes the string as tokenize does, stopping to generate the
+        position reached after each check matches. Appends the result
+        (None) to the result list when done.
         """
         self.state = initial_state
+        self.boundaries = None
+        boundaries = [] if self.incremental else None
+        count = [0]
+
+        def sync(pos, state):
+            # Stop after each check matches.
+            count[0] += 1
+            if count[0] > check:
+                count[0] = 0
+                return pos
+            return None
 
         pos = 0
+        while True:
+            pos = self._scan(src_string, pos, boundaries, sync)
+            if pos is None:
+                break
+            yield pos
+        self.boundaries = boundaries
+        result.append(None)
+
+    def _scan(self, src_string, pos, boundaries, sync=None, offset=0,
+              more=False):
+        """
+        Runs the rules over the string from the given position to the
+        end. If boundaries is a list, the position, state and mark at
+        the start of each match (and at the end of the string) are
+        added to it.
+
+        If sync is given, it is called with the position and state at
+        the start of each match (and at the end of the string), and the
+        scan stops as soon as it returns something other than None,
+        returning that. Otherwise returns None.
+
+        The string may be a window onto a longer input starting at
+        offset, which is added to the positions given to the rules and
+        tokens. If more is true, the input goes on past the window, so
+        the scan stops before a match that runs to the end of it, and
+        returns the position the match starts at.
+        """
+        # Byte buffers are sliced without copying.
+        if isinstance(src_string, basestring):
+            view = None
+        else:
+            view = buffer
+
+        # Skip and token rules are carried out here rather than called,
+        # except on byte buffers, where their functions make the tokens.
+        if view is None:
+            inline = self._inline
+            fast_rules = self._fast
+        else:
+            inline = fast_rules = {}
+
+        # The state, and so the matchers, can only change when a rule is
+        # called.
         n = len(src_string)
-        while pos < n:
-            assert self.state in self.patterns
-
-            # Try each possible token regexp on this bit of string.
-            longest = 0
-            best = None
-            for fn, regex in self.patterns[self.state]:
-                m = regex.match(src_string, pos)
-                if m is not None:
-                    this_length = len(m.group(0))
-                    if this_length > longest:
-                        longest = this_length
-                        best = fn, m
-
-            # Find the longest match.
-            if best is None:
-                raise SparkleInternalError(
-                    "Lexical error at position %d." % pos,
-                    pos
-                    )
-            fn, m = best
+        matchers = self.matchers
+        state = self.state
+        assert state in matchers
+        matcher = matchers[state]
+        fast = fast_rules.get(state)
+        tokens, add = self._token_sink()
+        while True:
+            if sync is not None:
+                stop = sync(pos, state)
+                if stop is not None:
+                    return stop
+            if boundaries is not None:
+                boundaries.append((pos, state, self._mark()))
+            if pos >= n:
+                return None
+
+            # Try the rule that wins every match starting with this
+            # character, if there is one.
+            m = None
+            if fast is not None:
+                entry = fast[src_string[pos]]
+                if entry is not None:
+                    match, fn, action = entry
+                    m = match(src_string, pos)
+
+            if m is not None:
+                end = m.end()
+            else:
+                # Find the longest match.
+                best = matcher.match(src_string, pos)
+                if best is None:
+                    raise SparkleInternalError(
+                        "Lexical error at position %d." % (offset + pos),
+                        offset + pos
+                        )
+                fn, end = best
+                action = inline.get(fn)
 
-            # Call the entry associated with the longest match
-            fn(m.group(0), src_string, pos)
+            # A match that could go on past the window is found again
+            # once more of the input has been read.
+            if more and end == n:
+                return pos
+
+            if action is None:
+                # Call the entry associated with the longest match
+                if view is None:
+                    fn(src_string[pos:end], src_string, offset + pos)
+                else:
+                    fn(view(src_string, pos, end - pos), src_string,
+                       offset + pos)
+                if self.state is not state:
+                    state = self.state
+                    assert state in matchers
+                    matcher = matchers[state]
+                    fast = fast_rules.get(state)
+            elif action[0] is not None:
+                token_type, convert = action
+                value = src_string[pos:end]
+                if convert is not None:
+                    value = convert(value)
+                if tokens is not self.tokens:
+                    tokens, add = self._token_sink()
+                if add is None:
+                    tokens.append(Token(token_type, value, offset + pos))
+                else:
+                    add(token_type, value, offset + pos)
 
             # Start again from the end of the previous match
-            if m.end() == pos:
+            if end == pos:
                 raise SparkleInternalError(
-                    'Found empty match at %d.' % m.start(),
-                    m.start()
+                    'Found empty match at %d.' % (offset + pos),
+                    offset + pos
                     )
-            pos = m.end()
+            pos = end
 
-    @rule(r'(.|\n)')
-    def t_default(self, token, full_string, position):
+    def _token_sink(self):
         """
-        The default rule that will be used (in all states) if no
-        other rule matches. The default implementation raises an error.
-        This can be overridden in a subclass to provide other
-        behaviour.
+        Returns the list (or other object with an append method) the
+        token rules add their tokens to, and the add method to use
+        instead of making Token objects, if it is a tokens.TokenBuffer.
         """
-        raise SparkleError(
-            "Found unmatched input at position %d" % position,
-            position
-            )
+        tokens = getattr(self, 'tokens', None)
+        if isinstance(tokens, TokenBuffer):
+            return tokens, tokens.add
+        return tokens, None
+
+    def _mark(self):
+        """
+        Returns a count of the output the rules have made so far, kept
+        with each boundary of an incremental scan. The base class
+        keeps no output, so this is always 0.
+        """
+        return 0
+
+    def _rewind(self, mark):
+        """
+        Throws away the output made since the given mark, before the
+        rules are run again from there.
+        """
+        pass
 
 class TokenizingScanner(GenericScanner):
     """
     A scanner that builds up tokens into a list internally. This is
-    intended for use with the decorators.generate_token decorator.
+    intended for use with the decorators.generate_token decorator, or
+    with decorators.token and decorators.skip, whose rules the scanner
+    carries out itself without calling a method, which is much faster.
+
+    If the class declares a result_cache (a tables.ResultCache), the
+    tokens of each string tokenized are kept in it, and a string met
+    again gets them from there, without running the rules. Only
+    declare one if the rules do nothing but make tokens and change
+    the state.
     """
-    def tokenize(self, src_string, initial_state=None):
+    result_cache = None
+
+    def tokenize(self, src_string, initial_state=None, tokens=None):
         """
-        Tokenizes the string and returns the list of Token objects.
+        Tokenizes the string (or byte buffer) and returns the list of
+        Token objects.
+
+        If tokens is given, the tokens are appended to it instead of
+        to a new list, and it is returned. Passing a tokens.TokenBuffer
+        stores them compactly.
         """
-        self.tokens = []
+        if tokens is None:
+            tokens = []
+        if self.result_cache is not None and not self.incremental and \
+                isinstance(src_string, basestring):
+            cached, state = self.result_cache.get(
+                'tokenize', self._result_source(src_string, initial_state),
+                lambda: self._tokenize_new(src_string, initial_state)
+                )
+            tokens.extend(cached)
+            self.tokens = tokens
+            self.state = state
+            return tokens
+        self.tokens = tokens
         super(TokenizingScanner, self).tokenize(src_string, initial_state)
         return self.tokens
+
+    def retokenize(self, src_string, start, old_end, new_end):
+        """
+        Tokenizes the string again after an edit to the string last
+        tokenized, which replaced the characters from start to old_end
+        with the characters from start to new_end of the new string.
+        The string must have been tokenized incrementally.
+
+        Returns the tokens, which are the list (or TokenBuffer) last
+        tokenized into, changed in place, and the range of them that
+        changed, as (start, old_end, new_end) token indices, ready to
+        pass on to GenericParser.reparse. The tokens after the range
+        are the old ones, with their positions moved along.
+        """
+        first, old_mark, new_mark = super(TokenizingScanner, self).retokenize(
+            src_string, start, old_end, new_end
+            )
+        delta = new_end - old_end
+        rest = self._rewound[old_mark - first:]
+        self._rewound = None
+        if delta:
+            for token in rest:
+                token.position += delta
+        self.tokens.extend(rest)
+        return self.tokens, (first, old_mark, new_mark)
+
+    def tokenize_sliced(self, src_string, initial_state=None, tokens=None,
+                        slice_size=1000, time_budget=None, deadline=None):
+        """
+        Returns a slicing.SlicedJob that tokenizes the string as it is
+        iterated, as GenericScanner.tokenize_sliced does. The job's
+        result is the list of tokens, or the tokens object given, as
+        with tokenize.
+        """
+        return SlicedJob(
+            lambda check, result: self._tokenize_steps(
+                src_string, initial_state, check, result, tokens
+                ),
+            slice_size, time_budget, deadline
+            )
+
+    def tokenize_stream(self, source, initial_state=None, chunk_size=65536):
+        """
+        Tokenizes text read from a file object (anything with a read
+        method) or from an iterable of string chunks, yielding the
+        Token objects as they are found. Only a window of the input is
+        kept in memory, rather than the whole string and token list.
+
+        Positions are still absolute offsets into the whole input. The
+        string passed to the t_* rules is the current window, however,
+        so rules shouldn't index into it using their position.
+
+        Any token up to chunk_size characters long is found just as
+        tokenize would find it. A match that runs to the end of the
+        window is retried once more input has been read, so longer
+        tokens are found too, provided their rule matches as far as the
+        end of the window.
+        """
+        chunks = _iter_chunks(source, chunk_size)
+        self.state = initial_state
+        self.boundaries = None
+        self.tokens = tokens = []
+
+        # Stop to read more once less than a chunk of input is left
+        # ahead of the position.
+        def sync(pos, state):
+            if not eof and len(window) - pos < chunk_size:
+                return pos
+            return None
+
+        window, eof = _refill(None, 0, chunks, chunk_size)
+        offset = 0
+        while window:
+            stop = self._scan(window, 0, None, sync, offset, not eof)
+
+            # Hand on the tokens found in this window.
+            for found in tokens:
+                yield found
+            del tokens[:]
+            if stop is None:
+                break
+
+            # Keep at least a chunk of input ahead of the position, and
+            # more than the match that stopped the scan at the end of
+            # the window, if that is why it stopped.
+            window, eof = _refill(
+                window, stop, chunks, len(window) - stop + chunk_size
+                )
+            offset += stop
+
+    def tokenize_parallel(self, src_string, initial_state=None, tokens=None,
+                          workers=None, chunk_size=1 << 20, states=None,
+                          overlap=4096):
+        """
+        Tokenizes a large string in a pool of the given number of worker
+        processes (by default, one per CPU), giving the same tokens as
+        tokenize. If tokens is given, the tokens are appended to it, as
+        they are by tokenize. The workers scan into TokenBuffers if it
+        is one, whose columns are copied into it without making a Token
+        for each.
+
+        The string is split into chunks of about chunk_size characters,
+        and the workers scan each chunk (and up to overlap characters
+        after it, to finish the match running over its end) from each
+        of the given candidate states, by default all the states of the
+        scanner. Each scan is a guess, since the real scan may reach
+        the chunk part way through a match, or in another state. The
+        guesses are then stitched together: the rules are run again in
+        this process only from where the real scan isn't at the start
+        of a match of some guess, in the same state, up to where it is.
+
+        This relies on each match depending only on the state and on
+        the text from its start to no more than overlap characters past
+        its end, and on the rules having no effects other than the
+        tokens and the state. The rules in the workers are given the
+        text of their chunk, rather than the whole string, so shouldn't
+        index into it using their position.
+        """
+        if tokens is None:
+            tokens = []
+        n = len(src_string)
+        if states is None:
+            states = self.matchers.keys()
+        compact = isinstance(tokens, TokenBuffer)
+
+        def jobs():
+            for start in xrange(0, n, chunk_size):
+                end = min(start + chunk_size, n)
+                text = src_string[start:end + overlap]
+                if start == 0:
+                    guesses = [initial_state]
+                else:
+                    guesses = states
+                for state in guesses:
+                    yield (
+                        start // chunk_size, text, start, end - start,
+                        end + overlap >= n, state, compact
+                        )
+
+        # The guessed scans of each chunk, as (positions, states, marks,
+        # tokens, end) tuples, where end is the (position, state, mark)
+        # the scan finished at.
+        runs = {}
+        pool = multiprocessing.Pool(workers, _start_worker, (self,))
+        try:
+            for index, run in pool.imap_unordered(_scan_chunk, jobs()):
+                runs.setdefault(index, []).append(run)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        def sync(pos, state):
+            # Is this the start of a match of a guess, in the same state?
+            index = pos // chunk_size
+            for chunk in (index, index - 1):
+                for run in runs.get(chunk, ()):
+                    positions = run[0]
+                    j = bisect.bisect_left(positions, pos)
+                    if j < len(positions) and positions[j] == pos and \
+                            run[1][j] == state:
+                        return run, j
+            return None
+
+        self.tokens = tokens
+        self.state = initial_state
+        self.boundaries = None
+        pos = 0
+        while True:
+            found = self._scan(src_string, pos, None, sync)
+            if found is None:
+                return self.tokens
+            (positions, run_states, marks, run_tokens, end), j = found
+            pos, self.state, mark = end
+            if compact:
+                self.tokens.extend_columns(run_tokens, marks[j], mark)
+            else:
+                self.tokens.extend(run_tokens[marks[j]:mark])
+
+    def __getstate__(self):
+        state = super(TokenizingScanner, self).__getstate__()
+        state.pop('tokens', None)
+        return state
+
+    # ........................................................................
+    # Internal functions
+
+    def _mark(self):
+        return len(self.tokens)
+
+    def _tokenize_steps(self, src_string, initial_state, check, result,
+                        tokens=None):
+        """
+        Tokenizes the string into the tokens given (or a new list), as
+        GenericScanner._tokenize_steps does, and appends them to the
+        result list when done.
+        """
+        if tokens is None:
+            tokens = []
+        self.tokens = tokens
+        steps = super(TokenizingScanner, self)._tokenize_steps(
+            src_string, initial_state, check, []
+            )
+        for position in steps:
+            yield position
+        result.append(self.tokens)
+
+    def _tokenize_new(self, src_string, initial_state):
+        """
+        Tokenizes the string into a new list, and returns it with the
+        state at the end, for the result cache.
+        """
+        self.tokens = []
+        super(TokenizingScanner, self).tokenize(src_string, initial_state)
+        return self.tokens, self.state
+
+    def _result_source(self, src_string, initial_state):
+        """
+        Returns the data identifying the result of tokenizing the
+        string, for the result cache.
+        """
+        cls = self.__class__
+        rules = tuple([
+                (state, tuple([
+                            (regex.pattern, regex.flags)
+                            for fn, regex in self.patterns[state]
+                            ]))
+                for state in sorted(self.patterns)
+                ])
+        return ('%s.%s' % (cls.__module__, cls.__name__), self.engine,
+                rules, initial_state, src_string)
+
+    def _rewind(self, mark):
+        # The tokens thrown away are kept for retokenize, which puts
+        # back the ones after the edit that stand.
+        self._rewound = self.tokens[mark:]
+        del self.tokens[mark:]
+
+class _FastRules(dict):
+    """
+    Maps each character met in a state to the (match method,
+    function, action) of the rule that wins every match starting with
+    the character (see matchers.RuleDecider), or to None if there is
+    no such rule. The action is the (token type, conversion) of a
+    skip or token rule, or None for others. Characters are decided
+    when first met.
+    """
+    def __init__(self, decider, rules, inline):
+        dict.__init__(self)
+        self.decider = decider
+        self.rules = rules
+        self.inline = inline
+
+    def __missing__(self, c):
+        entry = None
+        index = self.decider.decide(c)
+        if index is not None:
+            fn, regex = self.rules[index]
+            entry = regex.match, fn, self.inline.get(fn)
+        self[c] = entry
+        return entry
+
+# The scanner of a worker process used by tokenize_parallel.
+_worker = None
+
+def _start_worker(scanner):
+    global _worker
+    _worker = scanner
+
+def _scan_chunk(job):
+    """
+    Scans a chunk of a string from the guessed state, up to the first
+    match starting at or after its end. Returns the index of the chunk,
+    and the guessed scan.
+    """
+    index, text, offset, length, last, state, compact = job
+    scanner = _worker
+    scanner.state = state
+    if compact:
+        scanner.tokens = TokenBuffer()
+    else:
+        scanner.tokens = []
+    boundaries = []
+
+    def sync(pos, state):
+        if pos >= length:
+            return pos
+        return None
+
+    try:
+        pos = scanner._scan(text, 0, boundaries, sync)
+    except SparkleErrorBase:
+        # Probably from a wrong guess of the state. The scan ends before
+        # the match that failed.
+        end = boundaries.pop()
+    else:
+        end = pos, scanner.state, scanner._mark()
+        if pos > length and not last and boundaries:
+            # The last match, running over the end of the chunk, might
+            # have gone on if it could have seen more of the string.
+            end = boundaries.pop()
+
+    # Make the positions absolute.
+    tokens = scanner.tokens
+    del tokens[end[2]:]
+    if compact:
+        tokens.shift(offset)
+    else:
+        for token in tokens:
+            token.position += offset
+    return index, (
+        array('l', [position + offset for position, s, m in boundaries]),
+        [s for p, s, m in boundaries],
+        array('l', [mark for p, s, mark in boundaries]),
+        tokens,
+        (end[0] + offset, end[1], end[2])
+        )
+
+def _iter_chunks(source, chunk_size):
+    """
+    Returns an iterator over the chunks of text in the given file
+    object or iterable.
+    """
+    if hasattr(source, 'read'):
+        return iter(lambda: source.read(chunk_size), source.read(0))
+    return iter(source)
+
+def _refill(window, pos, chunks, wanted):
+    """
+    Drops the consumed part of the window, then reads chunks until at
+    least wanted characters are available. Returns the new window,
+    and whether the input is exhausted.
+    """
+    pieces = []
+    if window is not None:
+        pieces.append(window[pos:])
+    available = sum([len(piece) for piece in pieces])
+    for chunk in chunks:
+        pieces.append(chunk)
+        available += len(chunk)
+        if available >= wanted:
+            break
+    else:
+        return ''.join(pieces), True
+    return ''.join(pieces), False
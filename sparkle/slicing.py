@@ -0,0 +1,102 @@
+"""
+Runs long scans and parses in slices, so that they can share a thread
+with other work.
+
+A scanner's tokenize_sliced and a parser's parse_sliced return a
+SlicedJob instead of doing the work. Iterating the job does the work a
+slice at a time, so a cooperative scheduler (such as an event loop
+driving generator-based coroutines) can run other tasks between the
+slices:
+
+    job = parser.parse_sliced(tokens, time_budget=0.01)
+    for position in job:
+        yield  # Let the loop run other tasks.
+    result = job.result
+"""
+import time
+from errors import SparkleTimeoutError
+
+class SlicedJob(object):
+    """
+    A scan or parse that runs a slice at a time as it is iterated,
+    generating the position it has reached after each slice. When the
+    iteration finishes, the result is in the result attribute and done
+    is True.
+
+    A slice ends after slice_size tokens, or, if time_budget is given,
+    once it has run for time_budget seconds. If deadline is given (a
+    time.time() value), a SparkleTimeoutError with the position reached
+    is raised once it passes. Both are checked every check_interval
+    tokens (every slice_size tokens if neither is given), so a slice
+    can run past its time budget, and the job past its deadline, by as
+    long as that many tokens take. The job can be cancelled by not
+    iterating it any further, or by calling cancel.
+    """
+    def __init__(self, make_steps, slice_size=1000, time_budget=None,
+                 deadline=None):
+        """
+        Make_steps is called with the number of tokens between checks,
+        and a list, and returns a generator that does the work,
+        generating the position reached after each of those numbers of
+        tokens, and appending the result to the list when it is done.
+        """
+        self.slice_size = slice_size
+        self.time_budget = time_budget
+        self.deadline = deadline
+        if time_budget is None and deadline is None:
+            self.check_interval = slice_size
+        else:
+            self.check_interval = max(1, min(slice_size, _CHECK_INTERVAL))
+        self.result = None
+        self.done = False
+        self.position = 0
+        self._result = []
+        self.steps = make_steps(self.check_interval, self._result)
+
+    def __iter__(self):
+        clock = time.time
+        tokens = 0
+        started = clock()
+        for position in self.steps:
+            self.position = position
+            tokens += self.check_interval
+            now = clock()
+            if self.deadline is not None and now >= self.deadline:
+                self.steps.close()
+                raise SparkleTimeoutError(
+                    "Ran out of time at position %d." % position,
+                    position
+                    )
+            if tokens >= self.slice_size or (
+                    self.time_budget is not None and
+                    now - started >= self.time_budget
+                    ):
+                yield position
+                tokens = 0
+                started = clock()
+        if self._result:
+            self.result = self._result[0]
+            self.done = True
+
+    def run(self):
+        """
+        Runs the rest of the job without stopping between slices (but
+        still checking the deadline), and returns the result.
+        """
+        for position in self:
+            pass
+        return self.result
+
+    def cancel(self):
+        """
+        Stops the job, leaving it unfinished. Iterating it any further
+        generates nothing.
+        """
+        self.steps.close()
+
+# ..........................................................................
+# Internal data
+
+# The most tokens to do between checks of the time. Each check costs
+# about as much as a token, so checking more often slows the job down.
+_CHECK_INTERVAL = 16
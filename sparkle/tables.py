@@ -0,0 +1,239 @@
+import os
+import errno
+import hashlib
+import tempfile
+import cPickle as pickle
+from collections import OrderedDict
+
+class TableCache(object):
+    """
+    Keeps the tables that parsers and scanners compile from their
+    rules, so that constructing another instance with the same rules
+    doesn't compile them again.
+
+    Tables are kept in memory for the life of the process. If a
+    directory is given, they are also pickled there, so that new
+    processes can load them instead of compiling them. Tables are
+    keyed by a hash of the data they were compiled from, so a changed
+    grammar never picks up a stale table. Only point the cache at a
+    directory you trust, as loading a table unpickles it.
+    """
+
+    # Changing the format of any table must change this, so that old
+    # tables are not loaded.
+    FORMAT = 2
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.tables = {}
+
+    def get(self, kind, source, build):
+        """
+        Returns the table of the given kind for the given source data,
+        calling build to compile it if it isn't cached. The source
+        must have a repr that identifies it completely, such as a
+        tuple of strings.
+        """
+        key = '%s-%s' % (
+            kind, hashlib.sha1(repr((self.FORMAT, source))).hexdigest()
+            )
+        table = self.tables.get(key)
+        if table is None:
+            table = _load(self.directory, key)
+            if table is None:
+                table = build()
+                _save(self.directory, key, table)
+            self.tables[key] = table
+        return table
+
+    def clear(self):
+        """
+        Forgets the tables held in memory.
+        """
+        self.tables.clear()
+
+class TableSet(object):
+    """
+    The tables one scanner or parser has got from a TableCache. They
+    are pickled along with it, so that unpickling it in another process
+    (to hand it to a worker, say) doesn't compile them again.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.tables = {}
+
+    def get(self, kind, source, build):
+        """
+        Returns the table of the given kind for the given source data,
+        as TableCache.get does.
+        """
+        table = self.tables.get((kind, source))
+        if table is None:
+            if self.cache is None:
+                table = build()
+            else:
+                table = self.cache.get(kind, source, build)
+            self.tables[kind, source] = table
+        return table
+
+    def __getstate__(self):
+        # The cache belongs to the process, so isn't pickled.
+        return self.tables
+
+    def __setstate__(self, tables):
+        self.cache = None
+        self.tables = tables
+
+class ResultCache(object):
+    """
+    Keeps the results of scanning and parsing inputs, so that the same
+    input given again gets the same result without doing the work
+    again. Scanners and parsers only use one if their class declares
+    it, as their result_cache attribute, because caching skips the
+    side effects of their rule functions. The results are shared by
+    every call that gets them, so mustn't be changed.
+
+    Results are kept in memory, with the least recently used thrown
+    out once there are more than max_entries of them, or (if max_bytes
+    is given) once their total pickled size passes max_bytes. If a
+    directory is given, results are also pickled there, without a
+    bound, and loaded when they aren't in memory. As with a
+    TableCache, only point it at a directory you trust. Results are
+    keyed by a hash of the class, the rules and the input, but not of
+    the code of the rule functions, so changing those must go with
+    clearing the directory.
+
+    Hits, misses and evictions count the results found (in memory or
+    on disk), the results made, and the results thrown out of memory.
+    """
+
+    # Changing the form of any result must change this.
+    FORMAT = 1
+
+    def __init__(self, max_entries=1000, max_bytes=None, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.results = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kind, source, build):
+        """
+        Returns the result of the given kind for the given source
+        data, calling build to make it if it isn't cached. The source
+        must have a repr that identifies it completely.
+        """
+        key = '%s-%s' % (
+            kind, hashlib.sha1(repr((self.FORMAT, source))).hexdigest()
+            )
+        entry = self.results.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            self.results[key] = entry
+            return entry[0]
+
+        result = _load(self.directory, key)
+        saved = result is not None
+        if saved:
+            self.hits += 1
+        else:
+            self.misses += 1
+            result = build()
+        data = None
+        if self.directory is not None or self.max_bytes is not None:
+            try:
+                data = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError):
+                # Results that can't be pickled are only kept in
+                # memory, and only if there's no bound on their size.
+                pass
+        if data is not None and not saved:
+            _save(self.directory, key, data, pickled=True)
+        self._remember(key, result, data)
+        return result
+
+    def clear(self):
+        """
+        Forgets the results held in memory, and resets the counts.
+        """
+        self.__init__(self.max_entries, self.max_bytes, self.directory)
+
+    def __repr__(self):
+        return "<%s of %d results, %d hits, %d misses, %d evictions>" % (
+            self.__class__.__name__, len(self.results), self.hits,
+            self.misses, self.evictions
+            )
+
+    def _remember(self, key, result, data):
+        """
+        Keeps a result in memory, throwing out the least recently used
+        results to stay within the bounds.
+        """
+        size = 0
+        if self.max_bytes is not None:
+            if data is None or len(data) > self.max_bytes:
+                return
+            size = len(data)
+        self.results[key] = result, size
+        self.total_bytes += size
+        while len(self.results) > self.max_entries or (
+                self.max_bytes is not None and
+                self.total_bytes > self.max_bytes
+                ):
+            old_key, (old_result, old_size) = self.results.popitem(False)
+            self.total_bytes -= old_size
+            self.evictions += 1
+
+# The cache used by default. Set the SPARKLE_CACHE_DIR environment
+# variable to have it keep tables on disk.
+default_cache = TableCache(os.environ.get('SPARKLE_CACHE_DIR'))
+
+# ..........................................................................
+# Internal functions
+
+def _path(directory, key):
+    return os.path.join(directory, key + '.pickle')
+
+def _load(directory, key):
+    """
+    Returns the object pickled with the given key in the directory, or
+    None if there isn't one.
+    """
+    if directory is None:
+        return None
+    try:
+        with open(_path(directory, key), 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except (IOError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError):
+        # A missing, unreadable or corrupt file is made again.
+        return None
+
+def _save(directory, key, value, pickled=False):
+    """
+    Pickles the object with the given key in the directory, if there
+    is one. If pickled is True, the value is the pickled data already.
+    """
+    if directory is None:
+        return
+    try:
+        try:
+            os.makedirs(directory)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+        # Write to a temporary file first, so that other processes
+        # never see a partly written file.
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as cache_file:
+            if pickled:
+                cache_file.write(value)
+            else:
+                pickle.dump(value, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, _path(directory, key))
+    except (IOError, OSError):
+        # Caching is an optimisation, so failing to save isn't fatal.
+        pass
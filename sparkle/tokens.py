@@ -1,7 +1,11 @@
+from array import array
+
 class Token(object):
     """
     Holds a single token found from the scanning algorithm.
     """
+    __slots__ = ('token_type', 'value', 'position')
+
     def __init__(self, token_type, value, position):
         self.token_type = token_type
         self.value = value
@@ -26,6 +30,184 @@ class Token(object):
     def __hash__(self):
         return hash(self.token_type) ^ hash(self.value)
 
+    def __getstate__(self):
+        return self.token_type, self.value, self.position
+
+    def __setstate__(self, state):
+        self.token_type, self.value, self.position = state
+
+class LazyToken(Token):
+    """
+    A token for text matched in a byte buffer, such as an mmap, that
+    only converts its matched text into a value when the value is
+    first accessed. Tokens that are never looked at never allocate a
+    string.
+
+    The text is the (usually zero-copy) view of the matched bytes that
+    the scanner passed to the rule. If an encoding is given, the value
+    is decoded with it, otherwise it is the raw byte string.
+    """
+    __slots__ = ('text', 'encoding', '_value')
+
+    def __init__(self, token_type, text, position, encoding=None):
+        self.token_type = token_type
+        self.text = text
+        self.position = position
+        self.encoding = encoding
+        self._value = None
+
+    @property
+    def end(self):
+        """
+        The offset in the buffer just after the end of this token.
+        """
+        return self.position + len(self.text)
+
+    def _get_value(self):
+        if self._value is None:
+            text = self.text
+            if not isinstance(text, basestring):
+                text = str(text)
+            if self.encoding is not None and isinstance(text, str):
+                text = text.decode(self.encoding)
+            self._value = text
+        return self._value
+
+    def _set_value(self, value):
+        self._value = value
+
+    value = property(_get_value, _set_value)
+
+    def __getstate__(self):
+        # A buffer view can't be pickled, and would keep the buffer
+        # alive, so the matched bytes are copied into a string.
+        text = self.text
+        if not isinstance(text, basestring):
+            text = str(text)
+        return (self.token_type, text, self.position, self.encoding,
+                self._value)
+
+    def __setstate__(self, state):
+        (self.token_type, self.text, self.position, self.encoding,
+         self._value) = state
+
+class TokenBuffer(object):
+    """
+    Compact, column-oriented storage for long sequences of tokens.
+
+    Token types are interned to small integers, and stored with the
+    token positions in arrays, while the values are kept in a list.
+    A Token object is only created when an individual token is asked
+    for. The parser reads the type column directly, so it can parse a
+    buffer without creating a Token for each position.
+
+    Pass a TokenBuffer as the tokens argument of
+    TokenizingScanner.tokenize to have the scanner emit into it.
+    """
+    def __init__(self, tokens=()):
+        self.type_names = []
+        self.type_ids = {}
+        self.types = array('i')
+        # Positions in huge mapped inputs can pass 2**31.
+        self.positions = array('l')
+        self.values = []
+        self.extend(tokens)
+
+    def add(self, token_type, value, position):
+        """
+        Adds a token to the end of the buffer, given its fields.
+        """
+        type_id = self.type_ids.get(token_type)
+        if type_id is None:
+            type_id = self.type_ids[token_type] = len(self.type_names)
+            self.type_names.append(token_type)
+        self.types.append(type_id)
+        self.positions.append(position)
+        self.values.append(value)
+
+    def append(self, token):
+        """
+        Adds a Token object to the end of the buffer.
+        """
+        if isinstance(token, LazyToken):
+            # Keep lazy tokens whole, so their values stay undecoded.
+            self.add(token.token_type, token, token.position)
+        else:
+            self.add(token.token_type, token.value, token.position)
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.append(token)
+
+    def extend_columns(self, other, start=0, end=None):
+        """
+        Adds the tokens from start to end of another TokenBuffer to the
+        end of this one, copying its columns rather than making a Token
+        for each.
+        """
+        if end is None:
+            end = len(other)
+        types = other.types[start:end]
+        names = other.type_names
+        if names != self.type_names[:len(names)]:
+            type_ids = []
+            for token_type in names:
+                type_id = self.type_ids.get(token_type)
+                if type_id is None:
+                    type_id = self.type_ids[token_type] = len(self.type_names)
+                    self.type_names.append(token_type)
+                type_ids.append(type_id)
+            types = array('i', [type_ids[type_id] for type_id in types])
+        self.types.extend(types)
+        self.positions.extend(other.positions[start:end])
+        self.values.extend(other.values[start:end])
+
+    def shift(self, delta):
+        """
+        Moves the positions of all the tokens along by delta.
+        """
+        self.positions = array('l', [
+                position + delta for position in self.positions
+                ])
+        for value in self.values:
+            if isinstance(value, LazyToken):
+                value.position += delta
+
+    def token_types(self):
+        """
+        Returns a list of the type of each token. The type names are
+        shared, so this doesn't allocate per token beyond the list.
+        """
+        names = self.type_names
+        return [names[type_id] for type_id in self.types]
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        value = self.values[index]
+        if isinstance(value, LazyToken):
+            return value
+        return Token(
+            self.type_names[self.types[index]],
+            value,
+            self.positions[index]
+            )
+
+    def __delitem__(self, index):
+        del self.types[index]
+        del self.positions[index]
+        del self.values[index]
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return "<%s of %d tokens>" % (self.__class__.__name__, len(self))
+
 class AST(object):
     """
     A node in the generated AST.
@@ -72,3 +254,252 @@ class AST(object):
 
     def __str__(self):
         return ""
+
+class ASTArena(object):
+    """
+    Compact storage for large trees, with each node held as a row of
+    flat arrays rather than as an object.
+
+    Every node has an index. A node is either a leaf, holding a value
+    (such as a Token), or a branch, with a kind and a sequence of
+    child nodes. Kinds are interned to small integers, like the token
+    types of a TokenBuffer: kinds[node] is the number of the node's
+    kind in kind_names, or LEAF. The first_child, next_sibling and
+    parent columns link the nodes together (with -1 for none), and
+    the values of the leaves are kept in a list.
+
+    Nodes are added from the leaves up, so parse actions can build
+    into an arena directly, returning node indices:
+
+        @rule('expr ::= expr + term')
+        def p_add(self, args):
+            arena = self.arena
+            return arena.add('add', [args[0], arena.leaf(args[1]),
+                                     args[2]])
+
+    A node's children are fixed when it is added, so the size and
+    complexity of each subtree are worked out then, and kept.
+
+    An AST can be copied into an arena with add_ast, and a node back
+    out with to_ast.
+    """
+    LEAF = -1
+
+    def __init__(self):
+        self.kind_names = []
+        self.kind_ids = {}
+        self.kinds = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.parent = array('i')
+        self.sizes = array('l')
+        self.complexities = array('l')
+        self.values = []
+        # The kinds of the branches made from lists and tuples.
+        self._sequence_ids = set()
+
+    def leaf(self, value):
+        """
+        Adds a leaf holding the given value, and returns its index.
+        """
+        self.kinds.append(self.LEAF)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.parent.append(-1)
+        self.sizes.append(1)
+        self.complexities.append(0)
+        self.values.append(value)
+        return len(self.kinds) - 1
+
+    def add(self, kind, children=()):
+        """
+        Adds a branch of the given kind, whose children are the nodes
+        with the given indices, and returns its index. The children
+        mustn't already have a parent.
+        """
+        kind_id = self.kind_ids.get(kind)
+        if kind_id is None:
+            kind_id = self.kind_ids[kind] = len(self.kind_names)
+            self.kind_names.append(kind)
+            if kind in _SEQUENCES:
+                self._sequence_ids.add(kind_id)
+        index = len(self.kinds)
+
+        kinds = self.kinds
+        parent = self.parent
+        next_sibling = self.next_sibling
+        sizes = self.sizes
+        complexities = self.complexities
+        sequence_ids = self._sequence_ids
+        size = 1
+        complexity = 1
+        first = previous = -1
+        for child in children:
+            if parent[child] >= 0:
+                raise ValueError("Node %d already has a parent." % child)
+            parent[child] = index
+            if previous >= 0:
+                next_sibling[previous] = child
+            else:
+                first = child
+            previous = child
+            size += sizes[child]
+            if kinds[child] not in sequence_ids:
+                complexity += complexities[child]
+
+        kinds.append(kind_id)
+        self.first_child.append(first)
+        next_sibling.append(-1)
+        parent.append(-1)
+        sizes.append(size)
+        complexities.append(complexity)
+        self.values.append(None)
+        return index
+
+    def kind(self, index):
+        """
+        Returns the kind of the given branch, or None for a leaf.
+        """
+        kind_id = self.kinds[index]
+        if kind_id == self.LEAF:
+            return None
+        return self.kind_names[kind_id]
+
+    def is_leaf(self, index):
+        return self.kinds[index] == self.LEAF
+
+    def children(self, index):
+        """
+        Generates the indices of the children of the given node.
+        """
+        next_sibling = self.next_sibling
+        child = self.first_child[index]
+        while child >= 0:
+            yield child
+            child = next_sibling[child]
+
+    def size(self, index):
+        """
+        Returns the number of nodes in the subtree of the given node,
+        including leaves.
+        """
+        return self.sizes[index]
+
+    def complexity(self, index):
+        """
+        Returns the complexity of the given node, counted as by
+        AST.get_complexity: one for the node, plus the complexity of
+        each child that is a branch, but not a list or tuple.
+        """
+        return self.complexities[index]
+
+    def preorder(self, root):
+        """
+        Generates the indices of the nodes in the subtree of the given
+        node, each before its children.
+        """
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        parent = self.parent
+        index = root
+        while True:
+            yield index
+            if first_child[index] >= 0:
+                index = first_child[index]
+                continue
+            while index != root and next_sibling[index] < 0:
+                index = parent[index]
+            if index == root:
+                return
+            index = next_sibling[index]
+
+    def postorder(self, root):
+        """
+        Generates the indices of the nodes in the subtree of the given
+        node, each after its children.
+        """
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        parent = self.parent
+        index = root
+        while first_child[index] >= 0:
+            index = first_child[index]
+        while True:
+            yield index
+            if index == root:
+                return
+            if next_sibling[index] >= 0:
+                index = next_sibling[index]
+                while first_child[index] >= 0:
+                    index = first_child[index]
+            else:
+                index = parent[index]
+
+    def add_ast(self, tree):
+        """
+        Copies the given AST into the arena, and returns the index of
+        its root. Each AST becomes a branch whose kind is its class,
+        and each list or tuple within one a branch whose kind is list
+        or tuple. Anything else becomes a leaf.
+        """
+        # Children are added before their parents, so the indices of
+        # the children of each node are at the top of the results.
+        pending = [(tree, False)]
+        results = []
+        while pending:
+            item, ready = pending.pop()
+            if ready:
+                if isinstance(item, AST):
+                    count = len(item.expression)
+                else:
+                    count = len(item)
+                start = len(results) - count
+                results[start:] = [self.add(type(item), results[start:])]
+            elif isinstance(item, AST) or type(item) in _SEQUENCES:
+                pending.append((item, True))
+                if isinstance(item, AST):
+                    item = item.expression
+                for element in reversed(item):
+                    pending.append((element, False))
+            else:
+                results.append(self.leaf(item))
+        return results[0]
+
+    def to_ast(self, root):
+        """
+        Returns the given node as an AST, or as the value of a leaf.
+        Branches whose kind is an AST class, list or tuple become one
+        of those, holding their children, as add_ast makes them.
+        Branches of any other kind become an AST holding the kind,
+        then their children.
+        """
+        kinds = self.kinds
+        results = []
+        for index in self.postorder(root):
+            kind_id = kinds[index]
+            if kind_id == self.LEAF:
+                results.append(self.values[index])
+                continue
+            count = 0
+            for child in self.children(index):
+                count += 1
+            start = len(results) - count
+            items = results[start:]
+            kind = self.kind_names[kind_id]
+            if kind in _SEQUENCES:
+                node = kind(items)
+            elif isinstance(kind, type) and issubclass(kind, AST):
+                node = kind(*items)
+            else:
+                node = AST(kind, *items)
+            results[start:] = [node]
+        return results[0]
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __repr__(self):
+        return "<%s of %d nodes>" % (self.__class__.__name__, len(self))
+
+# The types that add_ast turns into branches, like AST nodes.
+_SEQUENCES = (list, tuple)
@@ -0,0 +1,9 @@
+"""
+Tests for sparkle. Run them from the top of the source tree with:
+
+    python -m unittest discover tests
+
+The engines are checked against the 'reference' engines they replace,
+and against brute force, on fixed examples and on randomly generated
+rules and inputs (see harness).
+"""
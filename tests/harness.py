@@ -0,0 +1,200 @@
+"""
+Random grammars and inputs, and brute force answers to check the
+engines against.
+
+Grammars are dictionaries mapping each nonterminal to a list of the
+right hand sides of its rules, as tuples of symbol names. The start
+symbol is 'S', and the terminals are lower case letters.
+"""
+import re
+import random
+from sparkle import *
+
+def random_grammar(rnd, nonterminals='SABC', terminals='ab', length=3):
+    """
+    Returns a random grammar over the given symbols, with up to three
+    rules for each nonterminal, of up to length symbols each. Rules
+    with no symbols, cycles and ambiguities are all likely.
+    """
+    symbols = list(nonterminals) + list(terminals)
+    grammar = {}
+    for nonterminal in nonterminals:
+        alternatives = []
+        for k in range(rnd.randint(1, 3)):
+            rhs = tuple([
+                    rnd.choice(symbols)
+                    for j in range(rnd.randint(0, length))
+                    ])
+            if rhs not in alternatives:
+                alternatives.append(rhs)
+        grammar[nonterminal] = alternatives
+    return grammar
+
+def parser_class(grammar, start='S'):
+    """
+    Returns a GenericParser subclass for the grammar, with a p_*
+    method for each rule, building (name, argument values...) tuples.
+    """
+    members = {
+        '__init__': lambda self: GenericParser.__init__(self, start),
+        }
+    for lhs, alternatives in grammar.items():
+        for index, rhs in enumerate(alternatives):
+            name = 'p_%s%d' % (lhs, index)
+            function = _builder(lhs + str(index))
+            function.__name__ = name
+            members[name] = rule('%s ::= %s' % (lhs, ' '.join(rhs)))(
+                function
+                )
+    return type('RandomParser', (GenericParser,), members)
+
+def make_tokens(types):
+    """
+    Returns a list of Token objects of the given types, each with its
+    type as its value.
+    """
+    return [Token(token_type, token_type, i)
+            for i, token_type in enumerate(types)]
+
+def random_types(rnd, terminals='ab', most=5):
+    """
+    Returns a random list of up to most of the given token types.
+    """
+    return [rnd.choice(terminals) for i in range(rnd.randint(0, most))]
+
+def with_engine(cls, engine):
+    """
+    Returns a subclass of the given scanner or parser class using the
+    given engine, so that the engine of the class itself, which other
+    tests use, is left alone.
+    """
+    subclass = _engine_classes.get((cls, engine))
+    if subclass is None:
+        subclass = type(cls.__name__, (cls,), {'engine': engine})
+        _engine_classes[cls, engine] = subclass
+    return subclass
+
+def parse_result(parser_class, engine, tokens):
+    """
+    Parses the tokens with a new parser of the class using the given
+    engine, and returns the result, or ('error', position) for a
+    syntax error.
+    """
+    try:
+        return with_engine(parser_class, engine)().parse(list(tokens))
+    except SparkleSyntaxError, e:
+        return 'error', e.position
+
+def derivations(grammar, symbols):
+    """
+    Counts the parse trees deriving the symbols from 'S' by brute
+    force, or returns None if a cycle gives infinitely many.
+    """
+    n = len(symbols)
+    counts = {}
+
+    def count(symbol, i, j):
+        if symbol not in grammar:
+            return int(j == i + 1 and symbols[i] == symbol)
+        return counts.get((symbol, i, j), 0)
+
+    def sequence(rhs, i, j):
+        if not rhs:
+            return int(i == j)
+        return sum([
+                count(rhs[0], i, k) * sequence(rhs[1:], k, j)
+                for k in range(i, j + 1)
+                ])
+
+    # The counts for each span are iterated to a fixed point, which is
+    # only reached if there are no cycles among the nonempty spans.
+    for length in range(n + 1):
+        for i in range(n - length + 1):
+            j = i + length
+            for iteration in range(len(grammar) + 2):
+                changed = False
+                for symbol, alternatives in grammar.items():
+                    total = sum([
+                            sequence(rhs, i, j) for rhs in alternatives
+                            ])
+                    if counts.get((symbol, i, j), 0) != total:
+                        counts[symbol, i, j] = total
+                        changed = True
+                if not changed:
+                    break
+            else:
+                return None
+    return count('S', 0, n)
+
+def accepts(grammar, symbols):
+    """
+    Checks by brute force if 'S' derives the symbols.
+    """
+    n = len(symbols)
+    derives = [[set() for j in range(n + 1)] for i in range(n + 1)]
+    for i in range(n):
+        derives[i][i + 1].add(symbols[i])
+
+    def sequence(rhs, i, j):
+        if not rhs:
+            return i == j
+        for k in range(i, j + 1):
+            if rhs[0] in derives[i][k] and sequence(rhs[1:], k, j):
+                return True
+        return False
+
+    changed = True
+    while changed:
+        changed = False
+        for i in range(n + 1):
+            for j in range(i, n + 1):
+                for symbol, alternatives in grammar.items():
+                    if symbol in derives[i][j]:
+                        continue
+                    for rhs in alternatives:
+                        if sequence(rhs, i, j):
+                            derives[i][j].add(symbol)
+                            changed = True
+                            break
+    return 'S' in derives[0][n]
+
+def longest_match(pattern, text):
+    """
+    Returns the length of the longest prefix of the text that the
+    whole pattern matches (the POSIX answer), or -1 if none does.
+    """
+    whole = re.compile('(?:%s)\Z' % pattern)
+    for length in range(len(text), -1, -1):
+        if whole.match(text[:length]):
+            return length
+    return -1
+
+def random_text(rnd, alphabet, most):
+    """
+    Returns a random string of up to most characters of the alphabet.
+    """
+    return ''.join([
+            rnd.choice(alphabet) for i in range(rnd.randint(0, most))
+            ])
+
+def signature(tokens):
+    """
+    Returns the (type, value, position) of each of the tokens, for
+    comparing token streams.
+    """
+    return [(token.token_type, token.value, token.position)
+            for token in tokens]
+
+# ..........................................................................
+# Internal data and functions
+
+# The subclasses made by with_engine.
+_engine_classes = {}
+
+def _builder(name):
+    """
+    Returns a rule function building a (name, values...) tuple.
+    """
+    def build(self, args):
+        return (name,) + tuple([getattr(arg, 'value', arg) for arg in args])
+    return build
@@ -0,0 +1,123 @@
+import random
+import unittest
+from sparkle import *
+
+class SumScanner(TokenizingScanner):
+    @rule(r'\s+')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\d+')
+    @token('NUMBER', int)
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'\+')
+    @token('+')
+    def t_plus(self, token, string, position):
+        pass
+
+class SumParser(GenericParser):
+    def __init__(self):
+        GenericParser.__init__(self, 'sum')
+
+    @rule('sum ::= sum + NUMBER')
+    def p_more(self, args):
+        return args[0] + args[2].value
+
+    @rule('sum ::= NUMBER')
+    def p_one(self, args):
+        return args[0].value
+
+class ParseManyTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2)
+        self.sources = []
+        for i in range(60):
+            source = ' + '.join([
+                    str(rnd.randint(0, 99))
+                    for k in range(rnd.randint(1, 6))
+                    ])
+            if i % 7 == 3:
+                # A syntax error.
+                source += ' +'
+            elif i % 7 == 5:
+                # A lexical error.
+                source = source.replace(' + ', ' - ', 1) + ' - 1'
+            self.sources.append(source)
+        self.expected = [
+            _outcome(index, source)
+            for index, source in enumerate(self.sources)
+            ]
+
+    def test_workers(self):
+        """
+        Each source gets the result (or error) parsing it alone gives,
+        in order, whether the sources are parsed in this process or in
+        worker processes.
+        """
+        for workers in [1, 3]:
+            for chunk_size in [1, 16]:
+                self.assertEqual(_summary(parse_many(
+                            SumScanner(), SumParser(), self.sources,
+                            workers=workers, chunk_size=chunk_size
+                            )), self.expected)
+
+    def test_unordered(self):
+        for workers in [1, 3]:
+            results = _summary(parse_many(
+                    SumScanner(), SumParser(), self.sources,
+                    workers=workers, ordered=False, chunk_size=4
+                    ))
+            self.assertEqual(sorted(results), self.expected)
+
+    def test_tokens(self):
+        """
+        Without a scanner, the sources are parsed as they are.
+        """
+        sources = [SumScanner().tokenize('1 + 2'), 'NUMBER + +'.split()]
+        for workers in [1, 2]:
+            results = list(parse_many(None, SumParser(), sources, workers))
+            self.assertEqual(results[0], (0, 3, None))
+            index, result, error = results[1]
+            self.assertTrue(isinstance(error, SparkleSyntaxError))
+
+    def test_errors(self):
+        errors = [
+            (index, error) for index, result, error
+            in parse_many(SumScanner(), SumParser(), self.sources, 2)
+            if error is not None
+            ]
+        self.assertEqual(len(errors), 17)
+        for index, error in errors:
+            if index % 7 == 3:
+                self.assertTrue(isinstance(error, SparkleSyntaxError))
+            else:
+                self.assertTrue(isinstance(error, SparkleError))
+                self.assertEqual(self.sources[index][error.position], '-')
+
+# ..........................................................................
+# Internal functions
+
+def _outcome(index, source):
+    """
+    Returns the summary of scanning and parsing the source on its own.
+    """
+    try:
+        return index, SumParser().parse(SumScanner().tokenize(source)), None
+    except SparkleErrorBase, err:
+        return index, None, (err.__class__, err.position)
+
+def _summary(results):
+    """
+    Returns a comparable list of the (index, result, error) triples,
+    with each error given by its class and position.
+    """
+    return [
+        (index, result, error and (error.__class__, error.position))
+        for index, result, error in results
+        ]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sparkle import *
+from sparkle.tables import TableCache
+from sparkle.codegen import write_module, check_class
+
+class CalculatorScanner(TokenizingScanner):
+    engine = 'dfa'
+
+    @rule(r'\s+')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\d+')
+    @token('NUMBER', int)
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'[-+*/()]')
+    def t_operator(self, token, string, position):
+        self.tokens.append(Token(token, token, position))
+
+class CalculatorParser(GenericParser):
+    engine = 'auto'
+
+    def __init__(self):
+        GenericParser.__init__(self, 'expr')
+
+    @rule('expr ::= expr + term  expr ::= expr - term')
+    def p_expr_binary(self, args):
+        return AST(args[1].token_type, args[0], args[2])
+
+    @rule('expr ::= term  term ::= factor')
+    def p_single(self, args):
+        return args[0]
+
+    @rule('term ::= term * factor  term ::= term / factor')
+    def p_term_binary(self, args):
+        return AST(args[1].token_type, args[0], args[2])
+
+    @rule('factor ::= NUMBER')
+    def p_number(self, args):
+        return args[0].value
+
+    @rule('factor ::= ( expr )')
+    def p_brackets(self, args):
+        return args[1]
+
+SOURCES = ['1', '1 + 2 * 3', '(1 - 2) / 3 + 4 * (5)', '1 +', '1 $ 2']
+
+class CodegenTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_samples(self):
+        """
+        The generated classes are checked against the originals on the
+        samples, and give the same results.
+        """
+        scanner = CalculatorScanner()
+        token_samples = [
+            scanner.tokenize(source) for source in SOURCES[:4]
+            ]
+        module = write_module(
+            os.path.join(self.directory, 'calculator_tables.py'),
+            [CalculatorScanner, CalculatorParser],
+            {CalculatorScanner: SOURCES, CalculatorParser: token_samples}
+            )
+        tokens = module.CalculatorScanner().tokenize(SOURCES[2])
+        self.assertEqual(
+            repr(module.CalculatorParser().parse(tokens)),
+            repr(CalculatorParser().parse(tokens))
+            )
+
+    def test_tables_not_compiled(self):
+        """
+        The generated classes take their tables from the module, rather
+        than compiling them or getting them from a cache.
+        """
+        module = write_module(
+            os.path.join(self.directory, 'calculator_all.py'),
+            [CalculatorScanner, CalculatorParser]
+            )
+        for cls in [module.CalculatorScanner, module.CalculatorParser]:
+            cache = TableCache()
+            instance = type(cls.__name__, (cls,), {'table_cache': cache})()
+            if isinstance(instance, GenericParser):
+                self.assertEqual(instance.active_engine, 'lalr')
+            self.assertTrue(instance._tables.tables)
+            self.assertEqual(cache.tables, {})
+
+    def test_different_results(self):
+        """
+        A generated class with the same rules and tables as the
+        original, which makes different tokens, fails its check.
+        """
+        module = write_module(
+            os.path.join(self.directory, 'calculator_scanner.py'),
+            [CalculatorScanner]
+            )
+
+        class Different(module.CalculatorScanner):
+            @rule(r'\d+')
+            @token('NUMBER')
+            def t_number(self, token, string, position):
+                pass
+
+        check_class(Different, CalculatorScanner)
+        self.assertRaises(
+            SparkleInternalError, check_class, Different, CalculatorScanner,
+            SOURCES
+            )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,649 @@
+import time
+import random
+import unittest
+from sparkle import *
+from sparkle.tables import TableCache, ResultCache
+from sparkle.instrument import Stats
+from harness import *
+
+class ExpressionParser(GenericParser):
+    def __init__(self):
+        GenericParser.__init__(self, 'expr')
+
+    @rule('expr ::= expr + term  expr ::= expr - term')
+    def p_expr_binary(self, args):
+        return (args[1].token_type, args[0], args[2])
+
+    @rule('expr ::= term  term ::= factor')
+    def p_single(self, args):
+        return args[0]
+
+    @rule('term ::= term * factor')
+    def p_term_binary(self, args):
+        return (args[1].token_type, args[0], args[2])
+
+    @rule('factor ::= x')
+    def p_factor_name(self, args):
+        return args[0].value
+
+    @rule('factor ::= ( expr )')
+    def p_factor_brackets(self, args):
+        return args[1]
+
+class AmbiguousParser(GenericParser):
+    def __init__(self):
+        GenericParser.__init__(self, 'e')
+
+    @rule('e ::= e + e  e ::= e * e')
+    def p_binary(self, args):
+        return (args[1].token_type, args[0], args[2])
+
+    @rule('e ::= x')
+    def p_name(self, args):
+        return args[0].value
+
+class NullableParser(GenericParser):
+    def __init__(self):
+        GenericParser.__init__(self, 'S')
+
+    @rule('S ::= A B x')
+    def p_s(self, args):
+        return ('S',) + tuple(args)
+
+    @rule('A ::=  A ::= a')
+    def p_a(self, args):
+        return ('A',) + tuple(args)
+
+    @rule('B ::= A A  B ::= b')
+    def p_b(self, args):
+        return ('B',) + tuple(args)
+
+class RightListParser(GenericParser):
+    def __init__(self):
+        GenericParser.__init__(self, 'list')
+
+    @rule('list ::= item list')
+    def p_more(self, args):
+        return args[1] + 1
+
+    @rule('list ::= item')
+    def p_one(self, args):
+        return 1
+
+    @rule('item ::= x ;')
+    def p_item(self, args):
+        return None
+
+class RecordParser(GenericParser):
+    """
+    Records, which parse_stream streams.
+    """
+    def __init__(self, start='record'):
+        GenericParser.__init__(self, start)
+
+    @rule('record ::= x = expr ;  record ::= x { body }')
+    def p_record(self, args):
+        return ('record', args[2])
+
+    @rule('body ::= body record  body ::= ')
+    def p_body(self, args):
+        if args:
+            return args[0] + [args[1]]
+        return []
+
+    @rule('expr ::= expr + expr  expr ::= 1')
+    def p_expr(self, args):
+        return tuple([getattr(arg, 'value', arg) for arg in args])
+
+class RecordsParser(RecordParser):
+    """
+    Any number of records, which is what parse_stream parses.
+    """
+    def __init__(self):
+        RecordParser.__init__(self, 'records')
+
+    @rule('records ::= records record  records ::= record')
+    def p_records(self, args):
+        if len(args) == 2:
+            return args[0] + [args[1]]
+        return args
+
+class OptionalParser(GenericParser):
+    """
+    Matches one token, or two, which parse_stream can tell apart by
+    the token after.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'root')
+
+    @rule('root ::= x  root ::= x y')
+    def p_root(self, args):
+        return len(args)
+
+class OrderParser(GenericParser):
+    """
+    Records the order its rule functions are called in.
+    """
+    def __init__(self):
+        GenericParser.__init__(self, 'root')
+        self.calls = []
+
+    @rule('root ::= a b')
+    def p_root(self, args):
+        self.calls.append('root')
+
+    @rule('a ::= x  a ::= x c')
+    def p_a(self, args):
+        self.calls.append('a')
+
+    @rule('b ::= y')
+    def p_b(self, args):
+        self.calls.append('b')
+
+    @rule('c ::= z')
+    def p_c(self, args):
+        self.calls.append('c')
+
+EXAMPLES = [
+    (ExpressionParser, [
+            'x', 'x + x * x', '( x - x ) * x', 'x * ( x + ( x ) ) - x',
+            ]),
+    (AmbiguousParser, ['x', 'x + x * x', 'x * x + x * x + x']),
+    (NullableParser, ['x', 'a x', 'b x', 'a a x', 'a a a x', 'a b x']),
+    (RightListParser, ['x ;', 'x ; x ; x ;']),
+    ]
+
+ENGINES = ['earley', 'auto']
+
+class EngineTest(unittest.TestCase):
+    """
+    Checks the engines against the 'reference' engine.
+    """
+    def test_examples(self):
+        for parser_class, sources in EXAMPLES:
+            for source in sources:
+                tokens = make_tokens(source.split())
+                expected = parse_result(parser_class, 'reference', tokens)
+                for engine in ENGINES:
+                    self.assertEqual(
+                        parse_result(parser_class, engine, tokens), expected
+                        )
+
+    def test_syntax_errors(self):
+        for source in ['', 'x +', '( x', 'x x']:
+            tokens = make_tokens(source.split())
+            errors = [
+                parse_result(ExpressionParser, engine, tokens)
+                for engine in ENGINES
+                ]
+            self.assertEqual(errors[0][0], 'error')
+            self.assertEqual(errors, errors[:1] * len(ENGINES))
+
+    def test_lalr_is_used(self):
+        self.assertEqual(
+            with_engine(ExpressionParser, 'auto')().active_engine, 'lalr'
+            )
+        self.assertEqual(
+            with_engine(AmbiguousParser, 'auto')().active_engine, 'earley'
+            )
+
+    def test_lazy_lalr_table(self):
+        """
+        The LALR(1) tables are only built when they are first needed.
+        """
+        cache = TableCache()
+        new_parser = type('LazyParser', (ExpressionParser,), {
+                'engine': 'auto', 'table_cache': cache,
+                })
+        parser = new_parser()
+        self.assertEqual(parser.lalr_table, None)
+        self.assertEqual(
+            [key for key in parser._tables.tables if key[0] == 'lalr'], []
+            )
+        self.assertEqual(len(cache.tables), 1)
+        self.assertEqual(parser.parse(make_tokens(['x'])), 'x')
+        self.assertFalse(parser.lalr_table.conflicts)
+        self.assertEqual(len(cache.tables), 2)
+
+    def test_call_order(self):
+        """
+        Every engine calls the rule functions in the same order.
+        """
+        for engine in ENGINES + ['reference']:
+            parser = with_engine(OrderParser, engine)()
+            parser.parse(make_tokens('x z y'.split()))
+            self.assertEqual(parser.calls, ['b', 'c', 'a', 'root'])
+        self.assertEqual(
+            with_engine(OrderParser, 'auto')().active_engine, 'lalr'
+            )
+
+    def test_table_cache(self):
+        """
+        Another parser with the same rules gets the grammar compiled for
+        the first from the cache, and one with other rules doesn't.
+        """
+        cache = TableCache()
+        members = {'engine': 'earley', 'table_cache': cache}
+        new_parser = type('CachedParser', (ExpressionParser,), members)
+        other_parser = type('OtherParser', (AmbiguousParser,), members)
+        grammar = new_parser()._get_grammar()
+        count = len(cache.tables)
+        self.assertTrue(new_parser()._get_grammar() is grammar)
+        self.assertEqual(len(cache.tables), count)
+        self.assertFalse(other_parser()._get_grammar() is grammar)
+        self.assertEqual(len(cache.tables), count + 1)
+
+    def test_result_cache(self):
+        """
+        Tokens parsed again get their result from the result cache,
+        unless the rules have changed.
+        """
+        cache = ResultCache()
+        new_parser = type('CachedParser', (ExpressionParser,), {
+                'result_cache': cache,
+                })
+        tokens = make_tokens('x * ( x + x )'.split())
+        expected = parse_result(ExpressionParser, 'earley', tokens)
+        for k in range(2):
+            self.assertEqual(new_parser().parse(tokens), expected)
+            self.assertEqual(new_parser().parse(TokenBuffer(tokens)),
+                             expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        new_parser().parse(make_tokens('x * x'.split()))
+        self.assertEqual(cache.misses, 3)
+
+        # A class of the same name with other rules doesn't share them.
+        @rule('factor ::= x  factor ::= y')
+        def p_factor_name(self, args):
+            return 'y'
+
+        other_parser = type('CachedParser', (ExpressionParser,), {
+                'result_cache': cache, 'p_factor_name': p_factor_name,
+                })
+        self.assertEqual(
+            other_parser().parse(tokens), ('*', 'y', ('+', 'y', 'y'))
+            )
+        self.assertEqual(cache.misses, 4)
+
+    def test_token_buffer(self):
+        tokens = make_tokens('x * ( x + x )'.split())
+        for engine in ENGINES + ['reference']:
+            new_parser = with_engine(ExpressionParser, engine)
+            self.assertEqual(
+                new_parser().parse(TokenBuffer(tokens)),
+                new_parser().parse(tokens)
+                )
+
+    def test_random_grammars(self):
+        """
+        The Earley engine accepts exactly what brute force says the
+        grammar derives, and builds the same trees as the reference.
+
+        Trees are only compared where there is just one. The reference
+        engine can reject inputs using rules deriving the empty string,
+        and choose a different tree among several using them.
+        """
+        rnd = random.Random(9)
+        for trial in range(300):
+            grammar = random_grammar(rnd)
+            parser = parser_class(grammar)
+            for k in range(4):
+                types = random_types(rnd)
+                tokens = make_tokens(types)
+                result = parse_result(parser, 'earley', tokens)
+                accepted = result[:1] != ('error',)
+                self.assertEqual(accepted, accepts(grammar, types))
+                if not accepted or derivations(grammar, types) != 1:
+                    continue
+                expected = parse_result(parser, 'reference', tokens)
+                if expected[:1] != ('error',):
+                    self.assertEqual(result, expected)
+
+    def test_random_lalr_grammars(self):
+        """
+        Where the 'auto' engine uses the LALR(1) tables, it gives the
+        same results and syntax errors as the Earley engine.
+        """
+        rnd = random.Random(11)
+        lalr = 0
+        for trial in range(300):
+            parser = parser_class(random_grammar(rnd, 'SAB', 'abc'))
+            if with_engine(parser, 'auto')().active_engine != 'lalr':
+                continue
+            lalr += 1
+            for k in range(10):
+                tokens = make_tokens(random_types(rnd, 'abc', 6))
+                self.assertEqual(
+                    parse_result(parser, 'auto', tokens),
+                    parse_result(parser, 'earley', tokens)
+                    )
+        self.assertTrue(lalr > 20)
+
+class IncrementalTest(unittest.TestCase):
+    def test_random_edits(self):
+        """
+        Reparsing after an edit gives what parsing from scratch does.
+        """
+        rnd = random.Random(4)
+        for trial in range(150):
+            grammar = random_grammar(rnd)
+            parser = with_engine(parser_class(grammar), 'earley')
+            if parser()._get_grammar().cyclic:
+                continue
+            incremental = parser()
+            incremental.incremental = True
+            types = random_types(rnd, most=8)
+            tokens = make_tokens(types)
+            try:
+                incremental.parse(tokens)
+            except SparkleSyntaxError:
+                pass
+            for edit in range(8):
+                start = rnd.randint(0, len(tokens))
+                old_end = rnd.randint(start, min(len(tokens), start + 3))
+                inserted = make_tokens(random_types(rnd, most=3))
+                tokens = tokens[:start] + inserted + tokens[old_end:]
+                try:
+                    result = incremental.reparse(
+                        tokens, start, old_end, start + len(inserted)
+                        )
+                except SparkleSyntaxError, e:
+                    result = 'error', e.position
+                self.assertEqual(
+                    result, parse_result(parser, 'earley', tokens)
+                    )
+
+    def test_auto_engine(self):
+        """
+        An incremental parser with the 'auto' engine uses the Earley
+        engine, even for an LALR(1) grammar, so it can reparse without
+        starting from scratch.
+        """
+        parser = with_engine(ExpressionParser, 'auto')()
+        self.assertEqual(parser.active_engine, 'lalr')
+        parser.incremental = True
+        self.assertEqual(parser.active_engine, 'earley')
+        tokens = make_tokens('x * ( x + x )'.split())
+        parser.parse(tokens)
+        recognizer = parser._previous[0]
+        tokens[2:2] = make_tokens('x - '.split())
+        self.assertEqual(
+            parser.reparse(tokens, 2, 2, 4),
+            ('-', ('*', 'x', 'x'), ('+', 'x', 'x'))
+            )
+        self.assertTrue(parser._previous[0] is recognizer)
+
+class LargeInputTest(unittest.TestCase):
+    def test_right_recursion(self):
+        """
+        With Leo's optimisation, right recursion keeps the Earley sets
+        the same size however long the list.
+        """
+        parser = with_engine(RightListParser, 'earley')()
+        stats = Stats()
+        parser.set_stats(stats)
+        self.assertEqual(parser.parse(make_tokens(['x', ';'] * 5000)), 5000)
+        self.assertTrue(max(stats.set_sizes) < 20)
+
+    def test_deep_nesting(self):
+        """
+        Trees are built without recursion, so deep inputs are fine.
+        """
+        depth = 20000
+        tokens = make_tokens(['('] * depth + ['x'] + [')'] * depth)
+        for engine in ENGINES:
+            parser = with_engine(ExpressionParser, engine)()
+            self.assertEqual(parser.parse(tokens), 'x')
+
+class ForestTest(unittest.TestCase):
+    def test_ambiguous_trees(self):
+        parser = with_engine(AmbiguousParser, 'earley')()
+        forest = parser.parse_forest(make_tokens('x + x * x'.split()))
+        self.assertEqual(forest.count(), 2)
+        self.assertEqual(sorted(forest.trees()), [
+                ('*', ('+', 'x', 'x'), 'x'),
+                ('+', 'x', ('*', 'x', 'x')),
+                ])
+        # The trees of n operators are counted by the Catalan numbers.
+        for n, expected in enumerate([1, 1, 2, 5, 14, 42, 132, 429]):
+            tokens = make_tokens(' + '.join(['x'] * (n + 1)).split())
+            self.assertEqual(parser.parse_forest(tokens).count(), expected)
+
+    def test_best(self):
+        grammar = {'S': [('A', 'b'), ('a', 'B')], 'A': [('a',)],
+                   'B': [('b',)]}
+        forest = parser_class(grammar)().parse_forest(make_tokens('ab'))
+        self.assertEqual(sorted(forest.trees()), [
+                ('S0', ('A0', 'a'), 'b'), ('S1', 'a', ('B0', 'b')),
+                ])
+        for favourite, expected in [
+                (('A', ('a',)), ('S0', ('A0', 'a'), 'b')),
+                (('B', ('b',)), ('S1', 'a', ('B0', 'b'))),
+                ]:
+            self.assertEqual(
+                forest.best(lambda rule: int(rule == favourite)), expected
+                )
+
+    def test_random_counts(self):
+        """
+        The forest has as many trees as brute force counts.
+        """
+        rnd = random.Random(5)
+        for trial in range(300):
+            grammar = random_grammar(rnd)
+            parser = with_engine(parser_class(grammar), 'earley')
+            for k in range(3):
+                types = random_types(rnd, most=4)
+                try:
+                    forest = parser().parse_forest(make_tokens(types))
+                except SparkleSyntaxError:
+                    continue
+                expected = derivations(grammar, types)
+                if expected is None:
+                    continue
+                self.assertEqual(forest.count(), expected)
+                # In cyclic grammars, trees() leaves out the trees
+                # nesting a nonterminal deeper than it needs to be.
+                if expected <= 100 and \
+                        not parser()._get_grammar().cyclic:
+                    trees = list(forest.trees())
+                    self.assertEqual(len(trees), expected)
+
+    def test_random_best(self):
+        """
+        best gives the first of the trees with the highest score.
+        """
+        rnd = random.Random(8)
+        for trial in range(300):
+            grammar = random_grammar(rnd)
+            parser = with_engine(parser_class(grammar), 'earley')
+            if parser()._get_grammar().cyclic:
+                continue
+            scores = {}
+            for lhs, alternatives in grammar.items():
+                for index, rhs in enumerate(alternatives):
+                    scores[lhs + str(index)] = scores[lhs, rhs] = \
+                        rnd.randint(-2, 3)
+            for k in range(3):
+                types = random_types(rnd, most=4)
+                try:
+                    forest = parser().parse_forest(make_tokens(types))
+                except SparkleSyntaxError:
+                    continue
+                if forest.count() > 100:
+                    continue
+                trees = list(forest.trees())
+                expected = max(trees, key=lambda tree: _score(tree, scores))
+                self.assertEqual(forest.best(scores.get), expected)
+
+class StreamTest(unittest.TestCase):
+    def test_random_records(self):
+        """
+        Streaming records gives what parsing them all at once does.
+        """
+        stream_parser = with_engine(RecordParser, 'earley')
+        whole_parser = with_engine(RecordsParser, 'earley')
+        rnd = random.Random(3)
+        for trial in range(100):
+            types = []
+            for k in range(rnd.randint(1, 6)):
+                types.extend(_record(rnd))
+            if trial % 5 == 0:
+                types.insert(rnd.randint(0, len(types)), rnd.choice('x;{'))
+            tokens = make_tokens(types)
+            try:
+                expected = whole_parser().parse(tokens)
+            except SparkleSyntaxError, e:
+                expected = 'error', e.position
+            try:
+                result = list(stream_parser().parse_stream(iter(tokens)))
+            except SparkleSyntaxError, e:
+                result = 'error', e.position
+            self.assertEqual(result, expected)
+
+    def test_settles_early(self):
+        """
+        A match is settled as soon as the token after it can't carry on
+        any longer one, so results come out as the tokens are read.
+        """
+        new_parser = with_engine(OptionalParser, 'earley')
+        read = []
+
+        def tokens():
+            for i in range(5000):
+                read.append(i)
+                yield Token('x', 'x', i)
+
+        for count, result in enumerate(new_parser().parse_stream(tokens())):
+            self.assertEqual(result, 1)
+            self.assertTrue(len(read) <= count + 2)
+        self.assertEqual(count, 4999)
+        self.assertEqual(list(new_parser().parse_stream(
+                    iter(make_tokens('x x y x y x'.split()))
+                    )), [1, 2, 2, 1])
+
+class SlicedTest(unittest.TestCase):
+    def test_sliced_parse(self):
+        """
+        The tokens are recognised a slice of slice_size tokens at a
+        time, and the result is then built in slices.
+        """
+        tokens = make_tokens(['x', ';'] * 500)
+        for engine in ENGINES:
+            parser = with_engine(RightListParser, engine)()
+            job = parser.parse_sliced(tokens, slice_size=50)
+            positions = list(job)
+            self.assertEqual(positions[:20], range(50, 1001, 50))
+            self.assertEqual(set(positions[20:]), set([1000]))
+            self.assertTrue(job.done)
+            self.assertEqual(job.result, 500)
+
+    def test_sliced_build(self):
+        """
+        The rule functions are called a slice at a time too, once the
+        tokens are recognised.
+        """
+        calls = []
+
+        class CountingParser(RightListParser):
+            @rule('item ::= x ;')
+            def p_item(self, args):
+                calls.append(None)
+
+        tokens = make_tokens(['x', ';'] * 500)
+        for engine in ENGINES:
+            del calls[:]
+            parser = with_engine(CountingParser, engine)()
+            if engine == 'auto':
+                self.assertEqual(parser.active_engine, 'lalr')
+            job = parser.parse_sliced(tokens, slice_size=50)
+            built = [len(calls) for position in job if position == 1000]
+            self.assertTrue(len(built) >= 10)
+            self.assertTrue(built[0] < 500)
+            self.assertEqual(job.result, 500)
+
+    def test_time_budget(self):
+        """
+        With a time budget, the time is checked every few tokens.
+        """
+        tokens = make_tokens(['x', ';'] * 500)
+        for engine in ENGINES:
+            parser = with_engine(RightListParser, engine)()
+            job = parser.parse_sliced(tokens, slice_size=1000, time_budget=0)
+            positions = list(job)
+            self.assertTrue(job.check_interval <= 16)
+            self.assertEqual(
+                positions[:10], range(job.check_interval, 1000,
+                                      job.check_interval)[:10]
+                )
+            self.assertEqual(job.result, 500)
+
+    def test_timeout(self):
+        tokens = make_tokens(['x', ';'] * 500)
+        for engine in ENGINES:
+            parser = with_engine(RightListParser, engine)()
+            job = parser.parse_sliced(tokens, deadline=time.time() - 1)
+            try:
+                job.run()
+            except SparkleTimeoutError, e:
+                self.assertEqual(e.position, job.check_interval)
+            else:
+                self.fail("No timeout for %s." % engine)
+            self.assertFalse(job.done)
+            self.assertEqual(job.result, None)
+            self.assertEqual(list(job), [])
+
+    def test_cancel(self):
+        tokens = make_tokens(['x', ';'] * 500)
+        for engine in ENGINES:
+            parser = with_engine(RightListParser, engine)()
+            job = parser.parse_sliced(tokens, slice_size=50)
+            slices = iter(job)
+            self.assertEqual(slices.next(), 50)
+            job.cancel()
+            self.assertEqual(list(slices), [])
+            self.assertEqual(list(job), [])
+            self.assertFalse(job.done)
+            self.assertEqual(parser.parse(tokens), 500)
+
+    def test_reference_deadline(self):
+        """
+        The 'reference' engine parses in one go, so can't be given a
+        deadline.
+        """
+        parser = with_engine(RightListParser, 'reference')()
+        tokens = make_tokens(['x', ';'] * 5)
+        self.assertRaises(
+            ValueError, parser.parse_sliced, tokens,
+            deadline=time.time() + 60
+            )
+        self.assertEqual(parser.parse_sliced(tokens, slice_size=2).run(), 5)
+
+# ..........................................................................
+# Internal functions
+
+def _record(rnd, depth=0):
+    """
+    Returns the token types of a random record for RecordParser.
+    """
+    if depth < 2 and rnd.random() < 0.2:
+        types = ['x', '{']
+        for k in range(rnd.randint(0, 3)):
+            types.extend(_record(rnd, depth + 1))
+        return types + ['}']
+    types = ['x', '=', '1']
+    for k in range(rnd.randint(0, 3)):
+        types.extend(['+', '1'])
+    return types + [';']
+
+def _score(tree, scores):
+    """
+    Returns the total score of the rules used in a tree built by a
+    harness.parser_class parser.
+    """
+    if not isinstance(tree, tuple):
+        return 0
+    return scores[tree[0]] + sum([_score(e, scores) for e in tree[1:]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,659 @@
+import re
+import mmap
+import pickle
+import time
+import bisect
+import random
+import tempfile
+import unittest
+from StringIO import StringIO
+from sparkle import *
+from sparkle.dfa import DFA
+from sparkle.tables import TableCache, ResultCache
+from sparkle.matchers import *
+from sparkle.instrument import Stats
+from harness import *
+
+class ExpressionScanner(TokenizingScanner):
+    """
+    Names, numbers, operators and strings, with a state for the
+    inside of strings.
+    """
+    @rule(r'\s+')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\d+(\.\d+)?')
+    @token('NUMBER')
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'[-+*/()=<>]=?')
+    def t_operator(self, token, string, position):
+        self.tokens.append(Token(token, token, position))
+
+    @rule(r'[a-zA-Z_]\w*')
+    @generate_token('NAME')
+    def t_name(self, token, string, position):
+        return token
+
+    @rule(r'"')
+    def t_quote(self, token, string, position):
+        self.state = 'string'
+
+    @rule(r'[^"\\]+|\\.', 'string')
+    @generate_token('STRING')
+    def t_string_text(self, token, string, position):
+        return token
+
+    @rule(r'"', 'string')
+    def t_end_quote(self, token, string, position):
+        self.state = None
+
+class IncrementalScanner(ExpressionScanner):
+    incremental = True
+
+class ShiftScanner(TokenizingScanner):
+    """
+    A scanner where an edit can change a match that ended two
+    characters before it.
+    """
+    incremental = True
+
+    @rule(r'<<=')
+    @token('SHL_EQ')
+    def t_shift_assign(self, token, string, position):
+        pass
+
+    @rule(r'<')
+    @token('LT')
+    def t_less(self, token, string, position):
+        pass
+
+    @rule(r'[a-z=]')
+    @token('X')
+    def t_x(self, token, string, position):
+        pass
+
+class LookaroundScanner(TokenizingScanner):
+    """
+    A scanner whose rules look before and after their matches.
+    """
+    incremental = True
+
+    @rule(r'(?<=a)b')
+    @token('AB')
+    def t_after_a(self, token, string, position):
+        pass
+
+    @rule(r'[ab](?=c)')
+    @token('XC')
+    def t_before_c(self, token, string, position):
+        pass
+
+    @rule(r'\bc')
+    @token('C')
+    def t_word_c(self, token, string, position):
+        pass
+
+    @rule(r'[abc ]')
+    @token('X')
+    def t_char(self, token, string, position):
+        pass
+
+class WordScanner(TokenizingScanner):
+    """
+    A scanner with a rule using an inline flag, which mustn't change
+    how the other rules match.
+    """
+    @rule(r'[^\W\d]+')
+    @token('ASCII')
+    def t_ascii(self, token, string, position):
+        pass
+
+    @rule(r'(?u)\w+')
+    @token('UNI')
+    def t_unicode(self, token, string, position):
+        pass
+
+    @rule(r'\s')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+class DeclaredByteScanner(TokenizingScanner):
+    @rule(r'\s+')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\d+')
+    @token('NUMBER', int)
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'[a-z]+')
+    @token('WORD')
+    def t_word(self, token, string, position):
+        pass
+
+def _inline_only(token_type, convert=None):
+    """
+    Like decorators.token (or decorators.skip, given None), but the
+    rule fails if it is called rather than carried out by the scanner.
+    """
+    def _decorator(function):
+        def _wraps(self, text, string, position):
+            raise AssertionError('%s was called.' % function.__name__)
+        _wraps.inline_token = token_type, convert
+        return _wraps
+    return _decorator
+
+class InlineScanner(TokenizingScanner):
+    @rule(r'\s+')
+    @_inline_only(None)
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\d+')
+    @_inline_only('NUMBER', int)
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'[a-z]+')
+    @_inline_only('WORD')
+    def t_word(self, token, string, position):
+        pass
+
+    @rule(r'"[^"]*"')
+    @_inline_only('STRING')
+    def t_string(self, token, string, position):
+        pass
+
+class ByteScanner(TokenizingScanner):
+    @rule(r'\s+')
+    @skip
+    def t_whitespace(self, token, string, position):
+        pass
+
+    @rule(r'\d+')
+    @generate_lazy_token('NUMBER', 'utf-8')
+    def t_number(self, token, string, position):
+        pass
+
+    @rule(r'[a-z\x80-\xff]+')
+    @generate_lazy_token('WORD', 'utf-8')
+    def t_word(self, token, string, position):
+        pass
+
+ENGINES = ['combined', 'dfa', 'dispatch']
+
+PATTERNS = [
+    r'in|init', r'[a-z_]\w*', r'\d+(\.\d+)?', r'"([^"\\]|\\.)*"', r'a*?b',
+    r'(ab|a)(bc|c)?', r'[^\s]{2,4}', r'x{0,3}y', r'\s+', r'.', r'(a|b)*abb',
+    r'[\S]+', r'\D\W?', r'(?i)IN', r'(a)\1', r'\bx', r'(?=a)\w+', r'(?!a)\w',
+    r'a?b?c?', r'(?s).', r'(x|)n', r'(?<=a)b', r'[^a-c]+', r'y*', r'ab',
+    r'a', r'[ab]{1,2}', r'\n', r'[^\W\d]+', r'(?u)\w+',
+    ]
+
+ALPHABET = u'abcinxyIN_09. "\\\n\t\xe9'
+
+SOURCE_ALPHABET = 'ab1 .2+=<"\\\n'
+
+PIECES = [
+    'foo', '12', ' 3.5', '+', '"a b c"', '"x\\"y"', 'x1', '(', ')', ' ',
+    '\n', '<=', '"a longer string ' + 'z' * 50 + '"',
+    ]
+
+class MatcherTest(unittest.TestCase):
+    """
+    Checks the matchers against ReferenceMatcher, on random sets of
+    rules.
+    """
+    def test_random_rules(self):
+        rnd = random.Random(7)
+        for trial in range(200):
+            rules = _random_rules(rnd)
+            reference = ReferenceMatcher(rules)
+            matchers = [CombinedMatcher(rules), DispatchMatcher(rules)]
+            decider = RuleDecider(rules)
+            for k in range(10):
+                text = random_text(rnd, ALPHABET, 10)
+                # Byte buffers are only checked with ASCII text.
+                data = None
+                if text == text.encode('ascii', 'ignore'):
+                    data = bytearray(str(text))
+                for pos in range(len(text)):
+                    expected = reference.match(text, pos)
+                    for matcher in matchers:
+                        self.assertEqual(matcher.match(text, pos), expected)
+                    if data is not None:
+                        self.assertEqual(
+                            matchers[1].match(data, pos), expected
+                            )
+                    index = decider.decide(text[pos])
+                    if index is not None:
+                        fn, regex = rules[index]
+                        match = regex.match(text, pos)
+                        if match is not None:
+                            self.assertEqual((fn, match.end()), expected)
+
+    def test_deciders(self):
+        """
+        Only the engines with the regex engine's semantics, other than
+        the 'reference' engine, skip the matcher with a RuleDecider.
+        """
+        rules = _random_rules(random.Random(5))
+        self.assertEqual(make_decider('reference', rules), None)
+        self.assertEqual(make_decider('dfa', rules), None)
+        for engine in ['combined', 'dispatch']:
+            decider = make_decider(engine, rules)
+            self.assertTrue(isinstance(decider, RuleDecider))
+
+    def test_dfa_longest_match(self):
+        """
+        A DFA finds the POSIX longest match of its pattern.
+        """
+        rnd = random.Random(3)
+        for pattern in PATTERNS[:13]:
+            dfa = DFA([pattern])
+            for trial in range(300):
+                text = random_text(rnd, ALPHABET, 8)
+                self.assertEqual(
+                    _dfa_match(dfa, text), longest_match(pattern, text)
+                    )
+
+class ScannerTest(unittest.TestCase):
+    def test_engines(self):
+        """
+        Each engine gives the tokens the 'reference' engine does.
+        """
+        rnd = random.Random(1)
+        for trial in range(100):
+            text = ''.join([
+                    rnd.choice(PIECES) for k in range(rnd.randint(0, 40))
+                    ])
+            expected = _tokenize(ExpressionScanner, 'reference', text)
+            for engine in ENGINES:
+                self.assertEqual(
+                    _tokenize(ExpressionScanner, engine, text), expected
+                    )
+
+    def test_inline_flags(self):
+        text = u'\xe9t\xe9 t\xe9 abc'
+        expected = [
+            ('UNI', u'\xe9t\xe9', 0), ('UNI', u't\xe9', 4),
+            ('ASCII', u'abc', 7),
+            ]
+        for engine in ENGINES + ['reference']:
+            self.assertEqual(_tokenize(WordScanner, engine, text), expected)
+
+    def test_stream(self):
+        """
+        Streaming gives the tokens tokenize does, at any chunk size at
+        least as long as the longest token that isn't found a piece at a
+        time (such as '3.5').
+        """
+        rnd = random.Random(2)
+        text = ''.join([rnd.choice(PIECES) for k in range(300)])
+        for engine in ENGINES + ['reference']:
+            expected = _tokenize(ExpressionScanner, engine, text)
+            for chunk_size in [3, 4, 8, 64, 100000]:
+                scanner = with_engine(ExpressionScanner, engine)()
+                self.assertEqual(signature(scanner.tokenize_stream(
+                            StringIO(text), chunk_size=chunk_size
+                            )), expected)
+                chunks = [text[i:i + 7] for i in range(0, len(text), 7)]
+                self.assertEqual(signature(scanner.tokenize_stream(
+                            chunks, chunk_size=chunk_size
+                            )), expected)
+
+    def test_stream_inline_rules(self):
+        """
+        Streaming carries out token and skip rules itself, as tokenize
+        does, rather than calling them, including words and numbers
+        longer than a chunk.
+        """
+        text = 'ab 12 "x y z" 34567890123 cd "a b" efghijklmn 6'
+        for engine in ENGINES + ['reference']:
+            scanner_class = with_engine(InlineScanner, engine)
+            expected = signature(scanner_class().tokenize(text))
+            self.assertEqual(expected[:3], [
+                    ('WORD', 'ab', 0), ('NUMBER', 12, 3),
+                    ('STRING', '"x y z"', 6),
+                    ])
+            for chunk_size in [7, 8, 100]:
+                self.assertEqual(signature(scanner_class().tokenize_stream(
+                            StringIO(text), chunk_size=chunk_size
+                            )), expected)
+
+    def test_lexical_error(self):
+        for engine in ENGINES + ['reference']:
+            try:
+                with_engine(ExpressionScanner, engine)().tokenize('x + $')
+            except SparkleError, e:
+                self.assertEqual(e.position, 4)
+            else:
+                self.fail("No error for %s." % engine)
+
+    def test_table_cache(self):
+        """
+        Another scanner with the same rules gets the tables compiled for
+        the first from the cache.
+        """
+        cache = TableCache()
+        scanner_class = type('CachedScanner', (ExpressionScanner,), {
+                'engine': 'dfa', 'table_cache': cache,
+                })
+        first = scanner_class()._tables.tables
+        self.assertTrue(first)
+        count = len(cache.tables)
+        second = scanner_class()._tables.tables
+        self.assertEqual(len(cache.tables), count)
+        self.assertEqual(sorted(second), sorted(first))
+        for key, table in first.items():
+            self.assertTrue(second[key] is table)
+
+    def test_result_cache(self):
+        """
+        A string tokenized again gets its tokens from the result cache,
+        unless the rules have changed.
+        """
+        cache = ResultCache()
+        scanner_class = type('CachedScanner', (ExpressionScanner,), {
+                'result_cache': cache,
+                })
+        text = 'x = "a b" + 12'
+        expected = _tokenize(ExpressionScanner, 'combined', text)
+        scanner = scanner_class()
+        first = scanner.tokenize(text)
+        self.assertEqual(
+            signature(scanner.tokenize(text, tokens=TokenBuffer())),
+            signature(first)
+            )
+        self.assertEqual(signature(scanner_class().tokenize(text)), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        scanner.tokenize(text + ' ')
+        scanner.tokenize(text, 'string')
+        self.assertEqual(cache.misses, 3)
+
+        # A class of the same name with other rules doesn't share them.
+        @rule(r'\d+')
+        @token('INT')
+        def t_number(self, token, string, position):
+            pass
+
+        other_class = type('CachedScanner', (ExpressionScanner,), {
+                'result_cache': cache, 't_number': t_number,
+                })
+        tokens = other_class().tokenize(text)
+        self.assertEqual(tokens[-1].token_type, 'INT')
+        self.assertEqual(cache.misses, 4)
+
+    def test_token_buffer(self):
+        text = 'x = "a b" + 12 * (y - 3.5)'
+        for engine in ENGINES + ['reference']:
+            scanner = with_engine(ExpressionScanner, engine)()
+            tokens = scanner.tokenize(text, tokens=TokenBuffer())
+            self.assertTrue(isinstance(tokens, TokenBuffer))
+            self.assertEqual(
+                signature(tokens), _tokenize(ExpressionScanner, engine, text)
+                )
+
+    def test_parallel(self):
+        """
+        Scanning in worker processes gives the tokens tokenize does,
+        into a list or a TokenBuffer.
+        """
+        rnd = random.Random(7)
+        for trial in range(5):
+            text = ''.join([
+                    rnd.choice(PIECES) for k in range(rnd.randint(0, 400))
+                    ])
+            expected = _tokenize(ExpressionScanner, 'combined', text)
+            for chunk_size, overlap in [(7, 3), (50, 10), (13, 2)]:
+                output = [[], TokenBuffer()][chunk_size % 2]
+                tokens = ExpressionScanner().tokenize_parallel(
+                    text, tokens=output, chunk_size=chunk_size,
+                    overlap=overlap, workers=2
+                    )
+                self.assertTrue(tokens is output)
+                self.assertEqual(signature(tokens), expected)
+
+    def test_sliced(self):
+        """
+        The string is tokenized a slice of slice_size matches at a time.
+        """
+        text = 'x + 12 * "a b" ' * 200
+        for engine in ENGINES + ['reference']:
+            scanner = with_engine(ExpressionScanner, engine)()
+            job = scanner.tokenize_sliced(text, slice_size=100)
+            positions = list(job)
+            # The text repeats 12 matches in 15 characters, so the first
+            # 100 matches are 8 repeats and x + (with the spaces).
+            self.assertEqual(positions[:2], [124, 249])
+            self.assertEqual(len(positions), 24)
+            self.assertEqual(positions[-1], len(text))
+            self.assertEqual(
+                signature(job.result),
+                _tokenize(ExpressionScanner, engine, text)
+                )
+
+    def test_sliced_timeout(self):
+        text = 'x + 12 * "a b" ' * 200
+        for engine in ENGINES + ['reference']:
+            scanner = with_engine(ExpressionScanner, engine)()
+            job = scanner.tokenize_sliced(text, deadline=time.time() - 1)
+            self.assertRaises(SparkleTimeoutError, job.run)
+            self.assertFalse(job.done)
+
+            job = scanner.tokenize_sliced(text, slice_size=100)
+            slices = iter(job)
+            self.assertEqual(slices.next(), 124)
+            job.cancel()
+            self.assertEqual(list(slices), [])
+            self.assertEqual(job.result, None)
+
+    def test_stats(self):
+        """
+        Instrumented scanners count the calls to their matchers, the
+        rules the matchers try, and the matches each rule wins.
+        """
+        tried = {}
+        for engine in ENGINES + ['reference']:
+            scanner = with_engine(ExpressionScanner, engine)()
+            stats = Stats()
+            scanner.set_stats(stats)
+            self.assertEqual(
+                signature(scanner.tokenize('12 + x')),
+                _tokenize(ExpressionScanner, engine, '12 + x')
+                )
+            calls = stats.match_calls[None]
+            self.assertEqual(calls.count, 5)
+            tried[engine] = attempts = dict([
+                    (name, counter.count)
+                    for name, counter in stats.rule_attempts.items()
+                    ])
+            self.assertEqual(attempts['t_end_quote'], 0)
+            for name, counter in stats.rule_hits.items():
+                self.assertTrue(attempts[name] >= counter.count)
+            self.assertEqual(stats.rule_hits['t_number'].count, 1)
+            self.assertAlmostEqual(sum([
+                        counter.time
+                        for counter in stats.rule_attempts.values()
+                        ]), calls.time)
+            self.assertTrue('attempts' in stats.summary())
+
+        # The reference engine tries every rule, and the DFA runs them
+        # all at once. The combined engine passes over t_default once
+        # t_whitespace has matched a space.
+        self.assertEqual(tried['reference']['t_default'], 5)
+        self.assertEqual(tried['dfa']['t_default'], 5)
+        self.assertEqual(tried['combined']['t_name'], 5)
+        self.assertEqual(tried['combined']['t_default'], 3)
+        # The dispatch engine only tries the rules that can start with
+        # each character.
+        self.assertEqual(tried['dispatch']['t_quote'], 0)
+        self.assertEqual(tried['dispatch']['t_whitespace'], 2)
+
+    def test_byte_buffers(self):
+        """
+        Byte buffers are scanned in place into lazy tokens.
+        """
+        data = u'hello w\xf6rld 123 abc'.encode('utf-8')
+        expected = [
+            ('WORD', u'hello', 0), ('WORD', u'w\xf6rld', 6),
+            ('NUMBER', u'123', 13), ('WORD', u'abc', 17),
+            ]
+        source = tempfile.TemporaryFile()
+        source.write(data)
+        source.flush()
+        mapped = mmap.mmap(source.fileno(), 0)
+        try:
+            for engine in ENGINES + ['reference']:
+                scanner_class = with_engine(ByteScanner, engine)
+                for buffer in [mapped, bytearray(data)]:
+                    tokens = scanner_class().tokenize(buffer)
+                    self.assertEqual(signature(tokens), expected)
+                    self.assertEqual(tokens[1].end, 12)
+        finally:
+            mapped.close()
+            source.close()
+
+    def test_byte_buffer_token_rules(self):
+        """
+        Token rules without a conversion make lazy tokens on byte
+        buffers, rather than tokens holding views of the buffer.
+        """
+        data = bytearray('abc 12 de')
+        for engine in ENGINES + ['reference']:
+            scanner = with_engine(DeclaredByteScanner, engine)()
+            tokens = scanner.tokenize(data)
+            self.assertTrue(isinstance(tokens[0], LazyToken))
+            copies = pickle.loads(pickle.dumps(tokens, 2))
+            for values in [tokens, copies]:
+                self.assertEqual(
+                    [token.value for token in values], ['abc', 12, 'de']
+                    )
+
+class IncrementalTest(unittest.TestCase):
+    def test_random_edits(self):
+        """
+        Tokenizing again after an edit gives what tokenizing from
+        scratch does, in the same list or TokenBuffer, and the range of
+        tokens changed is right.
+        """
+        for engine in ENGINES + ['reference']:
+            scanner_class = with_engine(IncrementalScanner, engine)
+            rnd = random.Random(3)
+            for trial in range(50):
+                text = random_text(rnd, SOURCE_ALPHABET, 40)
+                scanner = scanner_class()
+                output = [[], TokenBuffer()][trial % 2]
+                try:
+                    scanner.tokenize(text, tokens=output)
+                except SparkleError:
+                    continue
+                for edit in range(10):
+                    start = rnd.randint(0, len(text))
+                    old_end = rnd.randint(start, min(len(text), start + 4))
+                    inserted = random_text(rnd, SOURCE_ALPHABET, 4)
+                    text = text[:start] + inserted + text[old_end:]
+                    before = signature(scanner.tokens)
+                    try:
+                        tokens, changed = scanner.retokenize(
+                            text, start, old_end, start + len(inserted)
+                            )
+                    except SparkleError:
+                        break
+                    self.assertTrue(tokens is output)
+                    tokens = signature(tokens)
+                    self.assertEqual(
+                        tokens, _tokenize(ExpressionScanner, engine, text)
+                        )
+                    first, old_mark, new_mark = changed
+                    delta = len(inserted) - (old_end - start)
+                    self.assertEqual(before[:first], tokens[:first])
+                    self.assertEqual([
+                            (token_type, value, position + delta)
+                            for token_type, value, position
+                            in before[old_mark:]
+                            ], tokens[new_mark:])
+
+    def test_match_before_edit(self):
+        """
+        A match ending before the edit is scanned again if one of the
+        rules could have seen the edited text.
+        """
+        for engine in ENGINES + ['reference']:
+            scanner = with_engine(ShiftScanner, engine)()
+            scanner.tokenize('<<x')
+            tokens, changed = scanner.retokenize('<<=', 2, 3, 3)
+            self.assertEqual(signature(tokens), [('SHL_EQ', '<<=', 0)])
+            self.assertEqual(changed, (0, 3, 1))
+
+    def test_random_lookaround_edits(self):
+        for engine in ENGINES + ['reference']:
+            scanner_class = with_engine(LookaroundScanner, engine)
+            rnd = random.Random(6)
+            for trial in range(30):
+                text = random_text(rnd, 'abc ', 20)
+                scanner = scanner_class()
+                scanner.tokenize(text)
+                for edit in range(10):
+                    start = rnd.randint(0, len(text))
+                    old_end = rnd.randint(start, min(len(text), start + 3))
+                    inserted = random_text(rnd, 'abc ', 3)
+                    text = text[:start] + inserted + text[old_end:]
+                    tokens, changed = scanner.retokenize(
+                        text, start, old_end, start + len(inserted)
+                        )
+                    self.assertEqual(
+                        signature(tokens),
+                        _tokenize(LookaroundScanner, engine, text)
+                        )
+
+# ..........................................................................
+# Internal functions
+
+def _random_rules(rnd):
+    """
+    Returns some of the PATTERNS as rules, with a final rule matching
+    any character.
+    """
+    patterns = rnd.sample(PATTERNS, rnd.randint(1, 8))
+    rules = [(i, re.compile(pattern)) for i, pattern in enumerate(patterns)]
+    rules.append((99, re.compile(r'(.|\n)')))
+    return rules
+
+def _dfa_match(dfa, text):
+    """
+    Runs the DFA over the text, and returns the length of the longest
+    match, or -1.
+    """
+    state = 0
+    found = -1
+    if dfa.accept[0] >= 0:
+        found = 0
+    for i, c in enumerate(text):
+        column = bisect.bisect_right(dfa.boundaries, ord(c)) - 1
+        state = dfa.transitions[state][column]
+        if state < 0:
+            break
+        if dfa.accept[state] >= 0:
+            found = i + 1
+    return found
+
+def _tokenize(scanner_class, engine, text):
+    """
+    Tokenizes the text with a new scanner of the class using the given
+    engine, and returns the signature of the tokens, or 'error'.
+    """
+    try:
+        return signature(with_engine(scanner_class, engine)().tokenize(text))
+    except SparkleError:
+        return 'error'
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sparkle.tables import *
+
+class TableCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory(self):
+        cache = TableCache()
+        table = cache.get('kind', ('a', 'b'), self._build)
+        self.assertTrue(cache.get('kind', ('a', 'b'), self._build) is table)
+        self.assertEqual(len(self.builds), 1)
+        cache.get('kind', ('a', 'c'), self._build)
+        cache.get('other', ('a', 'b'), self._build)
+        self.assertEqual(len(self.builds), 3)
+        cache.clear()
+        cache.get('kind', ('a', 'b'), self._build)
+        self.assertEqual(len(self.builds), 4)
+
+    def test_disk_round_trip(self):
+        table = TableCache(self.directory).get('kind', ('a',), self._build)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        copy = TableCache(self.directory).get('kind', ('a',), self._build)
+        self.assertEqual(copy, table)
+        self.assertEqual(len(self.builds), 1)
+
+    def test_corrupt_files(self):
+        """
+        Corrupt or truncated files are compiled again, and replaced.
+        """
+        for data in ['not a pickle', '', '\x80\x02]q\x01(']:
+            TableCache(self.directory).get('kind', ('a',), self._build)
+            for name in os.listdir(self.directory):
+                with open(os.path.join(self.directory, name), 'wb') as f:
+                    f.write(data)
+            builds = len(self.builds)
+            table = TableCache(self.directory).get(
+                'kind', ('a',), self._build
+                )
+            self.assertEqual(len(self.builds), builds + 1)
+            copy = TableCache(self.directory).get('kind', ('a',), self._build)
+            self.assertEqual(copy, table)
+            self.assertEqual(len(self.builds), builds + 1)
+
+    def test_stale_files(self):
+        """
+        Tables saved for other source data, or in an older format,
+        aren't loaded.
+        """
+        TableCache(self.directory).get('kind', ('a',), self._build)
+        TableCache(self.directory).get('kind', ('b',), self._build)
+        self.assertEqual(len(self.builds), 2)
+
+        class NewCache(TableCache):
+            FORMAT = TableCache.FORMAT + 1
+
+        NewCache(self.directory).get('kind', ('a',), self._build)
+        self.assertEqual(len(self.builds), 3)
+
+    def test_unwritable_directory(self):
+        """
+        Failing to save a table only means compiling it again.
+        """
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        for k in range(2):
+            TableCache(path).get('kind', ('a',), self._build)
+        self.assertEqual(len(self.builds), 2)
+
+    def _build(self):
+        self.builds.append(None)
+        return {'table': len(self.builds)}
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_counts(self):
+        cache = ResultCache()
+        result = cache.get('kind', 'a', self._build('a'))
+        self.assertTrue(cache.get('kind', 'a', self._build('a')) is result)
+        cache.get('kind', 'b', self._build('b'))
+        cache.get('other', 'a', self._build('a'))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual(self.builds, ['a', 'b', 'a'])
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses, cache.evictions),
+                         (0, 0, 0))
+        self.assertEqual(len(cache.results), 0)
+
+    def test_lru_eviction(self):
+        """
+        Once there are too many results, the least recently used are
+        thrown out.
+        """
+        cache = ResultCache(max_entries=3)
+        for source in 'abca':
+            cache.get('kind', source, self._build(source))
+        cache.get('kind', 'd', self._build('d'))
+        self.assertEqual(cache.evictions, 1)
+        for source in 'acd':
+            cache.get('kind', source, self._build(source))
+        self.assertEqual(self.builds, ['a', 'b', 'c', 'd'])
+        cache.get('kind', 'b', self._build('b'))
+        self.assertEqual(self.builds, ['a', 'b', 'c', 'd', 'b'])
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual((cache.hits, cache.misses), (4, 5))
+
+    def test_max_bytes(self):
+        """
+        Results are thrown out once their pickled size passes
+        max_bytes, and results larger than that aren't kept at all.
+        """
+        # Each result pickles to a little over 100 bytes.
+        cache = ResultCache(max_bytes=250)
+        for source in 'abc':
+            cache.get('kind', source, lambda: 'x' * 100)
+        self.assertEqual(len(cache.results), 2)
+        self.assertTrue(200 < cache.total_bytes <= 250)
+        self.assertEqual(cache.evictions, 1)
+        cache.get('kind', 'd', lambda: 'x' * 1000)
+        self.assertEqual(len(cache.results), 2)
+        cache.get('kind', 'd', lambda: 'x' * 1000)
+        self.assertEqual(cache.misses, 5)
+
+    def test_disk(self):
+        """
+        Results are saved to the directory, and found there by other
+        caches, whatever their bounds.
+        """
+        cache = ResultCache(max_entries=1, directory=self.directory)
+        for source in 'ab':
+            cache.get('kind', source, self._build(source))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        other = ResultCache(directory=self.directory)
+        for source in 'ab':
+            self.assertEqual(
+                other.get('kind', source, self._build(source)), [source]
+                )
+        cache.get('kind', 'a', self._build('a'))
+        self.assertEqual(self.builds, ['a', 'b'])
+        self.assertEqual((other.hits, other.misses), (2, 0))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_unpicklable(self):
+        """
+        Results that can't be pickled are kept in memory only.
+        """
+        cache = ResultCache(directory=self.directory)
+        result = cache.get('kind', 'a', lambda: (lambda: None))
+        self.assertTrue(cache.get('kind', 'a', self._build('a')) is result)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def _build(self, source):
+        def build():
+            self.builds.append(source)
+            return [source]
+        return build
+
+if __name__ == '__main__':
+    unittest.main()
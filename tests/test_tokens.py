@@ -0,0 +1,156 @@
+import pickle
+import random
+import unittest
+from sparkle import *
+
+class Number(AST):
+    pass
+
+class Binary(AST):
+    pass
+
+class TokenTest(unittest.TestCase):
+    def test_pickle(self):
+        token = Token('NAME', 'x', 3)
+        copy = pickle.loads(pickle.dumps(token, 2))
+        self.assertEqual(
+            (copy.token_type, copy.value, copy.position), ('NAME', 'x', 3)
+            )
+
+    def test_compare(self):
+        token = Token('NAME', 'x', 3)
+        self.assertEqual(token, 'NAME')
+        self.assertNotEqual(token, 'NUMBER')
+
+    def test_lazy_value(self):
+        data = bytearray(u'w\xf6rld'.encode('utf-8'))
+        token = LazyToken('WORD', buffer(data, 0, len(data)), 4, 'utf-8')
+        self.assertEqual(token.value, u'w\xf6rld')
+        self.assertEqual(token.end, 4 + len(data))
+
+    def test_lazy_pickle(self):
+        data = bytearray(u'w\xf6rld'.encode('utf-8'))
+        token = LazyToken('WORD', buffer(data, 0, len(data)), 4, 'utf-8')
+        copy = pickle.loads(pickle.dumps(token, 2))
+        self.assertEqual(copy.value, u'w\xf6rld')
+        self.assertEqual(copy.end, 4 + len(data))
+        self.assertEqual(copy.encoding, 'utf-8')
+
+class TokenBufferTest(unittest.TestCase):
+    def test_round_trip(self):
+        tokens = [
+            Token('NAME', 'x', 0), Token('=', '=', 2),
+            Token('NUMBER', 12, 4), Token('NAME', 'y', 7),
+            ]
+        buffer = TokenBuffer(tokens)
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(buffer.token_types(), ['NAME', '=', 'NUMBER', 'NAME'])
+        self.assertEqual(buffer.type_names, ['NAME', '=', 'NUMBER'])
+        self.assertEqual(
+            [(t.token_type, t.value, t.position) for t in buffer],
+            [(t.token_type, t.value, t.position) for t in tokens]
+            )
+        self.assertEqual(buffer[1:3][1].value, 12)
+
+    def test_extend_columns(self):
+        tokens = [
+            Token('NAME', 'x', 0), Token('=', '=', 2),
+            Token('NUMBER', 12, 4), Token('NAME', 'y', 7),
+            ]
+        for first in [[], tokens[2:3], tokens[1:2]]:
+            buffer = TokenBuffer(first)
+            buffer.extend_columns(TokenBuffer(tokens), 1, 3)
+            self.assertEqual(
+                [(t.token_type, t.value, t.position) for t in buffer],
+                [(t.token_type, t.value, t.position)
+                 for t in first + tokens[1:3]]
+                )
+
+    def test_shift(self):
+        data = bytearray('abc')
+        lazy = LazyToken('WORD', buffer(data, 1, 2), 1)
+        tokens = TokenBuffer([Token('NAME', 'x', 0), lazy])
+        tokens.shift(10)
+        self.assertEqual([t.position for t in tokens], [10, 11])
+        self.assertEqual(lazy.position, 11)
+
+    def test_delete(self):
+        tokens = [Token('NAME', str(i), i) for i in range(6)]
+        buffer = TokenBuffer(tokens)
+        del buffer[4:]
+        del buffer[1]
+        del tokens[4:]
+        del tokens[1]
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(
+            [(t.value, t.position) for t in buffer],
+            [(t.value, t.position) for t in tokens]
+            )
+
+class ASTArenaTest(unittest.TestCase):
+    def test_random_trees(self):
+        """
+        Trees copied into an arena come back out the same, with the
+        same complexity, and the orders visit every node once.
+        """
+        rnd = random.Random(1)
+        for trial in range(300):
+            tree = _random_tree(rnd, 5)
+            arena = ASTArena()
+            arena.leaf('padding')
+            root = arena.add_ast(tree)
+            self.assertEqual(_shape(arena.to_ast(root)), _shape(tree))
+            copy = pickle.loads(pickle.dumps(arena, 2))
+            self.assertEqual(_shape(copy.to_ast(root)), _shape(tree))
+            if not isinstance(tree, AST):
+                continue
+            self.assertEqual(arena.complexity(root), tree.get_complexity())
+            preorder = list(arena.preorder(root))
+            postorder = list(arena.postorder(root))
+            self.assertEqual(preorder, _preorder(arena, root, []))
+            self.assertEqual(len(preorder), arena.size(root))
+            self.assertEqual(sorted(preorder), sorted(postorder))
+
+    def test_second_parent(self):
+        arena = ASTArena()
+        child = arena.leaf(1)
+        arena.add('one', [child])
+        self.assertRaises(ValueError, arena.add, 'two', [child])
+
+# ..........................................................................
+# Internal functions
+
+def _random_tree(rnd, depth):
+    """
+    Returns a random tree of AST nodes, lists, tuples and leaves.
+    """
+    r = rnd.random()
+    if depth == 0 or r < 0.2:
+        return rnd.choice([Number(rnd.randint(0, 9)), 'x', 5])
+    children = [
+        _random_tree(rnd, depth - 1) for i in range(rnd.randint(0, 3))
+        ]
+    if r < 0.3:
+        return children
+    if r < 0.35:
+        return tuple(children)
+    return rnd.choice([Binary, AST])(*children)
+
+def _shape(tree):
+    """
+    Returns a comparable copy of a tree.
+    """
+    if isinstance(tree, AST):
+        return (tree.__class__,) + tuple([_shape(e) for e in tree.expression])
+    if isinstance(tree, (list, tuple)):
+        return (type(tree), [_shape(e) for e in tree])
+    return tree
+
+def _preorder(arena, index, visited):
+    visited.append(index)
+    for child in arena.children(index):
+        _preorder(arena, child, visited)
+    return visited
+
+if __name__ == '__main__':
+    unittest.main()